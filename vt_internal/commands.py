@@ -0,0 +1,85 @@
+"""Commandes bench de vt_internal.
+
+    bench --site <site> vt-bench-data --scale 5          # jeu de données synthétique
+    bench --site <site> vt-bench-data --purge
+    bench --site <site> vt-benchmark --scales 1,5,20 --output bench.json [--baseline old.json]
+
+Sites de test uniquement (allow_tests ou developer_mode) : les données générées
+sont écrites directement en base.
+"""
+
+import click
+from frappe.commands import get_site, pass_context
+
+
+def _connect(context):
+    import frappe
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    if not (frappe.conf.allow_tests or frappe.conf.developer_mode):
+        frappe.destroy()
+        raise click.ClickException("Réservé aux sites de test (allow_tests ou developer_mode).")
+
+
+@click.command("vt-bench-data")
+@click.option("--scale", type=float, default=1, help="Multiplicateur des volumes (cf. BASE_COUNTS).")
+@click.option("--companies", type=int, default=2)
+@click.option("--seed", type=int, default=42)
+@click.option("--purge", is_flag=True, help="Supprime le jeu de données au lieu de le créer.")
+@pass_context
+def vt_bench_data(context, scale, companies, seed, purge):
+    """Crée (ou supprime) le jeu de données synthétique de mesure."""
+    import frappe
+
+    from vt_internal.vt_internal.utils import synthetic_data
+
+    _connect(context)
+    try:
+        if purge:
+            synthetic_data.purge()
+            click.echo("Jeu de données supprimé.")
+        else:
+            for kind, count in synthetic_data.generate(scale, companies, seed).items():
+                click.echo(f"{kind:20} {count}")
+    finally:
+        frappe.destroy()
+
+
+@click.command("vt-benchmark")
+@click.option("--scales", default="1,5", help="Tailles de jeu de données, ex. 1,5,20.")
+@click.option("--companies", type=int, default=2)
+@click.option("--repeat", type=int, default=3, help="Passages chronométrés par cible.")
+@click.option("--seed", type=int, default=42)
+@click.option("--targets", default=None, help="Cibles à mesurer (noms séparés par des virgules).")
+@click.option("--output", default=None, help="Fichier JSON des résultats.")
+@click.option("--baseline", default=None, help="JSON d'un passage précédent à comparer.")
+@click.option("--keep-data", is_flag=True, help="Garde le dernier jeu de données.")
+@pass_context
+def vt_benchmark(context, scales, companies, repeat, seed, targets, output, baseline, keep_data):
+    """Mesure rapports et API sur des jeux de données de tailles croissantes."""
+    import frappe
+
+    from vt_internal.vt_internal.utils import benchmark
+
+    _connect(context)
+    try:
+        payload = benchmark.run_matrix(
+            scales=[float(s) for s in scales.split(",")],
+            companies=companies,
+            repeat=repeat,
+            seed=seed,
+            targets=targets.split(",") if targets else None,
+            keep_data=keep_data,
+            echo=click.echo,
+        )
+        output = output or f"vt_benchmark_{payload['commit'] or 'local'}.json"
+        benchmark.write(payload, output)
+        click.echo(f"Résultats : {output}")
+        if baseline:
+            benchmark.compare(payload, baseline, echo=click.echo)
+    finally:
+        frappe.destroy()
+
+
+commands = [vt_bench_data, vt_benchmark]
@@ -198,6 +198,10 @@ doc_events = {
 		"before_insert": "vt_internal.vt_internal.events.quotation.before_insert",
 		"before_print": "vt_internal.vt_internal.events.quotation.before_print",
 		"before_update_after_submit": "vt_internal.vt_internal.events.quotation.before_update_after_submit",
+		"on_update": "vt_internal.vt_internal.events.quotation.on_update",
+		"on_update_after_submit": "vt_internal.vt_internal.events.quotation.on_update_after_submit",
+		"on_cancel": "vt_internal.vt_internal.events.quotation.on_cancel",
+		"after_delete": "vt_internal.vt_internal.events.quotation.after_delete",
 	},
 	"Bank Transaction": {
 		"after_insert": "vt_internal.vt_internal.events.bank_transaction.after_insert",
@@ -215,6 +219,7 @@ doc_events = {
 	},
 	"Employee": {
 		"validate": "vt_internal.vt_internal.events.employee.validate",
+		"on_update": "vt_internal.vt_internal.events.employee.on_update",
 	},
 	"Event": {
 		"validate": "vt_internal.vt_internal.events.event.validate",
@@ -225,23 +230,35 @@ doc_events = {
 		"validate": "vt_internal.vt_internal.events.expense.validate",
 		"before_submit": "vt_internal.vt_internal.events.expense.before_submit",
 		"on_submit": "vt_internal.vt_internal.events.expense.on_submit",
+		"on_cancel": "vt_internal.vt_internal.events.expense.on_cancel",
 	},
 	"Fabrication VT": {
 		"on_update": "vt_internal.vt_internal.events.fabrication_vt.on_update",
 		"on_trash": "vt_internal.vt_internal.events.fabrication_vt.on_trash",
+		"after_delete": "vt_internal.vt_internal.events.fabrication_vt.after_delete",
 	},
 	"Fiche de travail": {
 		"before_insert": "vt_internal.vt_internal.events.fiche_de_travail.before_insert",
 		"validate": "vt_internal.vt_internal.events.fiche_de_travail.validate",
+		"on_update": "vt_internal.vt_internal.events.fiche_de_travail.on_update",
 		"before_update_after_submit": "vt_internal.vt_internal.events.fiche_de_travail.before_update_after_submit",
+		"on_update_after_submit": "vt_internal.vt_internal.events.fiche_de_travail.on_update_after_submit",
 		"on_cancel": "vt_internal.vt_internal.events.fiche_de_travail.on_cancel",
 		"on_trash": "vt_internal.vt_internal.events.fiche_de_travail.on_trash",
 		"before_print": "vt_internal.vt_internal.events.fiche_de_travail.before_print",
 	},
+	"Fiscal Year": {
+		"on_update": "vt_internal.vt_internal.events.fiscal_year.on_update",
+		"after_delete": "vt_internal.vt_internal.events.fiscal_year.after_delete",
+	},
 	"Glass manufacturing costs": {
 		"validate": "vt_internal.vt_internal.events.glass_manufacturing_costs.validate",
 		"on_submit": "vt_internal.vt_internal.events.glass_manufacturing_costs.on_submit",
 	},
+	"Item": {
+		"on_update": "vt_internal.vt_internal.events.item.on_update",
+		"after_delete": "vt_internal.vt_internal.events.item.after_delete",
+	},
 	"Payment Order": {
 		"validate": "vt_internal.vt_internal.events.payment_order.validate",
 	},
@@ -261,6 +278,7 @@ doc_events = {
 	},
 	"Project": {
 		"validate": "vt_internal.vt_internal.events.project.validate",
+		"on_trash": "vt_internal.vt_internal.events.project.on_trash",
 	},
 	"Purchase Invoice": {
 		"validate": "vt_internal.vt_internal.events.purchase_invoice.validate",
@@ -270,8 +288,11 @@ doc_events = {
 		"before_validate": "vt_internal.vt_internal.events.purchase_order.before_validate",
 		"validate": "vt_internal.vt_internal.events.purchase_order.validate",
 		"after_insert": "vt_internal.vt_internal.events.purchase_order.after_insert",
+		"on_update": "vt_internal.vt_internal.events.purchase_order.on_update",
 		"on_submit": "vt_internal.vt_internal.events.purchase_order.on_submit",
 		"before_update_after_submit": "vt_internal.vt_internal.events.purchase_order.before_update_after_submit",
+		"on_cancel": "vt_internal.vt_internal.events.purchase_order.on_cancel",
+		"after_delete": "vt_internal.vt_internal.events.purchase_order.after_delete",
 	},
 	"Purchase Receipt": {
 		"on_submit": "vt_internal.vt_internal.events.purchase_receipt.on_submit",
@@ -289,19 +310,26 @@ doc_events = {
 		"before_validate": "vt_internal.vt_internal.events.sales_invoice.before_validate",
 		"before_insert": "vt_internal.vt_internal.events.sales_invoice.before_insert",
 		"validate": "vt_internal.vt_internal.events.sales_invoice.validate",
+		"on_update": "vt_internal.vt_internal.events.sales_invoice.on_update",
 		"on_submit": "vt_internal.vt_internal.events.sales_invoice.on_submit",
+		"on_cancel": "vt_internal.vt_internal.events.sales_invoice.on_cancel",
 		"before_update_after_submit": "vt_internal.vt_internal.events.sales_invoice.before_update_after_submit",
+		"on_update_after_submit": "vt_internal.vt_internal.events.sales_invoice.on_update_after_submit",
+		"after_delete": "vt_internal.vt_internal.events.sales_invoice.after_delete",
 		"before_print": "vt_internal.vt_internal.events.sales_invoice.before_print",
 	},
 	"Sales Order": {
 		"before_validate": "vt_internal.vt_internal.events.sales_order.before_validate",
 		"before_insert": "vt_internal.vt_internal.events.sales_order.before_insert",
 		"validate": "vt_internal.vt_internal.events.sales_order.validate",
+		"on_update": "vt_internal.vt_internal.events.sales_order.on_update",
 		"before_submit": "vt_internal.vt_internal.events.sales_order.before_submit",
 		"on_submit": "vt_internal.vt_internal.events.sales_order.on_submit",
 		"before_update_after_submit": "vt_internal.vt_internal.events.sales_order.before_update_after_submit",
+		"on_update_after_submit": "vt_internal.vt_internal.events.sales_order.on_update_after_submit",
 		"on_cancel": "vt_internal.vt_internal.events.sales_order.on_cancel",
 		"on_trash": "vt_internal.vt_internal.events.sales_order.on_trash",
+		"after_delete": "vt_internal.vt_internal.events.sales_order.after_delete",
 		"before_print": "vt_internal.vt_internal.events.sales_order.before_print",
 	},
 	"Sales Order Item": {
@@ -311,9 +339,11 @@ doc_events = {
 	"Timesheet": {
 		"before_insert": "vt_internal.vt_internal.events.timesheet.before_insert",
 		"validate": "vt_internal.vt_internal.events.timesheet.validate",
+		"on_update": "vt_internal.vt_internal.events.timesheet.on_update",
 		"before_submit": "vt_internal.vt_internal.events.timesheet.before_submit",
 		"on_submit": "vt_internal.vt_internal.events.timesheet.on_submit",
 		"on_cancel": "vt_internal.vt_internal.events.timesheet.on_cancel",
+		"after_delete": "vt_internal.vt_internal.events.timesheet.after_delete",
 	},
 	"Work Completion Receipt": {
 		"before_insert": "vt_internal.vt_internal.events.work_completion_receipt.before_insert",
@@ -350,6 +380,17 @@ scheduler_events = {
 	],
 	"daily": [
 		"vt_internal.vt_internal.tasks.update_recurring_customer_status.update_recurring_customer_status",
+		"vt_internal.vt_internal.doctype.vt_pointage_action.vt_pointage_action.purge_old_actions",
+	],
+	"daily_long": [
+		# Reconstruction complète des instantanés financiers (corrige la dérive)
+		"vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot.rebuild_all",
+		# Réconciliation du cube des ventes (rapports d'analyse)
+		"vt_internal.vt_internal.doctype.vt_sales_cube.vt_sales_cube.rebuild_all",
+		# Contrôle (et correction) des heures / coûts cumulés des fiches de travail
+		"vt_internal.vt_internal.tasks.verify_ft_labor_costs.verify_ft_labor_costs",
+		# Recalcul des heures planifiées des projets (tenues par incréments)
+		"vt_internal.vt_internal.tasks.reconcile_planned_hours.reconcile_planned_hours",
 	],
 	"weekly": [
 		"vt_internal.vt_internal.tasks.weekly_expense_reminder.weekly_expense_reminder",
@@ -419,14 +460,16 @@ override_whitelisted_methods = {
 # -----------------------------------------------------------
 
 # ignore_links_on_delete = ["Communication", "ToDo"]
+ignore_links_on_delete = ["Project Financial Snapshot", "VT Sales Cube"]
 
 # Request Events
 # ----------------
-# before_request = ["vt_internal.utils.before_request"]
+# Mesure des doc_events (désactivée par défaut, cf. utils/instrumentation.py)
+before_request = ["vt_internal.vt_internal.utils.instrumentation.install"]
 # after_request = ["vt_internal.utils.after_request"]
 # Job Events
 # ----------
-# before_job = ["vt_internal.utils.before_job"]
+before_job = ["vt_internal.vt_internal.utils.instrumentation.install"]
 # after_job = ["vt_internal.utils.after_job"]
 
 # User Data Protection
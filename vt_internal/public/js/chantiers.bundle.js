@@ -4,7 +4,7 @@
 // (contrôles Frappe natifs → autocomplétion), charge les données via l'API JSON
 // `get_chantiers`, et monte l'app Vue qui rend tout (KPIs, graphes, tableau).
 //
-// Le détail d'un projet réutilise la modale HTML existante (project_details),
+// Le détail d'un projet réutilise la modale partagée (vt.project_details),
 // exposée ici en global `openProjectDetails` pour que le composant Vue l'appelle.
 
 import { createApp, reactive } from "vue";
@@ -159,30 +159,12 @@ class ChantiersView {
 	}
 }
 
-// Modale de détail projet (réutilise l'API HTML existante project_details).
+// Modale de détail projet (modale partagée vt.project_details).
 window.openProjectDetails = function (project) {
-	const dialog = new frappe.ui.Dialog({
-		size: "extra-large",
+	vt.project_details.show(project, {
 		title: __("Détails du projet") + " · " + project,
-		fields: [{ fieldname: "content", fieldtype: "HTML" }],
-		primary_action: () => frappe.set_route("Form", "Project", project),
 		primary_action_label: __("Ouvrir le projet"),
 	});
-	dialog.show();
-	dialog.fields_dict.content.$wrapper.html(
-		`<div class="text-muted" style="padding:40px;text-align:center;">${__("Chargement…")}</div>`
-	);
-	frappe
-		.call({
-			method: "vt_internal.vt_internal.api.project_details.project_details",
-			args: { project },
-		})
-		.then((r) => dialog.fields_dict.content.$wrapper.html(r.message.html))
-		.catch(() =>
-			dialog.fields_dict.content.$wrapper.html(
-				`<div class="text-danger" style="padding:40px;text-align:center;">${__("Erreur de chargement")}</div>`
-			)
-		);
 };
 
 frappe.provide("frappe.ui");
@@ -0,0 +1,46 @@
+// Modale « Détails du projet » partagée (bouton 📁 des formulaires, rapports).
+// Chargé via vt_common.bundle.js.
+//
+// Les sections (en-tête marges/paiements, documents, événements) sont
+// demandées en parallèle à `get_project_details` : chacune s'affiche dès
+// qu'elle arrive, l'en-tête n'attend pas la liste des documents.
+
+frappe.provide("vt.project_details");
+
+vt.project_details.METHOD = "vt_internal.vt_internal.api.project_details.get_project_details";
+vt.project_details.SECTIONS = ["header", "timeline", "events"];
+
+vt.project_details._message = (cls, text) =>
+    `<div class="${cls}" style="padding:40px;text-align:center;">${text}</div>`;
+
+vt.project_details.show = (project, opts = {}) => {
+    if (!project) return;
+    const dialog = new frappe.ui.Dialog({
+        size: "extra-large",
+        title: opts.title || __("Details du projet"),
+        fields: [{ fieldname: "content", fieldtype: "HTML" }],
+        primary_action: () => frappe.set_route("Form", "Project", project),
+        primary_action_label: opts.primary_action_label || __("Projet"),
+    });
+    const $content = dialog.fields_dict.content.$wrapper.empty();
+    const slots = {};
+    vt.project_details.SECTIONS.forEach((section) => {
+        slots[section] = $("<div>").attr("data-section", section).appendTo($content);
+    });
+    slots.header.html(vt.project_details._message("text-muted", __("Chargement…")));
+    dialog.show();
+
+    vt.project_details.SECTIONS.forEach((section) => {
+        frappe.call({
+            method: vt.project_details.METHOD,
+            args: { project, section },
+            callback: (r) => slots[section].html((r.message && r.message.html) || ""),
+            error: () => {
+                if (section === "header") {
+                    slots[section].html(vt.project_details._message("text-danger", __("Erreur de chargement")));
+                }
+            },
+        });
+    });
+    return dialog;
+};
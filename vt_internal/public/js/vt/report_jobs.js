@@ -0,0 +1,34 @@
+// Rapports longs calculés en tâche de fond (cf. utils/report_jobs.py).
+// Chargé via vt_common.bundle.js.
+//
+// `vt.report_jobs.setup(report)` (dans le onload du rapport) ajoute le bouton
+// « Recalculer » (oublie le résultat en cache puis relance) et rafraîchit le
+// rapport quand le calcul en arrière-plan est terminé.
+
+frappe.provide("vt.report_jobs");
+
+vt.report_jobs.CLEAR_METHOD = "vt_internal.vt_internal.utils.report_jobs.clear_report_result";
+
+vt.report_jobs.setup = (report) => {
+    const report_name = report.report_name;
+
+    report.page.add_inner_button(__("Recalculer"), () => {
+        frappe.call({
+            method: vt.report_jobs.CLEAR_METHOD,
+            args: { report_name, filters: report.get_filter_values() },
+            callback: () => report.refresh(),
+        });
+    });
+
+    if (vt.report_jobs._listening) return;
+    vt.report_jobs._listening = true;
+    frappe.realtime.on("vt_report_ready", (data) => {
+        const current = frappe.query_report;
+        if (data.error) {
+            frappe.show_alert({ message: __("{0} : échec du calcul", [__(data.report)]), indicator: "red" }, 8);
+        }
+        if (current && current.report_name === data.report) {
+            current.refresh();
+        }
+    });
+};
@@ -7,14 +7,166 @@ frappe.provide("vt.timer");
 vt.timer.GROUP = "⏱️";
 
 // État de pointage du jour + actions autorisées (pilotées par le back).
+// La file hors ligne est d'abord envoyée : l'état reflète les appuis en attente.
 vt.timer.get_state = () =>
-    frappe.call({ method: "timesheet_state" }).then((r) => r.message);
+    vt.timer.sync().then(() => frappe.call({ method: "timesheet_state" }).then((r) => r.message));
 
 // Poste une action de pointage. `toast` optionnel affiché en cas de succès.
-vt.timer.post = (payload, toast) =>
-    frappe.call({ method: "timesheet_post_api", args: payload }).then(() => {
-        if (toast) frappe.show_alert({ message: toast, indicator: "green" }, 5);
-    });
+// L'action est horodatée sur le téléphone et mise en file (IndexedDB) avant
+// l'envoi : sans réseau, elle part à la reconnexion avec son heure d'origine.
+vt.timer.post = (payload, toast) => {
+    const { action, ...args } = payload;
+    const item = {
+        id: vt.timer.queue.new_id(),
+        user: frappe.session.user,
+        action,
+        args,
+        client_time: Date.now(),
+    };
+    return vt.timer.queue
+        .add(item)
+        .then(() => vt.timer.sync())
+        .then((status) => {
+            if (status === "offline") {
+                frappe.show_alert(
+                    { message: __("Hors ligne : pointage enregistré, envoi à la reconnexion"), indicator: "orange" },
+                    5
+                );
+            } else if (status === "retry") {
+                frappe.show_alert(
+                    { message: __("Serveur indisponible : pointage enregistré, nouvel envoi plus tard"), indicator: "orange" },
+                    5
+                );
+            } else if (status === "ok" && toast) {
+                frappe.show_alert({ message: toast, indicator: "green" }, 5);
+            }
+        });
+};
+
+// File des actions en attente (IndexedDB ; en mémoire si indisponible).
+vt.timer.queue = {
+    DB: "vt_pointage",
+    STORE: "actions",
+    _db: null,
+    _memory: [],
+
+    new_id() {
+        return window.crypto && crypto.randomUUID ? crypto.randomUUID() : frappe.utils.get_random(20);
+    },
+
+    open() {
+        if (!window.indexedDB) return Promise.resolve(null);
+        if (!this._db) {
+            this._db = new Promise((resolve) => {
+                const req = indexedDB.open(this.DB, 1);
+                req.onupgradeneeded = () => req.result.createObjectStore(this.STORE, { keyPath: "id" });
+                req.onsuccess = () => resolve(req.result);
+                req.onerror = () => resolve(null);
+            });
+        }
+        return this._db;
+    },
+
+    _tx(mode, fn) {
+        return this.open().then(
+            (db) =>
+                new Promise((resolve, reject) => {
+                    if (!db) return resolve(fn(null));
+                    const tx = db.transaction(this.STORE, mode);
+                    const result = fn(tx.objectStore(this.STORE));
+                    tx.oncomplete = () => resolve(result instanceof IDBRequest ? result.result : result);
+                    tx.onerror = () => reject(tx.error);
+                })
+        );
+    },
+
+    add(item) {
+        return this._tx("readwrite", (store) => (store ? store.put(item) : this._memory.push(item)));
+    },
+
+    // Actions en attente de `user`, dans l'ordre des appuis. Celles d'un autre
+    // utilisateur (appareil partagé) restent en file jusqu'à sa reconnexion.
+    all(user) {
+        return this._tx("readonly", (store) => (store ? store.getAll() : this._memory.slice())).then((items) =>
+            (items || []).filter((i) => i.user === user).sort((a, b) => a.client_time - b.client_time)
+        );
+    },
+
+    remove(ids) {
+        return this._tx("readwrite", (store) => {
+            if (!store) {
+                this._memory = this._memory.filter((i) => !ids.includes(i.id));
+                return;
+            }
+            ids.forEach((id) => store.delete(id));
+        });
+    },
+};
+
+// Envoie la file de l'utilisateur connecté en un seul appel (rejoué une seule
+// fois côté serveur, cf. timesheet_post_batch). Résout à :
+//   "ok"       : file envoyée (ou vide) ;
+//   "offline"  : pas de réponse du serveur (réseau, délai dépassé), file conservée ;
+//   "retry"    : erreur passagère (5xx : verrou, proxy 502/504 ; 401/403 : session
+//                expirée), file conservée : le serveur dédoublonne par id, le
+//                renvoi est sans risque ;
+//   "rejected" : lot refusé définitivement (400/417, validation), retiré de la
+//                file pour ne pas être renvoyé à chaque rafraîchissement.
+vt.timer.sync = () => {
+    if (vt.timer._syncing) return vt.timer._syncing;
+    vt.timer._syncing = vt.timer.queue
+        .all(frappe.session.user)
+        .then((items) => {
+            if (!items.length) return "ok";
+            const ids = items.map((i) => i.id);
+            return new Promise((resolve) =>
+                frappe
+                    .call({
+                        method: "vt_internal.vt_internal.api.timesheet.timesheet_post_batch",
+                        args: { actions: items },
+                    })
+                    .then(
+                        (r) => resolve(vt.timer._on_synced(ids, r.message)),
+                        (xhr, text_status) => resolve(vt.timer._on_sync_error(ids, xhr, text_status))
+                    )
+            );
+        })
+        .finally(() => {
+            vt.timer._syncing = null;
+        });
+    return vt.timer._syncing;
+};
+
+vt.timer._on_synced = (ids, r) => {
+    (r.results || [])
+        .filter((res) => res.status === "error")
+        .forEach((res) =>
+            frappe.show_alert({ message: __("Pointage refusé : {0}", [res.message]), indicator: "red" }, 8)
+        );
+    vt.timer.last_state = r.state;
+    return vt.timer.queue.remove(ids).then(() => "ok");
+};
+
+vt.timer._on_sync_error = (ids, xhr, text_status) => {
+    if (!xhr || xhr.status === 0 || text_status === "timeout") return "offline";
+    if (![400, 417].includes(xhr.status)) return "retry";
+    // Le message du serveur est déjà affiché par frappe.call.
+    frappe.show_alert(
+        {
+            message: __("{0} pointage(s) refusé(s) par le serveur et retiré(s) de la file", [ids.length]),
+            indicator: "red",
+        },
+        8
+    );
+    return vt.timer.queue.remove(ids).then(() => "rejected");
+};
+
+// Reconnexion : un seul appel pour toute la file, puis rafraîchissement du widget.
+window.addEventListener("online", () =>
+    vt.timer
+        .sync()
+        .then((status) => ["ok", "rejected"].includes(status) && vt.timer.widget && vt.timer.widget.refresh())
+);
 
 // Retire les boutons de pointage précédemment injectés (évite les doublons au refresh).
 vt.timer._clear_buttons = (frm) => {
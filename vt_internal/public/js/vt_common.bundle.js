@@ -4,10 +4,14 @@
 // Expose les namespaces globaux :
 //   - vt.timer   : pointage (feuilles de temps / fiches de travail) + widget global
 //   - vt.photos  : galerie photos réutilisable
+//   - vt.project_details : modale « Détails du projet » (sections en parallèle)
+//   - vt.report_jobs : rapports longs en tâche de fond (bouton « Recalculer »)
 //
 // Ces modules remplacent le code dupliqué qui vivait dans visite_technique.js
 // et fiche_de_travail.js.
 
 import "./vt/timer";
 import "./vt/photos";
+import "./vt/project_details";
+import "./vt/report_jobs";
 import "./vt/timer_widget";
@@ -11,16 +11,59 @@
 # est-il facturé ? combien d'heures passées (validées ET en attente) ? a-t-on
 # repointé sur un chantier déjà facturé (SAV) ? quels chantiers actifs n'ont
 # reçu aucun pointage ?
+#
+# Performance : une seule lecture fenêtrée par table source (Timesheet,
+# Sales Invoice, Purchase Order, Expense, Fabrication VT) couvrant la période
+# précédente ET la période courante (prev_start → end_date). KPIs, cartes par
+# projet, séries hebdomadaires et répartition par conducteur sont dérivés en
+# Python de ces résultats. Les métadonnées projet
+# (instantané financier, facturation cumulée, réceptions, incidents, noms
+# d'utilisateurs) sont lues en une requête ; les options de filtres en une
+# autre. Soit 7 requêtes par appel.
+#
+# Les noms des documents qui composent un KPI (pour ouvrir la liste filtrée
+# `name IN [...]`) ne sont pas dans la réponse : ils ne servent qu'au clic sur
+# une tuile et sont chargés à la demande via `get_chantiers_doc_names`.
+#
+# Cache : la réponse est mise en cache Redis quelques minutes, par (période,
+# société, conducteurs, empreinte des permissions de l'utilisateur). Les
+# doc_events (validation / annulation de Timesheet, Sales Invoice, Purchase
+# Order, Expense, Fabrication VT) invalident les seules entrées dont la fenêtre
+# couvre la date du document. Compteurs hit/miss : `get_chantiers_cache_stats`.
 
+import hashlib
 import json
+import time
+from datetime import timedelta
 
 import frappe
+from frappe.permissions import get_user_permissions
 
+from vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot import (
+	SNAPSHOT_FIELDS,
+	refresh_snapshots,
+)
 from vt_internal.vt_internal.utils.margin_utils import calculate_margin
 
 # Types d'activité exclus du "temps chantier" (temps atelier / logistique).
 EXCLUDED_ACTIVITIES = ("Fabrication", "Livraison")
 
+# Durée de vie d'une réponse en cache (secondes). Les brouillons (pointages en
+# cours, commandes fournisseur non validées) ne déclenchent pas d'invalidation :
+# ils sont rafraîchis au plus tard à l'expiration.
+CACHE_TTL = 300
+CACHE_PREFIX = "vt_chantiers"
+# Hash Redis : clé d'entrée → (début de fenêtre, fin de fenêtre, expiration)
+CACHE_INDEX = "vt_chantiers_index"
+# Date qui place un document dans la fenêtre de get_chantiers
+CACHE_DATE_FIELDS = {
+	"Timesheet": "end_date",
+	"Sales Invoice": "posting_date",
+	"Purchase Order": "transaction_date",
+	"Expense": "expense_date",
+	"Fabrication VT": "creation",
+}
+
 
 def _parse_list(value):
 	"""Normalise un filtre multi-valeurs (liste, JSON string, ou None)."""
@@ -51,171 +94,108 @@ def _cm_clause(cm_list):
 	return "", []
 
 
-def _scalar_kpis(start_date, end_date, company, cm_list):
-	"""KPIs scalaires pour une période — réutilisé pour la période courante ET
-	la période précédente (comparaison). Ne dépend pas de la boucle projets.
+def _empty_kpis():
+	return {
+		"h_val": 0, "h_draft": 0, "h_on": 0, "h_off": 0, "h_sav": 0,
+		"projects": set(), "ca": 0, "heures_facturees": 0,
+		"po": 0, "exp": 0, "fab": 0,
+	}
 
-	Si des conducteurs sont sélectionnés, on joint systématiquement `tabProject`
-	et on restreint aux chantiers de ces conducteurs (les heures hors chantier
-	disparaissent alors naturellement du périmètre)."""
 
-	comp_t, comp_pt = _company_clause(company, "t")
-	comp_si, comp_psi = _company_clause(company, "si")
-	cm_sql, cm_p = _cm_clause(cm_list)
-	# Jointure projet nécessaire pour les requêtes timesheet qui ne l'ont pas.
-	cm_join = " JOIN `tabProject` p ON p.name = d.project" if cm_list else ""
-	excl = ",".join(["%s"] * len(EXCLUDED_ACTIVITIES))
-
-	# Heures réalisées (validées) et non validées (brouillon), hors Fab/Livraison
-	val = frappe.db.sql(
-		f"""
-		SELECT
-			SUM(CASE WHEN t.docstatus = 1 THEN d.hours ELSE 0 END) AS h_val,
-			SUM(CASE WHEN t.docstatus = 0 THEN d.hours ELSE 0 END) AS h_draft
-		FROM `tabTimesheet` t
-		JOIN `tabTimesheet Detail` d ON d.parent = t.name{cm_join}
-		WHERE t.docstatus IN (0, 1)
-		  AND COALESCE(d.activity_type, '') NOT IN ({excl})
-		  AND t.end_date BETWEEN %s AND %s{comp_t}{cm_sql}
-		""",
-		tuple([*EXCLUDED_ACTIVITIES, start_date, end_date, *comp_pt, *cm_p]),
-		as_dict=True,
-	)[0]
-	heures_realisees = round(val.h_val or 0)
-	heures_non_validees = round(val.h_draft or 0)
+def _finalize_kpis(k):
+	"""Arrondis et ratios à partir des cumuls bruts d'une période."""
+	heures_realisees = round(k["h_val"])
+	h_on = round(k["h_on"])
+	h_off = round(k["h_off"])
+	heures_facturees = round(k["heures_facturees"])
+	return {
+		"ca_periode": round(k["ca"]),
+		"commande_fournisseur": round(k["po"]),
+		"depenses": round(k["exp"]),
+		"fabrication": round(k["fab"]),
+		"heures_facturees": heures_facturees,
+		"heures_realisees": heures_realisees,
+		"heures_non_validees": round(k["h_draft"]),
+		"pct_heures": round(heures_facturees / heures_realisees * 100) if heures_realisees > 0 else 0,
+		"heures_chantier": h_on,
+		"heures_hors_chantier": h_off,
+		"pct_chantier": round(h_on / (h_on + h_off) * 100) if (h_on + h_off) > 0 else 0,
+		"heures_sav": round(k["h_sav"]),
+		"nb_chantiers_pointes": len(k["projects"]),
+	}
 
-	# Heures sur chantier vs hors chantier (validées)
-	on_off = frappe.db.sql(
-		f"""
-		SELECT
-			SUM(CASE WHEN d.project IS NOT NULL AND d.project != '' THEN d.hours ELSE 0 END) AS h_on,
-			SUM(CASE WHEN d.project IS NULL OR d.project = '' THEN d.hours ELSE 0 END) AS h_off
-		FROM `tabTimesheet` t
-		JOIN `tabTimesheet Detail` d ON d.parent = t.name{cm_join}
-		WHERE t.docstatus = 1
-		  AND COALESCE(d.activity_type, '') NOT IN ({excl})
-		  AND t.end_date BETWEEN %s AND %s{comp_t}{cm_sql}
-		""",
-		tuple([*EXCLUDED_ACTIVITIES, start_date, end_date, *comp_pt, *cm_p]),
-		as_dict=True,
-	)[0]
-	h_on = round(on_off.h_on or 0)
-	h_off = round(on_off.h_off or 0)
-	pct_chantier = round(h_on / (h_on + h_off) * 100) if (h_on + h_off) > 0 else 0
 
-	# Heures SAV : heures (validées) sur des chantiers DÉJÀ facturés (Completed)
-	sav = frappe.db.sql(
-		f"""
-		SELECT SUM(d.hours) AS h
-		FROM `tabTimesheet` t
-		JOIN `tabTimesheet Detail` d ON d.parent = t.name
-		JOIN `tabProject` p ON p.name = d.project
-		WHERE t.docstatus = 1
-		  AND p.status = 'Completed'
-		  AND COALESCE(d.activity_type, '') NOT IN ({excl})
-		  AND t.end_date BETWEEN %s AND %s{comp_t}{cm_sql}
-		""",
-		tuple([*EXCLUDED_ACTIVITIES, start_date, end_date, *comp_pt, *cm_p]),
-		as_dict=True,
-	)[0]
-	heures_sav = round(sav.h or 0)
+def _week_start(d):
+	"""Lundi de la semaine de `d` (clé des séries hebdomadaires)."""
+	return str(d - timedelta(days=d.weekday()))
 
-	# CA de la période (factures non-acompte, projets "chantiers" réels)
-	ca = frappe.db.sql(
-		f"""
-		SELECT SUM(si.total) AS ca, SUM(si.custom_labour_hours) AS heures_facturees
-		FROM `tabSales Invoice` si
-		JOIN `tabProject` p ON p.name = si.project
-		WHERE si.docstatus = 1 AND si.is_return = 0
-		  AND (si.is_down_payment_invoice = 0 OR si.is_down_payment_invoice IS NULL)
-		  AND p.custom_estimated_labor_hours > 1
-		  AND si.posting_date BETWEEN %s AND %s{comp_si}{cm_sql}
-		""",
-		tuple([start_date, end_date, *comp_psi, *cm_p]),
-		as_dict=True,
-	)[0]
-	ca_periode = round(ca.ca or 0)
-	heures_facturees = round(ca.heures_facturees or 0)
-	pct_heures = round(heures_facturees / heures_realisees * 100) if heures_realisees > 0 else 0
 
-	# Nb de chantiers distincts pointés (validé ou brouillon) sur la période
-	nb = frappe.db.sql(
-		f"""
-		SELECT COUNT(DISTINCT d.project) AS nb
-		FROM `tabTimesheet` t
-		JOIN `tabTimesheet Detail` d ON d.parent = t.name{cm_join}
-		WHERE t.docstatus IN (0, 1)
-		  AND d.project IS NOT NULL AND d.project != ''
-		  AND t.end_date BETWEEN %s AND %s{comp_t}{cm_sql}
-		""",
-		tuple([start_date, end_date, *comp_pt, *cm_p]),
-		as_dict=True,
-	)[0]
+def _permission_fingerprint():
+	"""Empreinte des rôles et User Permissions de l'utilisateur courant (deux
+	lectures déjà en cache côté Frappe) : deux utilisateurs aux droits
+	différents ne partagent jamais une entrée."""
+	user = frappe.session.user
+	payload = json.dumps(
+		[sorted(frappe.get_roles(user)), get_user_permissions(user)],
+		sort_keys=True, default=str,
+	)
+	return hashlib.md5(payload.encode()).hexdigest()
 
-	# Montant commandé en commandes fournisseur sur la période (lignes liées à un projet)
-	comp_po = " AND po.company = %s" if company else ""
-	comp_po_p = [company] if company else []
-	po_join = " JOIN `tabProject` p ON p.name = poi.project" if cm_list else ""
-	po = frappe.db.sql(
-		f"""
-		SELECT SUM(poi.amount) AS montant
-		FROM `tabPurchase Order Item` poi
-		JOIN `tabPurchase Order` po ON po.name = poi.parent{po_join}
-		WHERE po.docstatus < 2
-		  AND poi.project IS NOT NULL AND poi.project != ''
-		  AND po.transaction_date BETWEEN %s AND %s{comp_po}{cm_sql}
-		""",
-		tuple([start_date, end_date, *comp_po_p, *cm_p]),
-		as_dict=True,
-	)[0]
 
-	# Dépenses sur la période (notes de frais rattachées à un chantier)
-	comp_exp = " AND e.company = %s" if company else ""
-	comp_exp_p = [company] if company else []
-	exp_join = " JOIN `tabProject` p ON p.name = e.project" if cm_list else ""
-	exp = frappe.db.sql(
-		f"""
-		SELECT SUM(e.net_amount) AS montant
-		FROM `tabExpense` e{exp_join}
-		WHERE e.docstatus < 2
-		  AND e.project IS NOT NULL AND e.project != ''
-		  AND e.expense_date BETWEEN %s AND %s{comp_exp}{cm_sql}
-		""",
-		tuple([start_date, end_date, *comp_exp_p, *cm_p]),
-		as_dict=True,
-	)[0]
+def _cache_key(start_date, end_date, company, cm_list):
+	payload = json.dumps(
+		[str(start_date), str(end_date), company or "", sorted(cm_list), _permission_fingerprint()]
+	)
+	return f"{CACHE_PREFIX}|{hashlib.md5(payload.encode()).hexdigest()}"
+
+
+def _count(stat):
+	frappe.cache.incr(frappe.cache.make_key(f"{CACHE_PREFIX}_{stat}"))
+
+
+def invalidate_chantiers_cache(dates):
+	"""Supprime les réponses en cache dont la fenêtre (période précédente +
+	courante) contient l'une des `dates`. Purge au passage les entrées expirées
+	de l'index."""
+	dates = {frappe.utils.getdate(d) for d in dates if d}
+	if not dates:
+		return
+	now = time.time()
+	for key, (window_start, window_end, expires) in (frappe.cache.hgetall(CACHE_INDEX) or {}).items():
+		if expires < now or any(window_start <= d <= window_end for d in dates):
+			# Clés du hash lues en bytes : delete_value préfixe une chaîne.
+			frappe.cache.delete_value(frappe.safe_decode(key))
+			frappe.cache.hdel(CACHE_INDEX, key)
+			if expires >= now:
+				_count("invalidations")
+
+
+def invalidate_for_doc(doc, method=None):
+	"""doc_event : invalide le cache Chantiers pour la date du document, une
+	fois la transaction validée (sinon une requête concurrente pourrait remettre
+	en cache l'état d'avant)."""
+	fieldname = CACHE_DATE_FIELDS.get(doc.doctype)
+	if not fieldname:
+		return
+	dates = [doc.get(fieldname)]
+	before = doc.get_doc_before_save()
+	if before:
+		dates.append(before.get(fieldname))
+	frappe.db.after_commit.add(lambda: invalidate_chantiers_cache(dates))
 
-	# Fabrication VT créée sur la période (hors annulées)
-	comp_fab = " AND f.company = %s" if company else ""
-	comp_fab_p = [company] if company else []
-	fab_join = " JOIN `tabProject` p ON p.name = f.project" if cm_list else ""
-	fab = frappe.db.sql(
-		f"""
-		SELECT SUM(f.manufacturing_costs) AS montant
-		FROM `tabFabrication VT` f{fab_join}
-		WHERE f.status != 'Annulé'
-		  AND f.project IS NOT NULL AND f.project != ''
-		  AND DATE(f.creation) BETWEEN %s AND %s{comp_fab}{cm_sql}
-		""",
-		tuple([start_date, end_date, *comp_fab_p, *cm_p]),
-		as_dict=True,
-	)[0]
 
-	return {
-		"ca_periode": ca_periode,
-		"commande_fournisseur": round(po.montant or 0),
-		"depenses": round(exp.montant or 0),
-		"fabrication": round(fab.montant or 0),
-		"heures_facturees": heures_facturees,
-		"heures_realisees": heures_realisees,
-		"heures_non_validees": heures_non_validees,
-		"pct_heures": pct_heures,
-		"heures_chantier": h_on,
-		"heures_hors_chantier": h_off,
-		"pct_chantier": pct_chantier,
-		"heures_sav": heures_sav,
-		"nb_chantiers_pointes": nb.nb or 0,
+@frappe.whitelist()
+def get_chantiers_cache_stats():
+	"""Compteurs du cache de la vue Chantiers (hits, misses, invalidations)."""
+	frappe.only_for("System Manager")
+	stats = {
+		stat: int(frappe.cache.get(frappe.cache.make_key(f"{CACHE_PREFIX}_{stat}")) or 0)
+		for stat in ("hits", "misses", "invalidations")
 	}
+	total = stats["hits"] + stats["misses"]
+	stats["hit_rate"] = round(stats["hits"] / total * 100) if total else 0
+	stats["entries"] = len(frappe.cache.hgetall(CACHE_INDEX) or {})
+	return stats
 
 
 @frappe.whitelist()
@@ -224,7 +204,8 @@ def get_chantiers(start_date=None, end_date=None, company=None, conducteurs=None
 
 	Renvoie période, KPIs (+ comparaison période précédente), lignes projet
 	enrichies, chantiers sans pointage, répartitions (activité, conducteur) et
-	séries hebdomadaires. `conducteurs` = liste de User (multi-sélection)."""
+	séries hebdomadaires. `conducteurs` = liste de User (multi-sélection).
+	Réponse servie depuis le cache Redis quand elle y est."""
 
 	end_date = end_date or frappe.utils.nowdate()
 	start_date = start_date or frappe.utils.add_to_date(end_date, days=-7)
@@ -235,248 +216,308 @@ def get_chantiers(start_date=None, end_date=None, company=None, conducteurs=None
 	prev_end = frappe.utils.add_to_date(start_date, days=-1)
 	prev_start = frappe.utils.add_to_date(prev_end, days=-length)
 
-	kpis = _scalar_kpis(start_date, end_date, company, cm_list)
-	kpis_prev = _scalar_kpis(prev_start, prev_end, company, cm_list)
+	key = _cache_key(start_date, end_date, company, cm_list)
+	cached = frappe.cache.get_value(key)
+	if cached is not None:
+		_count("hits")
+		return cached
+	_count("misses")
+
+	result = _compute_chantiers(start_date, end_date, prev_start, prev_end, length, company, cm_list)
+	frappe.cache.set_value(key, result, expires_in_sec=CACHE_TTL)
+	frappe.cache.hset(
+		CACHE_INDEX, key,
+		(frappe.utils.getdate(prev_start), frappe.utils.getdate(end_date), time.time() + CACHE_TTL),
+	)
+	return result
+
+
+def _compute_chantiers(start_date, end_date, prev_start, prev_end, length, company, cm_list):
+	"""Calcul complet de la réponse de get_chantiers (hors cache)."""
+
+	start_d, end_d = frappe.utils.getdate(start_date), frappe.utils.getdate(end_date)
+	prev_start_d, prev_end_d = frappe.utils.getdate(prev_start), frappe.utils.getdate(prev_end)
+
+	def _period(d):
+		"""'cur', 'prev' ou None selon la période qui contient la date `d`."""
+		d = frappe.utils.getdate(d)
+		if start_d <= d <= end_d:
+			return "cur"
+		if prev_start_d <= d <= prev_end_d:
+			return "prev"
+		return None
 
 	comp_t, comp_pt = _company_clause(company, "t")
 	comp_si, comp_psi = _company_clause(company, "si")
+	comp_po, comp_po_p = _company_clause(company, "po")
+	comp_exp, comp_exp_p = _company_clause(company, "e")
+	comp_fab, comp_fab_p = _company_clause(company, "f")
 	cm_sql, cm_p = _cm_clause(cm_list)
-	cm_join = " JOIN `tabProject` p ON p.name = d.project" if cm_list else ""
-	excl = ",".join(["%s"] * len(EXCLUDED_ACTIVITIES))
+	# Les lectures fenêtrées couvrent les deux périodes d'un coup.
+	window = [prev_start, end_date]
+
+	kpi = {"cur": _empty_kpis(), "prev": _empty_kpis()}
 
-	# --- Heures par projet sur la période (validées + brouillon) ---------------
-	rows = frappe.db.sql(
+	# --- 1. Timesheets (prev_start → end_date) --------------------------------
+	# Une ligne par (jour, statut, projet, activité). La jointure projet est en LEFT
+	# JOIN : le filtre conducteur (sur p) la rend interne, comme avant.
+	ts_rows = frappe.db.sql(
 		f"""
-		SELECT d.project AS project,
-			SUM(CASE WHEN t.docstatus = 1 THEN d.hours ELSE 0 END) AS h_val,
-			SUM(CASE WHEN t.docstatus = 0 THEN d.hours ELSE 0 END) AS h_draft
+		SELECT t.docstatus, t.end_date,
+		       d.project, d.activity_type, SUM(d.hours) AS hours,
+		       p.name AS p_name, p.status AS p_status,
+		       p.custom_construction_manager AS p_cm
 		FROM `tabTimesheet` t
-		JOIN `tabTimesheet Detail` d ON d.parent = t.name{cm_join}
+		JOIN `tabTimesheet Detail` d ON d.parent = t.name
+		LEFT JOIN `tabProject` p ON p.name = d.project
 		WHERE t.docstatus IN (0, 1)
-		  AND d.project IS NOT NULL AND d.project != ''
 		  AND t.end_date BETWEEN %s AND %s{comp_t}{cm_sql}
-		GROUP BY d.project
+		GROUP BY t.docstatus, t.end_date, d.project, d.activity_type
 		""",
-		tuple([start_date, end_date, *comp_pt, *cm_p]),
+		tuple([*window, *comp_pt, *cm_p]),
 		as_dict=True,
 	)
-	hours_map = {r.project: r for r in rows}
 
-	# --- Commandes fournisseur passées sur la période (par projet) -------------
+	hours_map = {}
+	prev_pointed = set()
+	activity_map = {}
+	conducteur_map = {}
+	wk_map = {}
+	for r in ts_rows:
+		period = _period(r.end_date)
+		if not period:
+			continue
+		k = kpi[period]
+		hours = r.hours or 0
+		validated = r.docstatus == 1
+		excluded = (r.activity_type or "") in EXCLUDED_ACTIVITIES
+		on_project = bool(r.project)
+
+		if on_project:
+			k["projects"].add(r.project)
+		if not excluded:
+			k["h_val" if validated else "h_draft"] += hours
+			if validated:
+				k["h_on" if on_project else "h_off"] += hours
+				# Heures SAV : sur des chantiers DÉJÀ facturés (Completed)
+				if r.p_name and r.p_status == "Completed":
+					k["h_sav"] += hours
+
+		if period == "prev":
+			if on_project:
+				prev_pointed.add(r.project)
+			continue
+
+		# Période courante uniquement
+		if on_project:
+			e = hours_map.setdefault(r.project, {"h_val": 0, "h_draft": 0})
+			e["h_val" if validated else "h_draft"] += hours
+			if r.p_name:
+				c = conducteur_map.setdefault(
+					r.p_cm or "—", {"h_val": 0, "h_draft": 0, "projects": set()}
+				)
+				c["h_val" if validated else "h_draft"] += hours
+				c["projects"].add(r.project)
+		elif validated and not excluded:
+			activity_map[r.activity_type] = activity_map.get(r.activity_type, 0) + hours
+
+		if not excluded:
+			w = wk_map.setdefault(_week_start(r.end_date), {"ca": 0, "val": 0, "draft": 0})
+			w["val" if validated else "draft"] += hours
+
+	# --- 2. Factures de vente (prev_start → end_date) -------------------------
+	si_rows = frappe.db.sql(
+		f"""
+		SELECT si.project, si.posting_date, si.total, si.custom_labour_hours,
+		       p.name AS p_name, p.custom_estimated_labor_hours AS p_estimated_hours
+		FROM `tabSales Invoice` si
+		LEFT JOIN `tabProject` p ON p.name = si.project
+		WHERE si.docstatus = 1 AND si.is_return = 0
+		  AND (si.is_down_payment_invoice = 0 OR si.is_down_payment_invoice IS NULL)
+		  AND si.project IS NOT NULL AND si.project != ''
+		  AND si.posting_date BETWEEN %s AND %s{comp_si}{cm_sql}
+		""",
+		tuple([*window, *comp_psi, *cm_p]),
+		as_dict=True,
+	)
+	ca_map = {}
+	for r in si_rows:
+		period = _period(r.posting_date)
+		if not period:
+			continue
+		# CA "chantiers" : projets réels (heures estimées > 1)
+		is_chantier = r.p_name and (r.p_estimated_hours or 0) > 1
+		if is_chantier:
+			kpi[period]["ca"] += r.total or 0
+			kpi[period]["heures_facturees"] += r.custom_labour_hours or 0
+		if period == "prev":
+			continue
+		ca_map[r.project] = ca_map.get(r.project, 0) + (r.total or 0)
+		if is_chantier:
+			w = wk_map.setdefault(_week_start(frappe.utils.getdate(r.posting_date)), {"ca": 0, "val": 0, "draft": 0})
+			w["ca"] += r.total or 0
+
+	# --- 3. Commandes fournisseur (lignes liées à un projet) ------------------
 	# Créer une commande fournisseur sur la période fait aussi "entrer" le
 	# chantier dans la période (même sans pointage).
-	comp_po = " AND po.company = %s" if company else ""
-	comp_po_p = [company] if company else []
-	po_cm_join = " JOIN `tabProject` p ON p.name = poi.project" if cm_list else ""
 	po_rows = frappe.db.sql(
 		f"""
-		SELECT poi.project AS project, SUM(poi.amount) AS montant
+		SELECT poi.project, po.transaction_date, SUM(poi.amount) AS montant
 		FROM `tabPurchase Order Item` poi
-		JOIN `tabPurchase Order` po ON po.name = poi.parent{po_cm_join}
+		JOIN `tabPurchase Order` po ON po.name = poi.parent
+		LEFT JOIN `tabProject` p ON p.name = poi.project
 		WHERE po.docstatus < 2
 		  AND poi.project IS NOT NULL AND poi.project != ''
 		  AND po.transaction_date BETWEEN %s AND %s{comp_po}{cm_sql}
-		GROUP BY poi.project
+		GROUP BY po.transaction_date, poi.project
 		""",
-		tuple([start_date, end_date, *comp_po_p, *cm_p]),
+		tuple([*window, *comp_po_p, *cm_p]),
 		as_dict=True,
 	)
-	po_map = {r.project: round(r.montant or 0) for r in po_rows}
+	po_map = {}
+	for r in po_rows:
+		period = _period(r.transaction_date)
+		if not period:
+			continue
+		kpi[period]["po"] += r.montant or 0
+		if period == "cur":
+			po_map[r.project] = po_map.get(r.project, 0) + (r.montant or 0)
 
-	# --- Dépenses par projet sur la période -----------------------------------
-	comp_exp = " AND e.company = %s" if company else ""
-	comp_exp_p = [company] if company else []
-	exp_cm_join = " JOIN `tabProject` p ON p.name = e.project" if cm_list else ""
+	# --- 4. Dépenses (notes de frais rattachées à un chantier) ----------------
 	exp_rows = frappe.db.sql(
 		f"""
-		SELECT e.project AS project, SUM(e.net_amount) AS montant
-		FROM `tabExpense` e{exp_cm_join}
+		SELECT e.project, e.expense_date, e.net_amount
+		FROM `tabExpense` e
+		LEFT JOIN `tabProject` p ON p.name = e.project
 		WHERE e.docstatus < 2
 		  AND e.project IS NOT NULL AND e.project != ''
 		  AND e.expense_date BETWEEN %s AND %s{comp_exp}{cm_sql}
-		GROUP BY e.project
 		""",
-		tuple([start_date, end_date, *comp_exp_p, *cm_p]),
+		tuple([*window, *comp_exp_p, *cm_p]),
 		as_dict=True,
 	)
-	exp_map = {r.project: round(r.montant or 0) for r in exp_rows}
+	exp_map = {}
+	for r in exp_rows:
+		period = _period(r.expense_date)
+		if not period:
+			continue
+		kpi[period]["exp"] += r.net_amount or 0
+		if period == "cur":
+			exp_map[r.project] = exp_map.get(r.project, 0) + (r.net_amount or 0)
 
-	# --- Fabrication VT par projet sur la période -----------------------------
-	comp_fab = " AND f.company = %s" if company else ""
-	comp_fab_p = [company] if company else []
-	fab_cm_join = " JOIN `tabProject` p ON p.name = f.project" if cm_list else ""
+	# --- 5. Fabrications VT créées sur la fenêtre (hors annulées) -------------
+	# Bornes en datetime (demi-ouvertes) : pas de DATE() sur la colonne.
 	fab_rows = frappe.db.sql(
 		f"""
-		SELECT f.project AS project, SUM(f.manufacturing_costs) AS montant
-		FROM `tabFabrication VT` f{fab_cm_join}
+		SELECT f.project, f.creation, f.manufacturing_costs
+		FROM `tabFabrication VT` f
+		LEFT JOIN `tabProject` p ON p.name = f.project
 		WHERE f.status != 'Annulé'
 		  AND f.project IS NOT NULL AND f.project != ''
-		  AND DATE(f.creation) BETWEEN %s AND %s{comp_fab}{cm_sql}
-		GROUP BY f.project
+		  AND f.creation >= %s AND f.creation < %s{comp_fab}{cm_sql}
 		""",
-		tuple([start_date, end_date, *comp_fab_p, *cm_p]),
+		tuple([prev_start, frappe.utils.add_days(end_date, 1), *comp_fab_p, *cm_p]),
 		as_dict=True,
 	)
-	fab_map = {r.project: round(r.montant or 0) for r in fab_rows}
+	fab_map = {}
+	for r in fab_rows:
+		period = _period(r.creation)
+		if not period:
+			continue
+		kpi[period]["fab"] += r.manufacturing_costs or 0
+		if period == "cur":
+			fab_map[r.project] = fab_map.get(r.project, 0) + (r.manufacturing_costs or 0)
 
-	# --- CA facturé par projet sur la période ---------------------------------
-	si_cm_join = " JOIN `tabProject` p ON p.name = si.project" if cm_list else ""
-	ca_period_rows = frappe.db.sql(
-		f"""
-		SELECT si.project AS project, SUM(si.total) AS ca
-		FROM `tabSales Invoice` si{si_cm_join}
-		WHERE si.docstatus = 1 AND si.is_return = 0
-		  AND (si.is_down_payment_invoice = 0 OR si.is_down_payment_invoice IS NULL)
-		  AND si.project IS NOT NULL AND si.project != ''
-		  AND si.posting_date BETWEEN %s AND %s{comp_si}{cm_sql}
-		GROUP BY si.project
-		""",
-		tuple([start_date, end_date, *comp_psi, *cm_p]),
-		as_dict=True,
-	)
-	ca_map = {r.project: round(r.ca or 0) for r in ca_period_rows}
+	kpis = _finalize_kpis(kpi["cur"])
+	kpis_prev = _finalize_kpis(kpi["prev"])
+	ca_map = {k: round(v) for k, v in ca_map.items()}
+	po_map = {k: round(v) for k, v in po_map.items()}
+	exp_map = {k: round(v) for k, v in exp_map.items()}
+	fab_map = {k: round(v) for k, v in fab_map.items()}
 
 	# Chantiers de la période : il s'est passé QUELQUE CHOSE dessus, c.-à-d.
 	# pointage OU facturation OU commande fournisseur OU dépense OU fabrication.
 	project_names = list(dict.fromkeys(
-		[r.project for r in rows]
-		+ list(ca_map.keys()) + list(po_map.keys()) + list(exp_map.keys()) + list(fab_map.keys())
+		sorted(hours_map) + sorted(ca_map) + sorted(po_map) + sorted(exp_map) + sorted(fab_map)
 	))
 
-	# --- Batchs (une requête pour tous les projets listés) ---------------------
-	ca_period_map = ca_map  # déjà calculé ci-dessus (sert aussi à l'inclusion)
-	billed_all_map, last_activity_map = {}, {}
-	reception_map, incident_map = {}, {}
-	meta_map, theo_map = {}, {}
-	po_all_map, fab_all_map, expected_map, actual_map, so_total_map = {}, {}, {}, {}, {}
-	if project_names:
-		ph = ",".join(["%s"] * len(project_names))
-
-		for r in frappe.db.sql(
-			f"""
-			SELECT si.project, SUM(si.total) AS ca
-			FROM `tabSales Invoice` si
-			WHERE si.docstatus = 1 AND si.is_return = 0
-			  AND (si.is_down_payment_invoice = 0 OR si.is_down_payment_invoice IS NULL)
-			  AND si.project IN ({ph})
-			GROUP BY si.project
-			""",
-			tuple(project_names),
-			as_dict=True,
-		):
-			billed_all_map[r.project] = round(r.ca or 0)
+	# Chantiers "décrochés" : pointés la période PRÉCÉDENTE mais plus du tout
+	# pendant la période courante (filtrés plus bas sur statut / heures).
+	current_set = set(project_names)
+	candidates = sorted(pr for pr in prev_pointed if pr not in current_set)
 
+	# --- 6. Métadonnées projet (une requête pour tous les projets listés) ------
+	# Instantané financier, facturation cumulée, dernière activité, réceptions,
+	# incidents et noms complets des conducteurs/responsables.
+	meta_map = {}
+	user_names = {}
+	all_names = project_names + candidates
+	if all_names:
+		snapshot_cols = ", ".join(f"s.{f}" for f in SNAPSHOT_FIELDS)
 		for r in frappe.db.sql(
 			f"""
-			SELECT d.project, MAX(t.end_date) AS last_date
-			FROM `tabTimesheet` t
-			JOIN `tabTimesheet Detail` d ON d.parent = t.name
-			WHERE t.docstatus IN (0, 1) AND d.project IN ({ph})
-			GROUP BY d.project
+			SELECT p.name, p.status, p.project_type, p.expected_end_date, p.customer,
+			       p.total_sales_amount, p.custom_construction_manager, p.custom_project_manager,
+			       p.total_costing_amount, p.total_consumed_material_cost, p.total_expense_claim,
+			       p.custom_estimated_labor_hours,
+			       ucm.full_name AS cm_full_name, upm.full_name AS pm_full_name,
+			       s.name AS snapshot, {snapshot_cols},
+			       billed.ca AS billed_all, last_ts.last_date,
+			       rec.nb AS nb_receptions, inc.nb AS nb_incidents, inc.nb_open AS nb_incidents_ouverts
+			FROM `tabProject` p
+			LEFT JOIN `tabUser` ucm ON ucm.name = p.custom_construction_manager
+			LEFT JOIN `tabUser` upm ON upm.name = p.custom_project_manager
+			LEFT JOIN `tabProject Financial Snapshot` s ON s.name = p.name
+			LEFT JOIN (
+				SELECT si.project, SUM(si.total) AS ca
+				FROM `tabSales Invoice` si
+				WHERE si.docstatus = 1 AND si.is_return = 0
+				  AND (si.is_down_payment_invoice = 0 OR si.is_down_payment_invoice IS NULL)
+				  AND si.project IN %(names)s
+				GROUP BY si.project
+			) billed ON billed.project = p.name
+			LEFT JOIN (
+				SELECT d.project, MAX(t.end_date) AS last_date
+				FROM `tabTimesheet` t
+				JOIN `tabTimesheet Detail` d ON d.parent = t.name
+				WHERE t.docstatus IN (0, 1) AND d.project IN %(names)s
+				GROUP BY d.project
+			) last_ts ON last_ts.project = p.name
+			LEFT JOIN (
+				SELECT project, COUNT(*) AS nb
+				FROM `tabWork Completion Receipt`
+				WHERE project IN %(names)s
+				GROUP BY project
+			) rec ON rec.project = p.name
+			LEFT JOIN (
+				SELECT project, COUNT(*) AS nb,
+				       SUM(COALESCE(status, '') NOT IN ('Closed', 'Resolved', 'Fermé')) AS nb_open
+				FROM `tabQuality Incident`
+				WHERE project IN %(names)s
+				GROUP BY project
+			) inc ON inc.project = p.name
+			WHERE p.name IN %(names)s
 			""",
-			tuple(project_names),
+			{"names": all_names},
 			as_dict=True,
-		):
-			last_activity_map[r.project] = r.last_date
-
-		for r in frappe.db.get_all(
-			"Work Completion Receipt",
-			filters={"project": ["in", project_names]},
-			fields=["project", "name"],
-		):
-			reception_map.setdefault(r.project, []).append(r.name)
-
-		for r in frappe.db.get_all(
-			"Quality Incident",
-			filters={"project": ["in", project_names]},
-			fields=["project", "name", "status"],
-		):
-			incident_map.setdefault(r.project, []).append(r)
-
-		# Métadonnées projet (remplace un get_value par projet)
-		for r in frappe.db.sql(
-			f"""
-			SELECT name, status, project_type, expected_end_date, customer,
-			       total_sales_amount, custom_construction_manager, custom_project_manager,
-			       total_costing_amount, total_consumed_material_cost, total_expense_claim
-			FROM `tabProject` WHERE name IN ({ph})
-			""",
-			tuple(project_names), as_dict=True,
 		):
 			meta_map[r.name] = r
+			if r.custom_construction_manager and r.cm_full_name:
+				user_names[r.custom_construction_manager] = r.cm_full_name
+			if r.custom_project_manager and r.pm_full_name:
+				user_names[r.custom_project_manager] = r.pm_full_name
 
-		# Ventes/coûts théoriques par projet (Sales Order Items + Packed Items) —
-		# remplace get_theoretical. Somme sur tous les axes (= marge globale).
-		def _accum_theo(sql_rows):
-			for r in sql_rows:
-				e = theo_map.setdefault(r.project, {"vente": 0.0, "cost": 0.0})
-				e["vente"] += (r.vente or 0)
-				e["cost"] += (r.cost or 0)
-		_accum_theo(frappe.db.sql(
-			f"""
-			SELECT so.project AS project, SUM(soi.amount) AS vente,
-			       SUM(soi.qty * COALESCE(soi.base_unit_cost_price, 0)) AS cost
-			FROM `tabSales Order Item` soi
-			JOIN `tabSales Order` so ON so.name = soi.parent
-			WHERE so.project IN ({ph}) AND so.docstatus = 1
-			  AND so.custom_exclude_from_statistics != 1
-			  AND COALESCE(soi.product_bundle_name, '') = ''
-			GROUP BY so.project
-			""", tuple(project_names), as_dict=True))
-		_accum_theo(frappe.db.sql(
-			f"""
-			SELECT so.project AS project, SUM(pi.qty * pi.rate) AS vente,
-			       SUM(pi.qty * COALESCE(pi.base_unit_cost_price, 0)) AS cost
-			FROM `tabPacked Item` pi
-			JOIN `tabSales Order` so ON so.name = pi.parent AND pi.parenttype = 'Sales Order'
-			WHERE so.project IN ({ph}) AND so.docstatus = 1
-			  AND so.custom_exclude_from_statistics != 1
-			GROUP BY so.project
-			""", tuple(project_names), as_dict=True))
-
-		# Coûts réels : commandes fournisseur + fabrications (tout l'historique)
-		for r in frappe.db.sql(
-			f"""
-			SELECT poi.project AS project, SUM(poi.amount) AS total
-			FROM `tabPurchase Order Item` poi
-			JOIN `tabPurchase Order` po ON po.name = poi.parent
-			WHERE poi.project IN ({ph}) AND po.docstatus < 2
-			GROUP BY poi.project
-			""", tuple(project_names), as_dict=True):
-			po_all_map[r.project] = r.total or 0
-		for r in frappe.db.sql(
-			f"""
-			SELECT project, SUM(manufacturing_costs) AS total
-			FROM `tabFabrication VT`
-			WHERE project IN ({ph}) AND docstatus < 2
-			GROUP BY project
-			""", tuple(project_names), as_dict=True):
-			fab_all_map[r.project] = r.total or 0
-
-		# Heures prévues (Sales Order) et réalisées (Timesheet) — remplace
-		# get_project_labour_hours.
-		for r in frappe.db.sql(
-			f"""
-			SELECT project, SUM(custom_labour_hours) AS h, SUM(total) AS montant
-			FROM `tabSales Order`
-			WHERE project IN ({ph}) AND docstatus = 1 AND custom_exclude_from_statistics != 1
-			GROUP BY project
-			""", tuple(project_names), as_dict=True):
-			expected_map[r.project] = r.h or 0
-			so_total_map[r.project] = round(r.montant or 0)
-		for r in frappe.db.sql(
-			f"""
-			SELECT d.project AS project, SUM(d.hours) AS h
-			FROM `tabTimesheet Detail` d
-			JOIN `tabTimesheet` t ON t.name = d.parent
-			WHERE d.project IN ({ph}) AND t.docstatus != 2
-			GROUP BY d.project
-			""", tuple(project_names), as_dict=True):
-			actual_map[r.project] = r.h or 0
+		# Projets sans instantané (jamais touchés depuis sa mise en place) :
+		# calculés et enregistrés à la volée.
+		missing = [n for n in project_names if n in meta_map and not meta_map[n].snapshot]
+		for name, values in refresh_snapshots(missing).items():
+			meta_map[name].update(values)
+
+	def resolve(u):
+		return user_names.get(u, u) if u else ""
 
 	# --- Construction des lignes projet ---------------------------------------
 	projects = []
-	cm_users = set()
 	for name in project_names:
 		p = meta_map.get(name)
 		if not p:
@@ -484,30 +525,29 @@ def get_chantiers(start_date=None, end_date=None, company=None, conducteurs=None
 
 		is_facture = p.status == "Completed"
 
-		# Marges (données pré-agrégées en batch)
-		theo = theo_map.get(name, {})
-		theo_vente = theo.get("vente", 0)
-		theo_cost = theo.get("cost", 0)
+		# Marges (instantané financier du projet)
+		theo_vente = p.theo_vente_global or 0
+		theo_cost = p.theo_cost_global or 0
 		theo_margin = calculate_margin(theo_vente, theo_cost)
 		real_cost = (
 			(p.total_costing_amount or 0)
-			+ po_all_map.get(name, 0)
+			+ (p.total_purchase_order or 0)
 			+ (p.total_consumed_material_cost or 0)
 			+ (p.total_expense_claim or 0)
-			+ fab_all_map.get(name, 0)
+			+ (p.total_manufacturing_cost or 0)
 		)
 		real_margin = calculate_margin(theo_vente, real_cost)
 
 		hm = hours_map.get(name)
-		h_val = round(hm.h_val or 0) if hm else 0
-		h_draft = round(hm.h_draft or 0) if hm else 0
-		hours_expected = round(expected_map.get(name, 0))
-		hours_total = round(actual_map.get(name, 0))
+		h_val = round(hm["h_val"]) if hm else 0
+		h_draft = round(hm["h_draft"]) if hm else 0
+		hours_expected = round(p.expected_hours or 0)
+		hours_total = round(p.actual_hours or 0)
 
 		# Montant total du projet = somme des commandes client (Sales Orders),
 		# avec repli sur total_sales_amount si aucune commande.
-		total_sold = so_total_map.get(name, 0) or round(p.total_sales_amount or 0)
-		billed_all = billed_all_map.get(name, 0)
+		total_sold = round(p.total_sales_order or 0) or round(p.total_sales_amount or 0)
+		billed_all = round(p.billed_all or 0)
 		pct_facture = round(billed_all / total_sold * 100) if total_sold > 0 else 0
 		reste_a_facturer = max(0, total_sold - billed_all)
 
@@ -516,12 +556,6 @@ def get_chantiers(start_date=None, end_date=None, company=None, conducteurs=None
 			retard = frappe.utils.date_diff(frappe.utils.nowdate(), p.expected_end_date)
 			retard = retard if retard > 0 else 0
 
-		incidents = incident_map.get(name, [])
-		if p.custom_construction_manager:
-			cm_users.add(p.custom_construction_manager)
-		if p.custom_project_manager:
-			cm_users.add(p.custom_project_manager)
-
 		projects.append({
 			"project": name,
 			"client": p.customer or "",
@@ -529,7 +563,7 @@ def get_chantiers(start_date=None, end_date=None, company=None, conducteurs=None
 			"is_facture": is_facture,
 			"is_sav": is_facture and (h_val + h_draft) > 0,
 			"type_projet": p.project_type or "",
-			"ca_periode": ca_period_map.get(name, 0),
+			"ca_periode": ca_map.get(name, 0),
 			"po_periode": po_map.get(name, 0),
 			"depense_periode": exp_map.get(name, 0),
 			"fab_periode": fab_map.get(name, 0),
@@ -547,12 +581,14 @@ def get_chantiers(start_date=None, end_date=None, company=None, conducteurs=None
 			"reste_a_facturer": reste_a_facturer,
 			"expected_end_date": p.expected_end_date,
 			"retard": retard,
-			"derniere_activite": last_activity_map.get(name),
+			"derniere_activite": p.last_date,
 			"conducteur": p.custom_construction_manager or "",
 			"responsable": p.custom_project_manager or "",
-			"nb_receptions": len(reception_map.get(name, [])),
-			"nb_incidents": len(incidents),
-			"nb_incidents_ouverts": sum(1 for i in incidents if i.get("status") not in ("Closed", "Resolved", "Fermé")),
+			"conducteur_nom": resolve(p.custom_construction_manager),
+			"responsable_nom": resolve(p.custom_project_manager),
+			"nb_receptions": p.nb_receptions or 0,
+			"nb_incidents": p.nb_incidents or 0,
+			"nb_incidents_ouverts": int(p.nb_incidents_ouverts or 0),
 		})
 
 	# --- Chantiers "décrochés" -------------------------------------------------
@@ -560,216 +596,71 @@ def get_chantiers(start_date=None, end_date=None, company=None, conducteurs=None
 	# plus aucune heure n'a été pointée pendant la période courante. C'est le
 	# signal actionnable ("on a arrêté de pointer dessus"), et non la liste de
 	# tous les projets ouverts (bien trop nombreuse pour être pertinente).
-	prev_pointed = frappe.db.sql(
-		f"""
-		SELECT DISTINCT d.project
-		FROM `tabTimesheet` t
-		JOIN `tabTimesheet Detail` d ON d.parent = t.name{cm_join}
-		WHERE t.docstatus IN (0, 1)
-		  AND d.project IS NOT NULL AND d.project != ''
-		  AND t.end_date BETWEEN %s AND %s{comp_t}{cm_sql}
-		""",
-		tuple([prev_start, prev_end, *comp_pt, *cm_p]),
-		pluck="project",
-	)
-	current_set = set(project_names)
-	candidates = [pr for pr in prev_pointed if pr not in current_set]
 	sans_pointage = []
-	if candidates:
-		ph = ",".join(["%s"] * len(candidates))
-		sans_pointage = frappe.db.sql(
-			f"""
-			SELECT p.name AS project, p.customer, p.status, p.project_type,
-			       p.expected_end_date, p.custom_construction_manager AS conducteur
-			FROM `tabProject` p
-			WHERE p.name IN ({ph})
-			  AND p.status NOT IN ('Completed', 'Cancelled')
-			  AND p.custom_estimated_labor_hours > 1
-			ORDER BY p.expected_end_date ASC
-			""",
-			tuple(candidates),
-			as_dict=True,
-		)
-	for s in sans_pointage:
-		if s.conducteur:
-			cm_users.add(s.conducteur)
-		r = frappe.utils.date_diff(frappe.utils.nowdate(), s.expected_end_date) if s.expected_end_date else 0
-		s["retard"] = r if r > 0 else 0
+	for name in candidates:
+		p = meta_map.get(name)
+		if not p or not p.status or p.status in ("Completed", "Cancelled"):
+			continue
+		if not (p.custom_estimated_labor_hours or 0) > 1:
+			continue
+		r = frappe.utils.date_diff(frappe.utils.nowdate(), p.expected_end_date) if p.expected_end_date else 0
+		sans_pointage.append(frappe._dict({
+			"project": name,
+			"customer": p.customer,
+			"status": p.status,
+			"project_type": p.project_type,
+			"expected_end_date": p.expected_end_date,
+			"conducteur": p.custom_construction_manager,
+			"retard": r if r > 0 else 0,
+			"conducteur_nom": resolve(p.custom_construction_manager),
+		}))
+	# Tri par date de fin prévue croissante (les dates vides d'abord, comme en SQL)
+	sans_pointage.sort(key=lambda s: (s.expected_end_date is not None, s.expected_end_date or ""))
 
 	# --- Heures hors chantier par activité (vide si filtre conducteur) --------
-	activity = frappe.db.sql(
-		f"""
-		SELECT COALESCE(d.activity_type, 'Non défini') AS activity_type, SUM(d.hours) AS hours
-		FROM `tabTimesheet` t
-		JOIN `tabTimesheet Detail` d ON d.parent = t.name{cm_join}
-		WHERE t.docstatus = 1
-		  AND (d.project IS NULL OR d.project = '')
-		  AND COALESCE(d.activity_type, '') NOT IN ({excl})
-		  AND t.end_date BETWEEN %s AND %s{comp_t}{cm_sql}
-		GROUP BY d.activity_type
-		ORDER BY hours DESC
-		""",
-		tuple([*EXCLUDED_ACTIVITIES, start_date, end_date, *comp_pt, *cm_p]),
-		as_dict=True,
-	)
-	activity = [{"activity_type": a.activity_type, "hours": round(a.hours or 0)} for a in activity]
+	activity = [
+		{"activity_type": a if a is not None else "Non défini", "hours": round(h or 0)}
+		for a, h in sorted(activity_map.items(), key=lambda x: x[1], reverse=True)
+	]
 
 	# --- Répartition par conducteur de travaux --------------------------------
-	conducteurs_rows = frappe.db.sql(
-		f"""
-		SELECT COALESCE(NULLIF(p.custom_construction_manager, ''), '—') AS conducteur,
-		       SUM(CASE WHEN t.docstatus = 1 THEN d.hours ELSE 0 END) AS h_val,
-		       SUM(CASE WHEN t.docstatus = 0 THEN d.hours ELSE 0 END) AS h_draft,
-		       COUNT(DISTINCT d.project) AS nb_chantiers
-		FROM `tabTimesheet` t
-		JOIN `tabTimesheet Detail` d ON d.parent = t.name
-		JOIN `tabProject` p ON p.name = d.project
-		WHERE t.docstatus IN (0, 1)
-		  AND d.project IS NOT NULL AND d.project != ''
-		  AND t.end_date BETWEEN %s AND %s{comp_t}{cm_sql}
-		GROUP BY conducteur
-		ORDER BY h_val DESC
-		""",
-		tuple([start_date, end_date, *comp_pt, *cm_p]),
-		as_dict=True,
-	)
-	for c in conducteurs_rows:
-		c["h_val"] = round(c["h_val"] or 0)
-		c["h_draft"] = round(c["h_draft"] or 0)
-		if c["conducteur"] and c["conducteur"] != "—":
-			cm_users.add(c["conducteur"])
+	conducteurs_rows = []
+	for cm, c in sorted(conducteur_map.items(), key=lambda x: x[1]["h_val"], reverse=True):
+		conducteurs_rows.append(frappe._dict({
+			"conducteur": cm,
+			"h_val": round(c["h_val"]),
+			"h_draft": round(c["h_draft"]),
+			"nb_chantiers": len(c["projects"]),
+			"conducteur_nom": resolve(cm) if cm != "—" else "Sans conducteur",
+		}))
 
 	# --- Séries hebdomadaires (lundi = début de semaine) ----------------------
-	ca_week = frappe.db.sql(
-		f"""
-		SELECT DATE(DATE_SUB(si.posting_date, INTERVAL WEEKDAY(si.posting_date) DAY)) AS wk,
-		       SUM(si.total) AS ca
-		FROM `tabSales Invoice` si
-		JOIN `tabProject` p ON p.name = si.project
-		WHERE si.docstatus = 1 AND si.is_return = 0
-		  AND (si.is_down_payment_invoice = 0 OR si.is_down_payment_invoice IS NULL)
-		  AND p.custom_estimated_labor_hours > 1
-		  AND si.posting_date BETWEEN %s AND %s{comp_si}{cm_sql}
-		GROUP BY wk ORDER BY wk
-		""",
-		tuple([start_date, end_date, *comp_psi, *cm_p]),
-		as_dict=True,
-	)
-	hours_week = frappe.db.sql(
-		f"""
-		SELECT DATE(DATE_SUB(t.end_date, INTERVAL WEEKDAY(t.end_date) DAY)) AS wk,
-		       SUM(CASE WHEN t.docstatus = 1 THEN d.hours ELSE 0 END) AS val,
-		       SUM(CASE WHEN t.docstatus = 0 THEN d.hours ELSE 0 END) AS draft
-		FROM `tabTimesheet` t
-		JOIN `tabTimesheet Detail` d ON d.parent = t.name{cm_join}
-		WHERE t.docstatus IN (0, 1)
-		  AND COALESCE(d.activity_type, '') NOT IN ({excl})
-		  AND t.end_date BETWEEN %s AND %s{comp_t}{cm_sql}
-		GROUP BY wk ORDER BY wk
-		""",
-		tuple([*EXCLUDED_ACTIVITIES, start_date, end_date, *comp_pt, *cm_p]),
-		as_dict=True,
-	)
-	wk_map = {}
-	for r in ca_week:
-		wk_map.setdefault(str(r.wk), {"ca": 0, "val": 0, "draft": 0})["ca"] = round(r.ca or 0)
-	for r in hours_week:
-		e = wk_map.setdefault(str(r.wk), {"ca": 0, "val": 0, "draft": 0})
-		e["val"] = round(r.val or 0)
-		e["draft"] = round(r.draft or 0)
-	weekly = [{"week": k, **v} for k, v in sorted(wk_map.items())]
-
-	# --- Noms complets des utilisateurs ---------------------------------------
-	user_names = {}
-	if cm_users:
-		for u in frappe.db.get_all(
-			"User", filters={"name": ["in", list(cm_users)]},
-			fields=["name", "full_name"],
-		):
-			user_names[u.name] = u.full_name or u.name
-
-	def resolve(u):
-		return user_names.get(u, u) if u else ""
-
-	for p in projects:
-		p["conducteur_nom"] = resolve(p["conducteur"])
-		p["responsable_nom"] = resolve(p["responsable"])
-	for s in sans_pointage:
-		s["conducteur_nom"] = resolve(s.get("conducteur"))
-	for c in conducteurs_rows:
-		c["conducteur_nom"] = resolve(c["conducteur"]) if c["conducteur"] != "—" else "Sans conducteur"
-
-	# --- Options de filtres (indépendantes de la période) ---------------------
-	meta_conducteurs = frappe.db.sql(
+	weekly = [
+		{"week": k, "ca": round(v["ca"]), "val": round(v["val"]), "draft": round(v["draft"])}
+		for k, v in sorted(wk_map.items())
+	]
+
+	# --- 7. Options de filtres (indépendantes de la période) ------------------
+	meta_conducteurs, meta_companies = [], []
+	for r in frappe.db.sql(
 		"""
-		SELECT DISTINCT p.custom_construction_manager AS value,
-		       COALESCE(u.full_name, p.custom_construction_manager) AS label
-		FROM `tabProject` p
-		LEFT JOIN `tabUser` u ON u.name = p.custom_construction_manager
-		WHERE p.custom_construction_manager IS NOT NULL AND p.custom_construction_manager != ''
-		ORDER BY label
+		SELECT 'conducteur' AS kind, c.value, c.label FROM (
+			SELECT DISTINCT p.custom_construction_manager AS value,
+			       COALESCE(u.full_name, p.custom_construction_manager) AS label
+			FROM `tabProject` p
+			LEFT JOIN `tabUser` u ON u.name = p.custom_construction_manager
+			WHERE p.custom_construction_manager IS NOT NULL AND p.custom_construction_manager != ''
+		) c
+		UNION ALL
+		SELECT 'company' AS kind, name AS value, name AS label FROM `tabCompany`
+		ORDER BY kind, label
 		""",
 		as_dict=True,
-	)
-	meta_companies = frappe.get_all("Company", pluck="name", order_by="name")
-
-	# --- Noms exacts des documents composant chaque KPI ------------------------
-	# Le filtre "conducteur" porte sur le Projet, pas sur ces documents : le seul
-	# moyen d'ouvrir une liste qui reflète EXACTEMENT le total est de filtrer par
-	# `name IN [...]`. On renvoie donc la liste des documents de chaque KPI.
-	def _names(sql, params):
-		return frappe.db.sql(sql, tuple(params), pluck=True)
-
-	inv_names = _names(
-		f"""
-		SELECT si.name FROM `tabSales Invoice` si
-		JOIN `tabProject` p ON p.name = si.project
-		WHERE si.docstatus = 1 AND si.is_return = 0
-		  AND (si.is_down_payment_invoice = 0 OR si.is_down_payment_invoice IS NULL)
-		  AND p.custom_estimated_labor_hours > 1
-		  AND si.posting_date BETWEEN %s AND %s{comp_si}{cm_sql}
-		""",
-		[start_date, end_date, *comp_psi, *cm_p],
-	)
-	po_join2 = " JOIN `tabProject` p ON p.name = poi.project" if cm_list else ""
-	po_names = _names(
-		f"""
-		SELECT DISTINCT po.name FROM `tabPurchase Order Item` poi
-		JOIN `tabPurchase Order` po ON po.name = poi.parent{po_join2}
-		WHERE po.docstatus < 2 AND poi.project IS NOT NULL AND poi.project != ''
-		  AND po.transaction_date BETWEEN %s AND %s{comp_po}{cm_sql}
-		""",
-		[start_date, end_date, *comp_po_p, *cm_p],
-	)
-	exp_join2 = " JOIN `tabProject` p ON p.name = e.project" if cm_list else ""
-	exp_names = _names(
-		f"""
-		SELECT e.name FROM `tabExpense` e{exp_join2}
-		WHERE e.docstatus < 2 AND e.project IS NOT NULL AND e.project != ''
-		  AND e.expense_date BETWEEN %s AND %s{comp_exp}{cm_sql}
-		""",
-		[start_date, end_date, *comp_exp_p, *cm_p],
-	)
-	fab_join2 = " JOIN `tabProject` p ON p.name = f.project" if cm_list else ""
-	fab_names = _names(
-		f"""
-		SELECT f.name FROM `tabFabrication VT` f{fab_join2}
-		WHERE f.status != 'Annulé' AND f.project IS NOT NULL AND f.project != ''
-		  AND DATE(f.creation) BETWEEN %s AND %s{comp_fab}{cm_sql}
-		""",
-		[start_date, end_date, *comp_fab_p, *cm_p],
-	)
-	ts_join2 = " JOIN `tabProject` p ON p.name = d.project" if cm_list else ""
-	ts_draft_names = _names(
-		f"""
-		SELECT DISTINCT t.name FROM `tabTimesheet` t
-		JOIN `tabTimesheet Detail` d ON d.parent = t.name{ts_join2}
-		WHERE t.docstatus = 0
-		  AND COALESCE(d.activity_type, '') NOT IN ({excl})
-		  AND t.end_date BETWEEN %s AND %s{comp_t}{cm_sql}
-		""",
-		[*EXCLUDED_ACTIVITIES, start_date, end_date, *comp_pt, *cm_p],
-	)
+	):
+		if r.kind == "company":
+			meta_companies.append(r.value)
+		else:
+			meta_conducteurs.append({"value": r.value, "label": r.label})
 
 	return {
 		"period": {
@@ -780,13 +671,6 @@ def get_chantiers(start_date=None, end_date=None, company=None, conducteurs=None
 			"days": length + 1,
 		},
 		"meta": {"conducteurs": meta_conducteurs, "companies": meta_companies},
-		"doc_names": {
-			"ca": inv_names,
-			"po": po_names,
-			"depenses": exp_names,
-			"fabrication": fab_names,
-			"nonval": ts_draft_names,
-		},
 		"kpis": kpis,
 		"kpis_prev": kpis_prev,
 		"projects": projects,
@@ -795,3 +679,73 @@ def get_chantiers(start_date=None, end_date=None, company=None, conducteurs=None
 		"conducteurs": conducteurs_rows,
 		"weekly": weekly,
 	}
+
+
+# Requête des documents composant chaque KPI cliquable de la période courante
+# (mêmes conditions que les lectures fenêtrées de `_compute_chantiers`).
+# Placeholders : {company} (clause société), {cm} (clause conducteurs), {excl}.
+_DOC_NAMES_SQL = {
+	"ca": """
+		SELECT si.name FROM `tabSales Invoice` si
+		JOIN `tabProject` p ON p.name = si.project
+		WHERE si.docstatus = 1 AND si.is_return = 0
+		  AND (si.is_down_payment_invoice = 0 OR si.is_down_payment_invoice IS NULL)
+		  AND p.custom_estimated_labor_hours > 1
+		  AND si.posting_date BETWEEN %s AND %s{company}{cm}
+	""",
+	"po": """
+		SELECT DISTINCT po.name FROM `tabPurchase Order Item` poi
+		JOIN `tabPurchase Order` po ON po.name = poi.parent
+		LEFT JOIN `tabProject` p ON p.name = poi.project
+		WHERE po.docstatus < 2 AND poi.project IS NOT NULL AND poi.project != ''
+		  AND po.transaction_date BETWEEN %s AND %s{company}{cm}
+	""",
+	"depenses": """
+		SELECT e.name FROM `tabExpense` e
+		LEFT JOIN `tabProject` p ON p.name = e.project
+		WHERE e.docstatus < 2 AND e.project IS NOT NULL AND e.project != ''
+		  AND e.expense_date BETWEEN %s AND %s{company}{cm}
+	""",
+	"fabrication": """
+		SELECT f.name FROM `tabFabrication VT` f
+		LEFT JOIN `tabProject` p ON p.name = f.project
+		WHERE f.status != 'Annulé' AND f.project IS NOT NULL AND f.project != ''
+		  AND f.creation >= %s AND f.creation < %s{company}{cm}
+	""",
+	"nonval": """
+		SELECT DISTINCT t.name FROM `tabTimesheet` t
+		JOIN `tabTimesheet Detail` d ON d.parent = t.name
+		LEFT JOIN `tabProject` p ON p.name = d.project
+		WHERE t.docstatus = 0
+		  AND COALESCE(d.activity_type, '') NOT IN ({excl})
+		  AND t.end_date BETWEEN %s AND %s{company}{cm}
+	""",
+}
+_DOC_NAMES_ALIAS = {"ca": "si", "po": "po", "depenses": "e", "fabrication": "f", "nonval": "t"}
+
+
+@frappe.whitelist()
+def get_chantiers_doc_names(kind, start_date, end_date, company=None, conducteurs=None):
+	"""Noms exacts des documents composant un KPI de la vue Chantiers.
+
+	Le filtre "conducteur" porte sur le Projet, pas sur ces documents : le seul
+	moyen d'ouvrir une liste qui reflète EXACTEMENT le total est de filtrer par
+	`name IN [...]`. Appelé au clic sur une tuile, hors du chargement principal."""
+	if kind not in _DOC_NAMES_SQL:
+		frappe.throw(f"KPI inconnu : {kind}")
+
+	company_sql, company_p = _company_clause(company, _DOC_NAMES_ALIAS[kind])
+	cm_sql, cm_p = _cm_clause(_parse_list(conducteurs))
+	excl = ",".join(["%s"] * len(EXCLUDED_ACTIVITIES))
+	if kind == "fabrication":
+		# Bornes en datetime (demi-ouvertes) : pas de DATE() sur la colonne.
+		bounds = [start_date, frappe.utils.add_days(end_date, 1)]
+	else:
+		bounds = [start_date, end_date]
+	params = [*EXCLUDED_ACTIVITIES] if kind == "nonval" else []
+
+	return frappe.db.sql(
+		_DOC_NAMES_SQL[kind].format(company=company_sql, cm=cm_sql, excl=excl),
+		tuple([*params, *bounds, *company_p, *cm_p]),
+		pluck=True,
+	)
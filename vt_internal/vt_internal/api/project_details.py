@@ -1,296 +1,234 @@
 import frappe
 from frappe import _
+from frappe.model.db_query import DatabaseQuery
 
-from vt_internal.vt_internal.utils.margin_utils import get_theoretical, get_project_costs, calculate_margin
+from vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot import (
+    get_snapshots,
+)
+from vt_internal.vt_internal.utils.margin_utils import calculate_margin
 
-@frappe.whitelist(allow_guest=True)
-def project_details():
+# Détail d'un projet (modale « 📁 » des formulaires et des rapports).
+#
+# `get_project_details(project, section)` renvoie une section à la fois, en
+# JSON (`data`) accompagné de son rendu (`html`) :
+#   - "header"   : marges théoriques / réelles, paiements, totaux (instantané
+#                  financier + 3 requêtes agrégées) ;
+#   - "timeline" : tous les documents du projet en UNE requête UNION ALL ;
+#   - "events"   : événements du calendrier.
+# La modale (vt.project_details.show) demande les sections en parallèle et
+# affiche l'en-tête dès qu'il arrive. `project_details` reste disponible et
+# renvoie l'ensemble en un seul bloc HTML.
 
-    def get_expenses(project_id):
-        es = frappe.db.get_list('Expense',
-            filters={'project': project_id, 'docstatus': ['!=', 2]},
-            fields=["name", "custom_état", "net_amount", "expense_date"]
-        )
-        return [{
-            "doctype": "<span class='badge badge-danger'>Dépense</span>",
-            "doctype_label": "Dépense",
-            "name": f"<a href={frappe.utils.get_url_to_form('Expense', i.name)}>{i.name}</a>",
-            "status": i.custom_état,
-            "description": frappe.utils.fmt_money(i.net_amount, currency='EUR'),
-            "date": i.expense_date,
-        } for i in es]
-
-    def get_payment_entries(project_id):
-        pe = frappe.db.get_list('Payment Entry',
-            filters={'project': project_id, 'docstatus': ['!=', 2]},
-            fields=["name", "status", "paid_amount", "reference_date", "mode_of_payment", "payment_type"]
-        )
-        return [{
-            "doctype": "<span class='badge badge-warning'>Ecriture de paiement</span>",
-            "doctype_label": "Ecriture de paiement",
-            "name": f"<a href={frappe.utils.get_url_to_form('Payment Entry', i.name)}>{i.name}</a>",
-            "status": i.status,
-            "description": frappe.utils.fmt_money(i.paid_amount, currency='EUR') + (i.mode_of_payment or "") + " " + _(i.payment_type, context='Payment Entry'),
-            "date": i.reference_date,
-        } for i in pe]
-
-    def get_purchase_orders(project_id):
-        pos = frappe.db.get_list('Purchase Order',
-            filters=[['docstatus', '!=', 2], ["Purchase Order Item", "project", "=", project_id]],
-            fields=["name", "status", "transaction_date", "supplier", "net_total as total"],
-            distinct=True,
-        )
-        total_purchase_order = frappe.db.sql("""
-            SELECT COALESCE(SUM(poi.amount), 0) as total
-            FROM `tabPurchase Order Item` poi
-            INNER JOIN `tabPurchase Order` po ON po.name = poi.parent
-            WHERE poi.project = %s AND po.docstatus < 2
-        """, project_id)[0][0] or 0
-        items = [{
-            "doctype": "<span class='badge badge-secondary'>Commande fournisseur</span>",
-            "doctype_label": "Commande fournisseur",
-            "name": f"<a href={frappe.utils.get_url_to_form('Purchase Order', i.name)}>{i.name}</a>",
-            "status": i.status,
-            "description": frappe.utils.fmt_money(i.total, currency='EUR') + i.supplier,
-            "date": i.transaction_date,
-        } for i in pos]
-        return items, total_purchase_order
-
-    def get_visite_techniques(project_id):
-        vts = frappe.db.get_list('Visite Technique',
-            filters={'projet': project_id, 'docstatus': ['!=', 2]},
-            fields=["name", "status", "creation", "plans", "photo_5", "photo_2", "photo_3", "photo_4"]
-        )
-        return [{
-            "doctype": "<span class='badge badge-secondary'>Visite technique</span>",
-            "doctype_label": "Visite technique",
-            "name": f"<a href={frappe.utils.get_url_to_form('Visite Technique', i.name)}>{i.name}</a>",
-            "status": i.status,
-            "description": f"{sum(1 for p in [i.plans, i.photo_2, i.photo_3, i.photo_4, i.photo_5] if p)} photos",
-            "date": i.creation,
-        } for i in vts]
-
-    def get_fiches_travail(project_id):
-        ft = frappe.db.get_list('Fiche de travail',
-            filters={'projet': project_id, 'docstatus': ['!=', 2]},
-            fields=["name", "status", "creation", "time_spent", "labor_costs"]
-        )
-        return [{
-            "doctype": "<span class='badge badge-secondary' style='background-color: #52159e'>Fiche de travail</span>",
-            "doctype_label": "Fiche de travail",
-            "name": f"<a href={frappe.utils.get_url_to_form('Fiche de travail', i.name)}>{i.name}</a>",
-            "status": i.status,
-            "description": "",
-            "date": i.creation,
-        } for i in ft]
-
-    def get_timesheets(project_id):
-        result = frappe.db.sql("""
-            SELECT COALESCE(SUM(tsd.hours), 0) as hours
-            FROM `tabTimesheet Detail` tsd
-            JOIN `tabTimesheet` ts ON ts.name = tsd.parent
-            WHERE tsd.project = %s AND ts.docstatus != 2
-        """, project_id, as_dict=True)
-        time_spent = round(result[0].hours, 2) if result else 0
-        return time_spent
-
-    def get_fabrications(project_id):
-        fab = frappe.db.get_list('Fabrication VT',
-            filters={'project': project_id, 'docstatus': ['!=', 2]},
-            fields=["name", "status", "creation", "article", "manufacturing_costs", "quantity"]
-        )
-        total_manufacturing_cost = sum(i.manufacturing_costs for i in fab)
-        items = [{
-            "doctype": "<span class='badge badge-secondary'>Fabrication</span>",
-            "doctype_label": "Fabrication",
-            "name": f"<a href={frappe.utils.get_url_to_form('Fabrication VT', i.name)}>{i.quantity} x {i.article}</a>",
-            "status": i.status,
-            "description": frappe.utils.fmt_money(i.manufacturing_costs, currency='EUR'),
-            "date": i.creation,
-        } for i in fab]
-        return items, total_manufacturing_cost
-
-    def get_purchase_invoices(project_id):
-        pis = frappe.db.get_list('Purchase Invoice',
-            filters={'docstatus': ['!=', 2]},
-            or_filters=[["Purchase Invoice Item", "project", "=", project_id], ["project", "=", project_id]],
-            fields=["name", "status", "posting_date", "supplier", "grand_total as total", 'custom_mode_of_paiement'],
-            distinct=True,
-        )
-        return [{
-            "doctype": "<span class='badge badge-danger'>Facture d'achat</span>",
-            "doctype_label": "Facture d'achat",
-            "name": f"<a href={frappe.utils.get_url_to_form('Purchase Invoice', i.name)}>{i.name}</a>",
-            "status": i.status,
-            "description": frappe.utils.fmt_money(i.total, currency='EUR') + (i.custom_mode_of_paiement or ""),
-            "date": i.posting_date,
-        } for i in pis]
-
-    def get_sales_invoices(project_id):
-        sis = frappe.db.get_list('Sales Invoice',
-            filters={'project': project_id, 'docstatus': ['!=', 2]},
-            fields=["name", "status", "total", "posting_date", "is_down_payment_invoice", "grand_total"]
-        )
-        return [{
-            "doctype": "<span class='badge badge-success'>Facture d'acompte</span>" if i.is_down_payment_invoice else "<span class='badge badge-success'>Facture de vente</span>",
-            "doctype_label": "Facture d'acompte" if i.is_down_payment_invoice else "Facture de vente",
-            "name": f"<a href={frappe.utils.get_url_to_form('Sales Invoice', i.name)}>{i.name}</a>",
-            "status": i.status,
-            "description": frappe.utils.fmt_money(i.grand_total if i.is_down_payment_invoice else i.total, currency='EUR'),
-            "date": i.posting_date,
-        } for i in sis]
-
-    def get_quality_incidents(project_id):
-        iqs = frappe.db.get_list('Quality Incident',
-            filters={'project': project_id},
-            fields=["name", "origine", "total_costs", 'object', 'status', 'date']
-        )
-        return [{
-            "doctype": "<span class='badge badge-dark'>Incident Qualité</span>",
-            "doctype_label": "Incident Qualité",
-            "name": f"<a href={frappe.utils.get_url_to_form('Quality Incident', i.name)}>{i.object}</a>",
-            "status": i.status,
-            "description": (i.origine or "") + " " + frappe.utils.fmt_money(i.total_costs, currency='EUR'),
-            "date": i.date,
-        } for i in iqs]
-
-    def get_work_completion_receipts(project_id):
-        rts = frappe.db.get_list('Work Completion Receipt',
-            filters={'project': project_id, 'docstatus': ["!=", 2]},
-            fields=["name", "docstatus", 'le']
-        )
-        return [{
-            "doctype": "<span class='badge badge-success' style='background-color: #0f0bcf'>Réception de travaux</span>",
-            "doctype_label": "Réception de travaux",
-            "name": f"<a href={frappe.utils.get_url_to_form('Work Completion Receipt', i.name)}>{i.name}</a>",
-            "status": "Non signé" if i.docstatus == 0 else "Signé",
-            "description": "",
-            "date": i.le,
-        } for i in rts]
-
-    def get_supplier_quotations(project_id):
-        qss = frappe.db.get_list('Supplier Quotation',
-            filters={'project': project_id, 'docstatus': ['!=', 2]},
-            fields=["name", "status", "total", "transaction_date", "supplier_name"]
-        )
-        return [{
-            "doctype": "<span class='badge badge-info' style='background-color: #6fc5e8;'>Devis fournisseur</span>",
-            "doctype_label": "Devis fournisseur",
-            "name": f"<a href={frappe.utils.get_url_to_form('Supplier Quotation', i.name)}>{i.name}</a>",
-            "status": i.status,
-            "description": frappe.utils.fmt_money(i.total, currency='EUR') + " " + i.supplier_name,
-            "date": i.transaction_date,
-        } for i in qss]
-
-    def get_quotations(project_id):
-        qs = frappe.db.get_list('Quotation',
-            filters={'project': project_id, 'docstatus': ['!=', 2]},
-            fields=["name", "status", "total", "transaction_date"]
-        )
-        return [{
-            "doctype": "<span class='badge badge-info'>Devis</span>",
-            "doctype_label": "Devis",
-            "name": f"<a href={frappe.utils.get_url_to_form('Quotation', i.name)}>{i.name}</a>",
-            "status": i.status,
-            "description": frappe.utils.fmt_money(i.total, currency='EUR'),
-            "date": i.transaction_date,
-        } for i in qs]
-
-    def get_delivery_notes(project_id):
-        dns = frappe.db.get_list('Delivery Note',
-            filters={'project': project_id, 'docstatus': ['!=', 2]},
-            fields=["name", "status", "posting_date", "custom_livré"]
-        )
-        return [{
-            "doctype": "<span class='badge badge-info'>Bon de livraison</span>",
-            "doctype_label": "Bon de livraison",
-            "name": f"<a href={frappe.utils.get_url_to_form('Delivery Note', i.name)}>{i.name}</a>",
-            "status": i.status,
-            "description": "Livré" if i.custom_livré else "",
-            "date": i.posting_date
-        } for i in dns]
-
-    def get_sales_orders(project_id):
-        sos = frappe.db.get_list('Sales Order',
-            filters={'project': project_id, 'docstatus': ['!=', 2], 'custom_exclude_from_statistics': ['!=', 1]},
-            fields=["name", "status", "grand_total", "total", "transaction_date", "markup_percentage", "custom_labour_hours"]
-        )
-        items = [{
-            "doctype": "<span class='badge badge-info'>Commande client</span>",
-            "doctype_label": "Commande client",
-            "name": f"<a href={frappe.utils.get_url_to_form('Sales Order', i.name)}>{i.name}</a>",
-            "status": i.status,
-            "description": frappe.utils.fmt_money(i.total, currency='EUR'),
-            "date": i.transaction_date
-        } for i in sos]
-        return items, sos
-
-    def get_sales_invoices_for_payments(project_id):
-        si = frappe.db.sql("""
-            SELECT status, is_down_payment_invoice,
-                SUM(grand_total) as grand_total,
-                SUM(outstanding_amount) as outstanding_amount
-            FROM `tabSales Invoice`
-            WHERE docstatus = 1 AND project = %s
-            GROUP BY is_down_payment_invoice
-        """, project_id, as_dict=True)
-        return si
-
-    def get_events(project_id):
-        events = frappe.db.get_list('Event',
-            filters={'project': project_id},
-            fields=["name", "subject", "starts_on", "color"],
-            order_by="starts_on asc"
+SECTIONS = ("header", "timeline", "events")
+
+# Branches de la timeline : (doctype, libellé, badge, SELECT).
+# Chaque SELECT renvoie les colonnes nommées name, title, status, amount, info,
+# flag, date ; `%(project)s` est le seul paramètre. La table du doctype n'est pas
+# aliasée : les conditions de permission (`tabDoctype`.champ) sont ajoutées à la
+# fin du WHERE. L'ordre de la liste est l'ordre d'affichage à date égale.
+TIMELINE_SOURCES = [
+    ("Expense", "Dépense", "<span class='badge badge-danger'>Dépense</span>", """
+        SELECT name, name AS title, `custom_état` AS status, net_amount AS amount,
+               NULL AS info, NULL AS flag, expense_date AS date
+        FROM `tabExpense`
+        WHERE project = %(project)s AND docstatus != 2
+    """),
+    ("Payment Entry", "Ecriture de paiement", "<span class='badge badge-warning'>Ecriture de paiement</span>", """
+        SELECT name, name AS title, status, paid_amount AS amount,
+               mode_of_payment AS info, payment_type AS flag, reference_date AS date
+        FROM `tabPayment Entry`
+        WHERE project = %(project)s AND docstatus != 2
+    """),
+    ("Purchase Order", "Commande fournisseur", "<span class='badge badge-secondary'>Commande fournisseur</span>", """
+        SELECT name, name AS title, status, net_total AS amount,
+               supplier AS info, NULL AS flag, transaction_date AS date
+        FROM `tabPurchase Order`
+        WHERE docstatus != 2
+          AND EXISTS (
+              SELECT 1 FROM `tabPurchase Order Item` poi
+              WHERE poi.parent = `tabPurchase Order`.name AND poi.project = %(project)s
+          )
+    """),
+    ("Visite Technique", "Visite technique", "<span class='badge badge-secondary'>Visite technique</span>", """
+        SELECT name, name AS title, status, NULL AS amount,
+               (COALESCE(plans, '') != '') + (COALESCE(photo_2, '') != '') + (COALESCE(photo_3, '') != '')
+                 + (COALESCE(photo_4, '') != '') + (COALESCE(photo_5, '') != '') AS info,
+               NULL AS flag, creation AS date
+        FROM `tabVisite Technique`
+        WHERE projet = %(project)s AND docstatus != 2
+    """),
+    ("Fiche de travail", "Fiche de travail", "<span class='badge badge-secondary' style='background-color: #52159e'>Fiche de travail</span>", """
+        SELECT name, name AS title, status, NULL AS amount, NULL AS info, NULL AS flag, creation AS date
+        FROM `tabFiche de travail`
+        WHERE projet = %(project)s AND docstatus != 2
+    """),
+    ("Fabrication VT", "Fabrication", "<span class='badge badge-secondary'>Fabrication</span>", """
+        SELECT name, article AS title, status, manufacturing_costs AS amount,
+               NULL AS info, quantity AS flag, creation AS date
+        FROM `tabFabrication VT`
+        WHERE project = %(project)s AND docstatus != 2
+    """),
+    ("Purchase Invoice", "Facture d'achat", "<span class='badge badge-danger'>Facture d'achat</span>", """
+        SELECT name, name AS title, status, grand_total AS amount,
+               custom_mode_of_paiement AS info, NULL AS flag, posting_date AS date
+        FROM `tabPurchase Invoice`
+        WHERE docstatus != 2
+          AND (project = %(project)s OR EXISTS (
+              SELECT 1 FROM `tabPurchase Invoice Item` pii
+              WHERE pii.parent = `tabPurchase Invoice`.name AND pii.project = %(project)s
+          ))
+    """),
+    ("Sales Invoice", "Facture de vente", "<span class='badge badge-success'>Facture de vente</span>", """
+        SELECT name, name AS title, status, IF(is_down_payment_invoice, grand_total, total) AS amount,
+               NULL AS info, is_down_payment_invoice AS flag, posting_date AS date
+        FROM `tabSales Invoice`
+        WHERE project = %(project)s AND docstatus != 2
+    """),
+    ("Quality Incident", "Incident Qualité", "<span class='badge badge-dark'>Incident Qualité</span>", """
+        SELECT name, object AS title, status, total_costs AS amount, origine AS info, NULL AS flag, date
+        FROM `tabQuality Incident`
+        WHERE project = %(project)s
+    """),
+    ("Work Completion Receipt", "Réception de travaux", "<span class='badge badge-success' style='background-color: #0f0bcf'>Réception de travaux</span>", """
+        SELECT name, name AS title, IF(docstatus = 0, 'Non signé', 'Signé') AS status,
+               NULL AS amount, NULL AS info, NULL AS flag, le AS date
+        FROM `tabWork Completion Receipt`
+        WHERE project = %(project)s AND docstatus != 2
+    """),
+    ("Supplier Quotation", "Devis fournisseur", "<span class='badge badge-info' style='background-color: #6fc5e8;'>Devis fournisseur</span>", """
+        SELECT name, name AS title, status, total AS amount, supplier_name AS info, NULL AS flag, transaction_date AS date
+        FROM `tabSupplier Quotation`
+        WHERE project = %(project)s AND docstatus != 2
+    """),
+    ("Quotation", "Devis", "<span class='badge badge-info'>Devis</span>", """
+        SELECT name, name AS title, status, total AS amount, NULL AS info, NULL AS flag, transaction_date AS date
+        FROM `tabQuotation`
+        WHERE project = %(project)s AND docstatus != 2
+    """),
+    ("Delivery Note", "Bon de livraison", "<span class='badge badge-info'>Bon de livraison</span>", """
+        SELECT name, name AS title, status, NULL AS amount, NULL AS info, `custom_livré` AS flag, posting_date AS date
+        FROM `tabDelivery Note`
+        WHERE project = %(project)s AND docstatus != 2
+    """),
+    ("Sales Order", "Commande client", "<span class='badge badge-info'>Commande client</span>", """
+        SELECT name, name AS title, status, total AS amount, NULL AS info, NULL AS flag, transaction_date AS date
+        FROM `tabSales Order`
+        WHERE project = %(project)s AND docstatus != 2 AND IFNULL(custom_exclude_from_statistics, 0) != 1
+    """),
+]
+
+DOWN_PAYMENT_LABEL = "Facture d'acompte"
+DOWN_PAYMENT_BADGE = "<span class='badge badge-success'>Facture d'acompte</span>"
+
+
+def _money(value):
+    return frappe.utils.fmt_money(value, currency='EUR')
+
+
+def _margin_color(real, theoretical):
+    return "success" if real >= theoretical else "warning" if real > (theoretical - 7) else "danger"
+
+
+# --- En-tête : marges, paiements, totaux ------------------------------------
+
+def get_header(project_id):
+    """Chiffres de l'en-tête : marges théoriques (instantané) et réelles,
+    temps passé, avancement des paiements et décomposition du bénéfice."""
+    project = frappe.db.get_value(
+        "Project", project_id,
+        ["total_costing_amount", "total_expense_claim", "total_sales_amount"],
+        as_dict=True,
+    )
+    if not project:
+        frappe.throw(_("Project {0} not found").format(project_id), frappe.DoesNotExistError)
+    snapshot = get_snapshots([project_id])[project_id]
+
+    sales_orders = frappe.db.sql("""
+        SELECT COALESCE(SUM(grand_total), 0) AS grand_total,
+               COALESCE(SUM(custom_labour_hours), 0) AS labour_hours
+        FROM `tabSales Order`
+        WHERE project = %s AND docstatus != 2 AND IFNULL(custom_exclude_from_statistics, 0) != 1
+    """, project_id, as_dict=True)[0]
+    payments = frappe.db.sql("""
+        SELECT is_down_payment_invoice,
+            SUM(grand_total) as grand_total,
+            SUM(outstanding_amount) as outstanding_amount
+        FROM `tabSales Invoice`
+        WHERE docstatus = 1 AND project = %s
+        GROUP BY is_down_payment_invoice
+    """, project_id, as_dict=True)
+
+    grand_total_sold_ttc = max(1, sales_orders.grand_total)
+
+    def _pct(down_payment, paid):
+        total = sum(
+            (s.grand_total - s.outstanding_amount) if paid else s.outstanding_amount
+            for s in payments
+            if bool(s.is_down_payment_invoice) == down_payment
         )
-        return events
+        return round(total / grand_total_sold_ttc * 100)
 
-    project_id = frappe.form_dict.get("project")
-    project = frappe.get_doc("Project", project_id)
-    theo_vente_global, theo_cost_global = get_theoretical(project_id, "global")
-    theo_vente_tp, theo_cost_tp = get_theoretical(project_id, "Temps passé")
-    theo_vente_ach, theo_cost_ach = get_theoretical(project_id, "Achats")
-    theoretical_margin = round(calculate_margin(theo_vente_global, theo_cost_global))
-    theo_margin_ach = round(calculate_margin(theo_vente_ach, theo_cost_ach))
-    items = []
-    items.extend(get_expenses(project_id))
-    items.extend(get_payment_entries(project_id))
-    po_items, total_purchase_order = get_purchase_orders(project_id)
-    items.extend(po_items)
-    items.extend(get_visite_techniques(project_id))
-    items.extend(get_fiches_travail(project_id))
-    time_spent = get_timesheets(project_id)
-    fab_items, total_manufacturing_cost = get_fabrications(project_id)
-    items.extend(fab_items)
-    items.extend(get_purchase_invoices(project_id))
-    items.extend(get_sales_invoices(project_id))
-    items.extend(get_quality_incidents(project_id))
-    items.extend(get_work_completion_receipts(project_id))
-    items.extend(get_supplier_quotations(project_id))
-    items.extend(get_quotations(project_id))
-    items.extend(get_delivery_notes(project_id))
-    so_items, sales_orders = get_sales_orders(project_id)
-    items.extend(so_items)
-    grand_total_sold_ttc = max(1, sum(s.grand_total for s in sales_orders))
-    sales_invoices_payments = get_sales_invoices_for_payments(project_id)
-    per_down_payment_paid = round(sum((s.grand_total - s.outstanding_amount if s.is_down_payment_invoice else 0 for s in sales_invoices_payments)) / grand_total_sold_ttc * 100)
-    per_down_payment_unpaid = round(sum((s.outstanding_amount if s.is_down_payment_invoice else 0 for s in sales_invoices_payments)) / grand_total_sold_ttc * 100)
-    per_billed_paid = round(sum((s.grand_total - s.outstanding_amount) if not s.is_down_payment_invoice else 0 for s in sales_invoices_payments)/grand_total_sold_ttc*100)
-    per_billed_unpaid = round(sum([s.outstanding_amount if not s.is_down_payment_invoice else 0 for s in sales_invoices_payments])/grand_total_sold_ttc*100)
-    labour_hours = sum(i.custom_labour_hours or 0 for i in sales_orders) or 0
-    items = sorted(items, key=lambda k: frappe.utils.getdate(k['date']) if k['date'] else frappe.utils.getdate('1900-01-01'))
-    total_purchases = total_purchase_order + project.total_expense_claim
-    total_expenses = total_purchases + project.total_costing_amount + total_manufacturing_cost
-    real_cost_ach = total_purchases + total_manufacturing_cost
-    real_margin_ach = round(calculate_margin(theo_vente_ach, real_cost_ach))
-    vente = theo_vente_global or project.total_sales_amount
+    theoretical_margin = round(calculate_margin(snapshot.theo_vente_global, snapshot.theo_cost_global))
+    theo_margin_ach = round(calculate_margin(snapshot.theo_vente_ach, snapshot.theo_cost_ach))
+
+    total_costing_amount = project.total_costing_amount or 0
+    total_manufacturing_cost = snapshot.total_manufacturing_cost or 0
+    total_purchases = (snapshot.total_purchase_order or 0) + (project.total_expense_claim or 0)
+    total_expenses = total_purchases + total_costing_amount + total_manufacturing_cost
+    real_margin_ach = round(calculate_margin(snapshot.theo_vente_ach, total_purchases + total_manufacturing_cost))
+    vente = snapshot.theo_vente_global or project.total_sales_amount or 0
     real_margin = round(calculate_margin(vente, total_expenses))
-    real_margin_color = "success" if real_margin >= theoretical_margin else "warning" if real_margin > (theoretical_margin - 7) else "danger"
-    ach_margin_color = "success" if real_margin_ach >= theo_margin_ach else "warning" if real_margin_ach > (theo_margin_ach - 7) else "danger"
-    time_spent_color = "success" if time_spent <= labour_hours else "warning" if time_spent < labour_hours * 1.1 else "danger"
-    diff_global = real_margin - theoretical_margin
-    diff_ach = real_margin_ach - theo_margin_ach
-    diff_time = time_spent - labour_hours
-    has_pose_vt = labour_hours > 0 or time_spent > 0
+
+    labour_hours = sales_orders.labour_hours or 0
+    time_spent = round(snapshot.actual_hours or 0, 2)
+
+    return {
+        "margins": {
+            "theoretical": theoretical_margin,
+            "real": real_margin,
+            "diff": real_margin - theoretical_margin,
+            "color": _margin_color(real_margin, theoretical_margin),
+        },
+        "margins_ach": {
+            "theoretical": theo_margin_ach,
+            "real": real_margin_ach,
+            "diff": real_margin_ach - theo_margin_ach,
+            "color": _margin_color(real_margin_ach, theo_margin_ach),
+        },
+        "hours": {
+            "expected": labour_hours,
+            "spent": time_spent,
+            "diff": time_spent - labour_hours,
+            "color": "success" if time_spent <= labour_hours else "warning" if time_spent < labour_hours * 1.1 else "danger",
+        },
+        "has_pose_vt": labour_hours > 0 or time_spent > 0,
+        "payments": {
+            "down_payment_paid": _pct(True, True),
+            "down_payment_unpaid": _pct(True, False),
+            "billed_paid": _pct(False, True),
+            "billed_unpaid": _pct(False, False),
+        },
+        "totals": {
+            "vente": vente,
+            "purchases": total_purchases,
+            "manufacturing": total_manufacturing_cost,
+            "labour": total_costing_amount,
+            "profit": vente - total_expenses,
+        },
+    }
+
+
+def _total_html(label, value):
+    return f"""
+          <p style="margin: 0; color: black; font-size: 16px; margin-top:30px; font-weight: bolder;">-</p>
+          <div style="text-align: center;">
+            <p style="margin: 0; color: gray; font-size: 16px;">{label}</p>
+            <p style="color: red; font-size: 24px; margin: 5px 0;">{_money(value)}</p>
+          </div>"""
+
+
+def render_header(h):
+    m, ach, hours, pay, totals = h["margins"], h["margins_ach"], h["hours"], h["payments"], h["totals"]
     marges_table = f"""
         <table class="table mb-0">
             <thead>
@@ -304,87 +242,34 @@ def project_details():
             <tbody>
                 <tr>
                     <td>Marge globale</td>
-                    <td>{theoretical_margin} %</td>
-                    <td>{real_margin} %</td>
-                    <td class="text-{real_margin_color}"><b>{diff_global} pp</b></td>
+                    <td>{m["theoretical"]} %</td>
+                    <td>{m["real"]} %</td>
+                    <td class="text-{m["color"]}"><b>{m["diff"]} pp</b></td>
                 </tr>
         """
-    if has_pose_vt:
+    if h["has_pose_vt"]:
         marges_table += f"""
                 <tr>
                     <td>Temps passé</td>
-                    <td>{labour_hours} h</td>
-                    <td>{time_spent} h</td>
-                    <td class="text-{time_spent_color}"><b>{diff_time} h</b></td>
+                    <td>{hours["expected"]} h</td>
+                    <td>{hours["spent"]} h</td>
+                    <td class="text-{hours["color"]}"><b>{hours["diff"]} h</b></td>
                 </tr>
                 <tr>
                     <td>Marge sur achats</td>
-                    <td>{theo_margin_ach} %</td>
-                    <td>{real_margin_ach} %</td>
-                    <td class="text-{ach_margin_color}"><b>{diff_ach} pp</b></td>
+                    <td>{ach["theoretical"]} %</td>
+                    <td>{ach["real"]} %</td>
+                    <td class="text-{ach["color"]}"><b>{ach["diff"]} pp</b></td>
                 </tr>
             """
     marges_table += """
             </tbody>
         </table>
         """
-    mo_html = ""
-    if project.total_costing_amount > 0:
-        mo_html = f"""
-          <p style="margin: 0; color: black; font-size: 16px; margin-top:30px; font-weight: bolder;">-</p>
-          <div style="text-align: center;">
-            <p style="margin: 0; color: gray; font-size: 16px;">Total MO</p>
-            <p style="color: red; font-size: 24px; margin: 5px 0;">{frappe.utils.fmt_money(project.total_costing_amount, currency='EUR')}</p>
-          </div>"""
-    manufacturing_html = ""
-    if total_manufacturing_cost > 0:
-        manufacturing_html = f"""
-          <p style="margin: 0; color: black; font-size: 16px; margin-top:30px; font-weight: bolder;">-</p>
-          <div style="text-align: center;">
-            <p style="margin: 0; color: gray; font-size: 16px;">Total fabrication</p>
-            <p style="color: red; font-size: 24px; margin: 5px 0;">{frappe.utils.fmt_money(total_manufacturing_cost, currency='EUR')}</p>
-          </div>"""
-    purchase_html = ""
-    if total_purchases > 0:
-        purchase_html = f"""
-          <p style="margin: 0; color: black; font-size: 16px; margin-top:30px; font-weight: bolder;">-</p>
-          <div style="text-align: center;">
-            <p style="margin: 0; color: gray; font-size: 16px;">Total des achats (HT)</p>
-            <p style="color: red; font-size: 24px; margin: 5px 0;">{frappe.utils.fmt_money(total_purchases, currency='EUR')}</p>
-          </div>"""
-    temps_du_projet = frappe.utils.date_diff(items[-1]["date"], items[0]["date"]) if items else 0
-
-    # Section Événements
-    events = get_events(project_id)
-    events_tags = ""
-    for e in events:
-        color = e.color or "#6c757d"
-        date_str = frappe.utils.format_date(e.starts_on, "dd/MM/yyyy") if e.starts_on else ""
-        events_tags += f'''<a href="#" onclick="frappe.set_route('Form', 'Event', '{e.name}')" title="{e.subject or ''}"><span class="badge" style="background-color: {color}; cursor: pointer;">{date_str}</span></a>'''
-    events_html = f"""
-        <div style="margin-top: 20px;">
-            <h4>Événements</h4>
-            <div style="display: flex; flex-wrap: wrap; gap: 8px;">
-                {events_tags}
-            </div>
-        </div>
-    """ if events else ""
-
-    content_rows = [
-        f"""<tr data-doctype="{i["doctype_label"]}">
-                <td>{i["doctype"]}</td>
-                <td>{i["name"]}</td>
-                <td>{i["description"]}</td>
-                <td>{_(i["status"])}</td>
-                <td>{frappe.utils.format_date(i["date"])}</td>
-            </tr>""" for i in items
-        ]
-    content = "".join(content_rows)
-
-    # Générer les options du filtre à partir des types de documents présents
-    doctype_labels = sorted(set(i["doctype_label"] for i in items))
-    filter_options = "".join([f'<option value="{label}">{label}</option>' for label in doctype_labels])
-    html = f"""<div>
+    purchase_html = _total_html("Total des achats (HT)", totals["purchases"]) if totals["purchases"] > 0 else ""
+    manufacturing_html = _total_html("Total fabrication", totals["manufacturing"]) if totals["manufacturing"] > 0 else ""
+    mo_html = _total_html("Total MO", totals["labour"]) if totals["labour"] > 0 else ""
+    return f"""<div>
         <div style="display: flex; flex-direction: row; justify-content: space-between;">
             <div style="width: 45%">
               <h4>Marges</h4>
@@ -394,30 +279,128 @@ def project_details():
                 <h4>Paiements</h4>
                 Acompte:
                 <div class="progress" style="height: 20px;">
-                  <div class="progress-bar bg-success" role="progressbar" style="width: {per_down_payment_paid}%">{per_down_payment_paid}% Payé</div>
-                  <div class="progress-bar bg-info" role="progressbar" style="width: {per_down_payment_unpaid}%">{per_down_payment_unpaid}% Non payé</div>
+                  <div class="progress-bar bg-success" role="progressbar" style="width: {pay["down_payment_paid"]}%">{pay["down_payment_paid"]}% Payé</div>
+                  <div class="progress-bar bg-info" role="progressbar" style="width: {pay["down_payment_unpaid"]}%">{pay["down_payment_unpaid"]}% Non payé</div>
                 </div>
                 Facture finale:
                 <div class="progress" style="height: 20px;">
-                  <div class="progress-bar bg-success" role="progressbar" style="width: {per_billed_paid}%">{per_billed_paid}% Payé</div>
-                  <div class="progress-bar bg-info" role="progressbar" style="width: {per_billed_unpaid}%">{per_billed_unpaid}% Non payé</div>
+                  <div class="progress-bar bg-success" role="progressbar" style="width: {pay["billed_paid"]}%">{pay["billed_paid"]}% Payé</div>
+                  <div class="progress-bar bg-info" role="progressbar" style="width: {pay["billed_unpaid"]}%">{pay["billed_unpaid"]}% Non payé</div>
                 </div>
             </div>
         </div>
         <div style="display: flex; justify-content: space-between; width: 100%; padding-top:20px; padding-bottom:20px; box-sizing: border-box;">
           <div style="text-align: center;">
             <p style="margin: 0; color: gray; font-size: 16px;">Total commandé (HT)</p>
-            <p style="color: green; font-size: 24px; margin: 5px 0;">{frappe.utils.fmt_money(vente, currency='EUR')}</p>
+            <p style="color: green; font-size: 24px; margin: 5px 0;">{_money(totals["vente"])}</p>
           </div>
     {purchase_html}
     {manufacturing_html}
     {mo_html}
           <p style="margin: 0; color: black; font-size: 16px; margin-top:30px; font-weight: bolder;">=</p>
           <div style="text-align: center;">
-            <p style="margin: 0; color: gray; font-size: 16px;">Bénéfice ({real_margin} % de marge)</p>
-            <p style="color: blue; font-size: 24px; margin: 5px 0;">{frappe.utils.fmt_money(vente - total_expenses, currency='EUR')}</p>
+            <p style="margin: 0; color: gray; font-size: 16px;">Bénéfice ({m["real"]} % de marge)</p>
+            <p style="color: blue; font-size: 24px; margin: 5px 0;">{_money(totals["profit"])}</p>
           </div>
         </div>
+        </div>"""
+
+
+# --- Timeline : tous les documents du projet --------------------------------
+
+def _describe(doctype, r):
+    """Texte de la colonne « Description » selon le type de document."""
+    if doctype == "Payment Entry":
+        return _money(r.amount) + (r.info or "") + " " + _(r.flag, context='Payment Entry')
+    if doctype == "Purchase Order":
+        return _money(r.amount) + (r.info or "")
+    if doctype == "Visite Technique":
+        return f"{frappe.utils.cint(r.info)} photos"
+    if doctype == "Purchase Invoice":
+        return _money(r.amount) + (r.info or "")
+    if doctype == "Quality Incident":
+        return (r.info or "") + " " + _money(r.amount)
+    if doctype == "Supplier Quotation":
+        return _money(r.amount) + " " + (r.info or "")
+    if doctype == "Delivery Note":
+        return "Livré" if frappe.utils.cint(r.flag) else ""
+    if doctype in ("Fiche de travail", "Work Completion Receipt"):
+        return ""
+    return _money(r.amount)
+
+
+def _match_conditions(doctype):
+    """Conditions de permission (User Permissions, « si propriétaire »…) que
+    get_list appliquerait à `doctype`."""
+    conditions = DatabaseQuery(doctype).build_match_conditions(as_condition=True)
+    return f" AND ({conditions})" if conditions else ""
+
+
+def get_timeline(project_id):
+    """Documents du projet triés par date, en une seule requête UNION ALL.
+
+    Les types de document que l'utilisateur ne peut pas lire sont exclus, et
+    chaque branche porte les conditions de permission de son doctype."""
+    frappe.has_permission("Project", "read", project_id, throw=True)
+    sources = [
+        (i, src) for i, src in enumerate(TIMELINE_SOURCES)
+        if frappe.has_permission(src[0], "read")
+    ]
+    if not sources:
+        return []
+
+    union = "\nUNION ALL\n".join(
+        f"SELECT {i} AS source, t.* FROM ({sql}{_match_conditions(doctype)}) t"
+        for i, (doctype, _label, _badge, sql) in sources
+    )
+    rows = frappe.db.sql(
+        f"""
+        SELECT source, name, title, status, amount, info, flag, date
+        FROM ({union}) timeline
+        ORDER BY DATE(COALESCE(date, '1900-01-01')), source
+        """,
+        {"project": project_id},
+        as_dict=True,
+    )
+
+    items = []
+    for r in rows:
+        doctype, label, badge, _sql = TIMELINE_SOURCES[r.source]
+        if doctype == "Sales Invoice" and frappe.utils.cint(r.flag):
+            label, badge = DOWN_PAYMENT_LABEL, DOWN_PAYMENT_BADGE
+        title = r.title
+        if doctype == "Fabrication VT":
+            title = f"{frappe.utils.flt(r.flag):g} x {r.title}"
+        items.append({
+            "doctype": doctype,
+            "doctype_label": label,
+            "badge": badge,
+            "name": r.name,
+            "title": title,
+            "url": frappe.utils.get_url_to_form(doctype, r.name),
+            "status": r.status,
+            "description": _describe(doctype, r),
+            "date": r.date,
+        })
+    return items
+
+
+def render_timeline(items):
+    content = "".join(
+        f"""<tr data-doctype="{i["doctype_label"]}">
+                <td>{i["badge"]}</td>
+                <td><a href={i["url"]}>{i["title"]}</a></td>
+                <td>{i["description"]}</td>
+                <td>{_(i["status"])}</td>
+                <td>{frappe.utils.format_date(i["date"])}</td>
+            </tr>""" for i in items
+    )
+    temps_du_projet = frappe.utils.date_diff(items[-1]["date"], items[0]["date"]) if items else 0
+
+    # Générer les options du filtre à partir des types de documents présents
+    doctype_labels = sorted(set(i["doctype_label"] for i in items))
+    filter_options = "".join([f'<option value="{label}">{label}</option>' for label in doctype_labels])
+    return f"""<div>
         <table class="table" id="documents-table">
             <thead>
                 <tr>
@@ -451,6 +434,59 @@ def project_details():
             }});
         </script>
         <p style="color: black; font-size: 16px; font-weight: bolder;">Durée totale du projet: {temps_du_projet} jours</p>
-{events_html}
         </div>"""
-    frappe.response['message'] = {"html": html}
\ No newline at end of file
+
+
+# --- Événements ---------------------------------------------------------------
+
+def get_events(project_id):
+    return frappe.db.get_list('Event',
+        filters={'project': project_id},
+        fields=["name", "subject", "starts_on", "color"],
+        order_by="starts_on asc"
+    )
+
+
+def render_events(events):
+    if not events:
+        return ""
+    events_tags = ""
+    for e in events:
+        color = e.color or "#6c757d"
+        date_str = frappe.utils.format_date(e.starts_on, "dd/MM/yyyy") if e.starts_on else ""
+        events_tags += f'''<a href="#" onclick="frappe.set_route('Form', 'Event', '{e.name}')" title="{e.subject or ''}"><span class="badge" style="background-color: {color}; cursor: pointer;">{date_str}</span></a>'''
+    return f"""
+        <div style="margin-top: 20px;">
+            <h4>Événements</h4>
+            <div style="display: flex; flex-wrap: wrap; gap: 8px;">
+                {events_tags}
+            </div>
+        </div>
+    """
+
+
+_SECTION_HANDLERS = {
+    "header": (get_header, render_header),
+    "timeline": (get_timeline, render_timeline),
+    "events": (get_events, render_events),
+}
+
+
+@frappe.whitelist()
+def get_project_details(project, section):
+    """Une section du détail projet : {"data": ..., "html": ...}."""
+    if section not in SECTIONS:
+        frappe.throw(_("Section inconnue : {0}").format(section))
+    frappe.has_permission("Project", "read", project, throw=True)
+    get, render = _SECTION_HANDLERS[section]
+    data = get(project)
+    return {"data": data, "html": render(data)}
+
+
+@frappe.whitelist()
+def project_details():
+    """Détail complet d'un projet en un seul bloc HTML (toutes les sections)."""
+    project_id = frappe.form_dict.get("project")
+    frappe.has_permission("Project", "read", project_id, throw=True)
+    html = "".join(render(get(project_id)) for get, render in _SECTION_HANDLERS.values())
+    frappe.response['message'] = {"html": html}
@@ -0,0 +1,42 @@
+# Copyright (c) 2026, Verre & Transparence and Contributors
+# For license information, please see license.txt
+
+import time
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import getdate
+
+from vt_internal.vt_internal.api.chantiers import (
+	CACHE_INDEX,
+	CACHE_TTL,
+	_cache_key,
+	invalidate_chantiers_cache,
+)
+
+
+class TestChantiersCache(FrappeTestCase):
+	def _fill(self, start_date, end_date):
+		"""Met une réponse en cache comme get_chantiers."""
+		key = _cache_key(start_date, end_date, "_Test Company", [])
+		frappe.cache.set_value(key, {"rows": []}, expires_in_sec=CACHE_TTL)
+		frappe.cache.hset(CACHE_INDEX, key, (getdate(start_date), getdate(end_date), time.time() + CACHE_TTL))
+		self.addCleanup(frappe.cache.hdel, CACHE_INDEX, key)
+		self.addCleanup(frappe.cache.delete_value, key)
+		return key
+
+	def test_invalidation_deletes_cached_response(self):
+		key = self._fill("2026-01-01", "2026-01-31")
+		self.assertIsNotNone(frappe.cache.get_value(key))
+
+		invalidate_chantiers_cache(["2026-01-15"])
+
+		self.assertIsNone(frappe.cache.get_value(key))
+		self.assertIsNone(frappe.cache.hget(CACHE_INDEX, key))
+
+	def test_invalidation_keeps_other_windows(self):
+		key = self._fill("2026-03-01", "2026-03-31")
+
+		invalidate_chantiers_cache(["2026-01-15"])
+
+		self.assertIsNotNone(frappe.cache.get_value(key))
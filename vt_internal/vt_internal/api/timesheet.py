@@ -5,6 +5,8 @@ URLs courtes historiques préservées via override_whitelisted_methods (hooks.py
 Source de vérité : ces fichiers (versionnés). Les records DB ont été supprimés.
 """
 
+from datetime import datetime, time, timezone
+
 import frappe
 
 from vt_internal.vt_internal.constants import (
@@ -15,9 +17,12 @@ from vt_internal.vt_internal.constants import (
     TASK_DAY_NOT_STARTED,
     TASK_PAUSE,
 )
-from vt_internal.vt_internal.utils.time_utils import round_to_quarter
+from vt_internal.vt_internal.utils.time_utils import hours_between, round_to_quarter
 
 ONE_MINUTE = 1 / 60
+# Ancienneté maximale (en jours, depuis le début de la veille) d'une action
+# rejouée depuis la file hors ligne : au-delà, saisie manuelle dans la feuille.
+MAX_QUEUED_ACTION_DAYS = 1
 
 
 # ---------------------------------------------------------------------------
@@ -104,14 +109,36 @@ def _allowed_actions(task):
     return actions
 
 
+# État du jour par utilisateur, en cache Redis : le widget de pointage l'interroge
+# en continu pour chaque employé connecté. Oublié (après commit) quand la feuille
+# de temps de l'employé, ses événements du jour, sa fiche Employee ou une fiche
+# de travail changent ; la durée de vie borne le reste (ex. adresse modifiée).
+STATE_CACHE_PREFIX = "vt_timesheet_state:"
+STATE_CACHE_TTL = 3600
+
+
 @frappe.whitelist()
 def timesheet_state():
-    """État de pointage du jour de l'employé courant + actions autorisées."""
-    employee = frappe.db.get_value("Employee", {"user_id": frappe.session.user}, "name")
+    """État de pointage du jour de l'employé courant + actions autorisées.
+
+    Servi depuis le cache sans requête SQL ; recalculé au premier appel du jour
+    ou après invalidation."""
+    key = STATE_CACHE_PREFIX + frappe.session.user
+    today = frappe.utils.today()
+    state = frappe.cache.get_value(key)
+    if state is None or state.get("date") != today:
+        state = _build_state(frappe.session.user, today)
+        frappe.cache.set_value(key, state, expires_in_sec=STATE_CACHE_TTL)
+    return state
+
+
+def _build_state(user, today):
+    employee = frappe.db.get_value("Employee", {"user_id": user}, ["name", "employee_name"], as_dict=True)
 
     state = {
-        "employee": employee,
-        "employee_name": frappe.db.get_value("Employee", employee, "employee_name") if employee else None,
+        "date": today,
+        "employee": employee.name if employee else None,
+        "employee_name": employee.employee_name if employee else None,
         "timesheet": None,
         "current_task": TASK_DAY_NOT_STARTED,
         "from_time": None,        # début de journée (1er log)
@@ -121,8 +148,8 @@ def timesheet_state():
         "total_hours": 0,               # total pointé aujourd'hui (heures)
     }
 
-    ts_name = frappe.db.exists("Timesheet", {
-        "employee": employee, "start_date": frappe.utils.today(), "docstatus": 0,
+    ts_name = employee and frappe.db.exists("Timesheet", {
+        "employee": employee.name, "start_date": today, "docstatus": 0,
     })
     if ts_name:
         doc = frappe.get_doc("Timesheet", ts_name)
@@ -144,12 +171,71 @@ def timesheet_state():
                 state["current_task"] = last.activity_type
                 state["task_from_time"] = last.from_time
 
-    state["today_events"] = _today_events(employee) if employee else []
+    state["today_events"] = _today_events(employee.name, today) if employee else []
     state["actions"] = _allowed_actions(state["current_task"])
     return state
 
 
-def _today_events(employee):
+def invalidate_timesheet_state(users=None):
+    """Oublie l'état de pointage de ces utilisateurs (de tous si None), au commit.
+
+    Après le commit : un appel concurrent ne peut pas remettre en cache l'état
+    d'avant la modification."""
+    pending = frappe.flags.get("vt_timesheet_state_pending")
+    if pending is None:
+        pending = frappe.flags.vt_timesheet_state_pending = set()
+        frappe.db.after_commit.add(_flush_state_invalidation)
+        frappe.db.after_rollback.add(_discard_state_invalidation)
+    if users is None:
+        pending.add(None)
+    else:
+        pending.update(u for u in users if u)
+
+
+def invalidate_timesheet_state_for_employees(employees):
+    employees = [e for e in set(employees) if e]
+    if employees:
+        invalidate_timesheet_state(
+            frappe.get_all("Employee", filters={"name": ["in", employees]}, pluck="user_id")
+        )
+
+
+def invalidate_timesheet_state_for_fiches(fiches):
+    """État en cache des seuls employés concernés par ces fiches : planifiés
+    dessus aujourd'hui (Event) ou qui y pointent sur leur feuille du jour."""
+    fiches = [f for f in set(fiches) if f]
+    if not fiches:
+        return
+    today = frappe.utils.getdate()
+    employees = frappe.db.sql_list(
+        """
+        SELECT e.`custom_employé` FROM `tabEvent` e
+        WHERE e.custom_fiche_de_travail IN %(fiches)s
+          AND e.starts_on >= %(today)s AND e.starts_on < %(tomorrow)s
+        UNION
+        SELECT ts.employee FROM `tabTimesheet` ts
+        INNER JOIN `tabTimesheet Detail` tsd ON tsd.parent = ts.name AND tsd.parenttype = 'Timesheet'
+        WHERE tsd.custom_fiche_de_travail IN %(fiches)s
+          AND ts.start_date = %(today)s AND ts.docstatus = 0
+        """,
+        {"fiches": fiches, "today": today, "tomorrow": frappe.utils.add_days(today, 1)},
+    )
+    invalidate_timesheet_state_for_employees(employees)
+
+
+def _flush_state_invalidation():
+    users = frappe.flags.pop("vt_timesheet_state_pending", None) or set()
+    if None in users:
+        frappe.cache.delete_keys(STATE_CACHE_PREFIX)
+    elif users:
+        frappe.cache.delete_value([STATE_CACHE_PREFIX + u for u in users])
+
+
+def _discard_state_invalidation():
+    frappe.flags.pop("vt_timesheet_state_pending", None)
+
+
+def _today_events(employee, today):
     """Événements planifiés aujourd'hui pour l'employé (table Event).
 
     Un Event porte `custom_employé` (nom Employee) et `starts_on`. Selon les
@@ -157,6 +243,7 @@ def _today_events(employee):
       - `fiche`  : lié à une fiche de travail (custom_fiche_de_travail) ;
       - `visite` : lié à une visite technique (custom_visite_technique) ;
       - `event`  : autre événement (agenda simple).
+    Adresses jointes dans la même requête (plus de lecture Address par événement).
     """
     rows = frappe.db.sql(
         """
@@ -170,35 +257,28 @@ def _today_events(employee):
             ft.`référence_pièce` AS fiche_reference,
             ft.status AS fiche_status,
             ft.address AS fiche_address,
-            vt.address AS visite_address
+            vt.address AS visite_address,
+            a.address_line1, a.address_line2, a.city, a.pincode
         FROM `tabEvent` e
         LEFT JOIN `tabFiche de travail` ft ON ft.name = e.custom_fiche_de_travail
         LEFT JOIN `tabVisite Technique` vt ON vt.name = e.custom_visite_technique
+        LEFT JOIN `tabAddress` a
+            ON a.name = IF(IFNULL(e.custom_fiche_de_travail, '') != '', ft.address, vt.address)
         WHERE e.custom_employé = %s
           AND DATE(e.starts_on) = %s
         ORDER BY e.starts_on
         """,
-        (employee, frappe.utils.today()),
+        (employee, today),
         as_dict=True,
     )
     for r in rows:
         r["kind"] = "fiche" if r.fiche else ("visite" if r.visite else "event")
-        r["maps"] = _address_query(r.fiche_address if r.fiche else r.visite_address)
+        r["maps"] = _address_query(r.pop("address_line1"), r.pop("address_line2"), r.pop("city"), r.pop("pincode"))
     return rows
 
 
-def _address_query(address_name):
-    """Adresse formatée (pour une recherche Google Maps) depuis un lien Address."""
-    if not address_name:
-        return None
-    a = frappe.db.get_value(
-        "Address", address_name,
-        ["address_line1", "address_line2", "city", "pincode"],
-        as_dict=True,
-    )
-    if not a:
-        return None
-    parts = [a.address_line1, a.address_line2, a.city, a.pincode]
+def _address_query(*parts):
+    """Adresse formatée (pour une recherche Google Maps) depuis les lignes d'une Address."""
     return ", ".join(p for p in parts if p) or None
 
 
@@ -232,11 +312,11 @@ def _close_last_log(doc, rounded_time, duration, drop_if_shorter_than=ONE_MINUTE
         doc.time_logs[-1].hours = duration
 
 
-def _act_start_construction(doc, rounded_time, duration):
-    fiche_de_travail = frappe.form_dict.get("fiche_de_travail")
-    project = frappe.form_dict.get("project")
-    activity_type = frappe.form_dict.get("activity_type") or ACTIVITY_ATELIER
-    sav = frappe.form_dict.get("sav") or 0
+def _act_start_construction(doc, rounded_time, duration, params):
+    fiche_de_travail = params.get("fiche_de_travail")
+    project = params.get("project")
+    activity_type = params.get("activity_type") or ACTIVITY_ATELIER
+    sav = params.get("sav") or 0
 
     _close_last_log(doc, rounded_time, duration)
 
@@ -251,7 +331,7 @@ def _act_start_construction(doc, rounded_time, duration):
     doc.save()
 
 
-def _act_start_break(doc, rounded_time, duration):
+def _act_start_break(doc, rounded_time, duration, params):
     # Une pause = on ferme simplement le log courant (pas de nouveau log).
     if duration is None:
         return
@@ -264,23 +344,23 @@ def _act_start_break(doc, rounded_time, duration):
     doc.save()
 
 
-def _act_stop_day(doc, rounded_time, duration):
+def _act_stop_day(doc, rounded_time, duration, params):
     _close_last_log(doc, rounded_time, duration)
     doc.custom_day_finished = True
     doc.save()
 
 
-def _act_duplicate(doc, rounded_time, duration):
-    new_employee = frappe.form_dict.get("new_employee")
+def _act_duplicate(doc, rounded_time, duration, params):
+    new_employee = params.get("new_employee")
     new_timesheet = frappe.copy_doc(doc)
     new_timesheet.employee = new_employee
     new_timesheet.title = f"{new_employee} dupliqué"
-    new_timesheet.note = (new_timesheet.note or "") + (frappe.form_dict.get("comment") or "") + "\n"
+    new_timesheet.note = (new_timesheet.note or "") + (params.get("comment") or "") + "\n"
     new_timesheet.save()
 
 
-def _act_add_comment(doc, rounded_time, duration):
-    doc.note = (doc.note or "") + (frappe.form_dict.get("comment") or "") + "\n"
+def _act_add_comment(doc, rounded_time, duration, params):
+    doc.note = (doc.note or "") + (params.get("comment") or "") + "\n"
     doc.save()
 
 
@@ -293,31 +373,184 @@ _ACTIONS = {
 }
 
 
-@frappe.whitelist()
-def timesheet_post_api():
-    # Converti depuis le Server Script API « timesheet_post_api ».
-    action = frappe.form_dict.get("action")
+# Actions rapides : sur la feuille du jour déjà créée, seules les lignes touchées
+# sont écrites (cf. _PointageTimesheet) ; les autres passent par doc.save().
+_FAST_ACTIONS = ("start_construction", "start_break", "stop_day")
+
+_LOG_FIELDS = (
+    "name", "idx", "activity_type", "from_time", "to_time", "hours", "project", "custom_fiche_de_travail",
+    "costing_rate", "costing_amount",
+)
+
+
+class _PointageTimesheet:
+    """Feuille de temps brouillon réduite à ce que les actions de pointage lisent
+    et modifient (dernier log, ajout, suppression, fin de journée).
+
+    `save()` n'écrit que les lignes ajoutées, modifiées ou retirées, puis les
+    totaux de l'en-tête, sans recharger ni revalider toute la feuille :
+    l'arrondi et les heures des lignes sont déjà calculés par l'action, le coût
+    des lignes écrites l'est ici (`_set_costing`), et la validation complète
+    d'ERPNext (chevauchements, facturation) a lieu à la validation (submit) de
+    la feuille. Reprend les effets de bord de
+    events/timesheet (fiche « En cours », instantanés projet, état en cache)."""
+
+    def __init__(self, name):
+        self.name = name
+        header = frappe.db.get_value(
+            "Timesheet", name, ["employee", "custom_day_finished"], as_dict=True, for_update=True
+        )
+        self.employee = header.employee
+        self.custom_day_finished = header.custom_day_finished
+        self.time_logs = frappe.get_all(
+            "Timesheet Detail",
+            filters={"parent": name, "parenttype": "Timesheet", "parentfield": "time_logs"},
+            fields=list(_LOG_FIELDS),
+            order_by="idx asc",
+            for_update=True,
+        )
+        self._original = {row.name: frappe._dict(row) for row in self.time_logs}
+
+    def append(self, fieldname, values):
+        self.time_logs.append(frappe._dict(values))
+
+    def save(self):
+        kept = {row.name for row in self.time_logs if row.get("name")}
+        removed = [row for name, row in self._original.items() if name not in kept]
+        updated = [
+            row for row in self.time_logs
+            if row.get("name")
+            and (row.to_time, row.hours) != (self._original[row.name].to_time, self._original[row.name].hours)
+        ]
+        added = [row for row in self.time_logs if not row.get("name")]
+
+        for row in updated + added:
+            if row.from_time and row.to_time and row.to_time < row.from_time:
+                frappe.throw(f"Fin avant le début sur la ligne {row.get('idx') or len(self.time_logs)}")
+
+        for row in updated + added:
+            self._set_costing(row)
+
+        now, user = frappe.utils.now(), frappe.session.user
+        if removed:
+            frappe.db.sql("DELETE FROM `tabTimesheet Detail` WHERE name IN %s", ([row.name for row in removed],))
+        for row in updated:
+            frappe.db.sql(
+                """
+                UPDATE `tabTimesheet Detail`
+                SET to_time = %s, hours = %s, costing_rate = %s, costing_amount = %s, modified = %s
+                WHERE name = %s
+                """,
+                (row.to_time, row.hours, row.costing_rate, row.costing_amount, now, row.name),
+            )
+        next_idx = max((row.idx for row in self.time_logs if row.get("idx")), default=0)
+        for row in added:
+            next_idx += 1
+            child = frappe.new_doc("Timesheet Detail")
+            child.update(row)
+            child.update({
+                "parent": self.name, "parenttype": "Timesheet", "parentfield": "time_logs", "idx": next_idx,
+                "hours": row.get("hours") or 0,
+            })
+            child.db_insert()
+            row.update(name=child.name, idx=next_idx)
+
+        frappe.db.sql(
+            """
+            UPDATE `tabTimesheet`
+            SET total_hours = (
+                    SELECT IFNULL(SUM(hours), 0) FROM `tabTimesheet Detail`
+                    WHERE parent = %(name)s AND parenttype = 'Timesheet'
+                ),
+                total_costing_amount = (
+                    SELECT IFNULL(SUM(costing_amount), 0) FROM `tabTimesheet Detail`
+                    WHERE parent = %(name)s AND parenttype = 'Timesheet'
+                ),
+                custom_day_finished = %(day_finished)s,
+                modified = %(now)s,
+                modified_by = %(user)s
+            WHERE name = %(name)s
+            """,
+            {"name": self.name, "day_finished": 1 if self.custom_day_finished else 0, "now": now, "user": user},
+        )
+
+        self._after_save(added, updated, removed)
+
+    def _set_costing(self, row):
+        """Coût de la ligne, comme Timesheet.update_cost d'ERPNext : taux de
+        l'Activity Cost de l'employé (à défaut de l'Activity Type) si la ligne
+        n'en a pas, multiplié par les heures."""
+        from erpnext.projects.doctype.timesheet.timesheet import get_activity_cost
+
+        if not frappe.utils.flt(row.get("costing_rate")) and row.get("activity_type"):
+            rate = get_activity_cost(self.employee, row.activity_type) or {}
+            row.costing_rate = frappe.utils.flt(rate.get("costing_rate"))
+        row.costing_rate = frappe.utils.flt(row.get("costing_rate"))
+        row.costing_amount = row.costing_rate * frappe.utils.flt(row.get("hours"))
+
+    def _after_save(self, added, updated, removed):
+        from vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot import (
+            refresh_snapshots_after_commit,
+        )
+        from vt_internal.vt_internal.events.timesheet import start_fiches
+
+        start_fiches({row.custom_fiche_de_travail for row in added if row.get("custom_fiche_de_travail")})
+        # Heures réalisées : seules les lignes dont les heures changent comptent
+        # (une ligne ouverte vaut 0 h), rafraîchies après le commit.
+        changed = [row for row in added + removed if frappe.utils.flt(row.get("hours"))]
+        changed += [
+            row for row in updated
+            if frappe.utils.flt(row.hours) != frappe.utils.flt(self._original[row.name].hours)
+        ]
+        refresh_snapshots_after_commit({row.get("project") for row in changed})
+        invalidate_timesheet_state_for_employees([self.employee])
+
+
+def _current_employee():
+    # Verrou par employé jusqu'à la fin de la transaction : deux appuis (ou deux
+    # files rejouées) simultanés s'exécutent l'un après l'autre (pas de double
+    # feuille du jour, pas de log fermé deux fois). La lecture qui suit (feuille,
+    # logs, actions déjà rejouées) se fait aussi FOR UPDATE : une lecture simple
+    # verrait l'instantané REPEATABLE READ pris avant l'attente du verrou.
+    employee = frappe.db.sql(
+        "SELECT name, company FROM `tabEmployee` WHERE user_id = %s LIMIT 1 FOR UPDATE",
+        (frappe.session.user,),
+        as_dict=True,
+    )
+    if not employee:
+        frappe.throw("Aucun employé lié à cet utilisateur")
+    return employee[0]
+
+
+def _apply_action(employee, action, params, at):
+    """Applique une action de pointage horodatée `at` sur la feuille brouillon
+    du jour de `at` (créée au besoin) ; renvoie le nom de la feuille."""
     handler = _ACTIONS.get(action)
     if not handler:
         frappe.throw(f"Action de pointage inconnue : {action}")
 
-    employee = frappe.db.get_value("Employee", {"user_id": frappe.session.user}, "name")
-    company = frappe.db.get_value("Employee", {"user_id": frappe.session.user}, "company")
-    activity_type = frappe.form_dict.get("activity_type") or ACTIVITY_ATELIER
+    activity_type = params.get("activity_type") or ACTIVITY_ATELIER
+    rounded_time = round_to_quarter(at)
 
-    rounded_time = round_to_quarter(frappe.utils.now_datetime())
-
-    ts_name = frappe.db.exists("Timesheet", {
-        "employee": employee, "start_date": frappe.utils.today(), "docstatus": 0,
-    })
-    if ts_name:
-        doc = frappe.get_doc("Timesheet", ts_name)
+    ts_name = frappe.db.sql(
+        """
+        SELECT name FROM `tabTimesheet`
+        WHERE employee = %s AND start_date = %s AND docstatus = 0
+        ORDER BY creation LIMIT 1 FOR UPDATE
+        """,
+        (employee.name, rounded_time.date()),
+    )
+    ts_name = ts_name[0][0] if ts_name else None
+    if ts_name and action in _FAST_ACTIONS:
+        doc = _PointageTimesheet(ts_name)
+    elif ts_name:
+        doc = frappe.get_doc("Timesheet", ts_name, for_update=True)
     else:
         doc = frappe.get_doc({
             "doctype": "Timesheet",
-            "company": company,
-            "employee": employee,
-            "title": employee,
+            "company": employee.company,
+            "employee": employee.name,
+            "title": employee.name,
             "time_logs": [{"activity_type": activity_type, "from_time": rounded_time}],
         })
         doc.insert()
@@ -326,9 +559,86 @@ def timesheet_post_api():
     duration = None
     last = doc.time_logs[-1] if doc.time_logs else None
     if last and last.to_time is None:
-        duration = frappe.utils.time_diff_in_hours(rounded_time, last.from_time)
+        duration = hours_between(last.from_time, rounded_time)
+        if duration < 0:
+            # Action rejouée plus ancienne que le dernier pointage (autre appareil).
+            frappe.throw(f"Action antérieure au dernier pointage ({last.from_time})")
+
+    handler(doc, rounded_time, duration, params)
+    return doc.name
+
+
+@frappe.whitelist()
+def timesheet_post_api():
+    # Converti depuis le Server Script API « timesheet_post_api ».
+    _apply_action(
+        _current_employee(), frappe.form_dict.get("action"), frappe.form_dict, frappe.utils.now_datetime()
+    )
+
 
-    handler(doc, rounded_time, duration)
+def _client_time(timestamp_ms):
+    """Heure système d'un horodatage du téléphone (ms depuis l'epoch, UTC),
+    bornée à l'heure serveur (horloge du téléphone en avance)."""
+    now = frappe.utils.now_datetime()
+    if not timestamp_ms:
+        return now
+    utc = datetime.fromtimestamp(frappe.utils.cint(timestamp_ms) / 1000, tz=timezone.utc)
+    local = frappe.utils.convert_utc_to_system_timezone(utc).replace(tzinfo=None)
+    return min(local, now)
+
+
+def _earliest_client_time():
+    """Heure la plus ancienne acceptée pour une action rejouée : début de la
+    veille (horloge du téléphone en retard, file restée longtemps hors ligne)."""
+    return datetime.combine(frappe.utils.add_days(frappe.utils.getdate(), -MAX_QUEUED_ACTION_DAYS), time.min)
+
+
+@frappe.whitelist(methods=["POST"])
+def timesheet_post_batch(actions):
+    """Rejoue, dans l'ordre et en une transaction, les actions de la file hors
+    ligne du widget : [{id, action, client_time (ms), args}].
+
+    Chaque action est appliquée à l'heure du téléphone et une seule fois (`id`
+    enregistré dans VT Pointage Action, même en erreur : le téléphone la retire
+    de sa file). Une action en erreur est annulée seule (savepoint), les
+    suivantes sont appliquées. Une action antérieure au début de la veille
+    (cf. _earliest_client_time) est refusée sans être appliquée. Renvoie
+    [{id, status, message?}] et l'état du jour."""
+    from vt_internal.vt_internal.doctype.vt_pointage_action.vt_pointage_action import DOCTYPE, record
+
+    actions = frappe.parse_json(actions) or []
+    employee = _current_employee()
+    earliest = _earliest_client_time()
+
+    results = []
+    for a in actions:
+        client_id = str(a.get("id") or "")
+        if not client_id:
+            results.append({"id": None, "status": "error", "message": "Action sans identifiant"})
+            continue
+        if frappe.db.get_value(DOCTYPE, client_id, "name", for_update=True):
+            results.append({"id": client_id, "status": "duplicate"})
+            continue
+
+        at = _client_time(a.get("client_time"))
+        if at < earliest:
+            message = f"Pointage trop ancien ({at:%d/%m/%Y %H:%M}) : à saisir dans la feuille de temps"
+            record(client_id, employee.name, a.get("action"), at, "Erreur", message=message)
+            results.append({"id": client_id, "status": "error", "message": message})
+            continue
+
+        frappe.db.savepoint("vt_pointage_action")
+        try:
+            timesheet = _apply_action(employee, a.get("action"), frappe._dict(a.get("args") or {}), at)
+            record(client_id, employee.name, a.get("action"), at, "OK", timesheet=timesheet)
+            results.append({"id": client_id, "status": "ok"})
+        except frappe.ValidationError as e:
+            frappe.db.rollback(save_point="vt_pointage_action")
+            frappe.clear_messages()
+            record(client_id, employee.name, a.get("action"), at, "Erreur", message=str(e))
+            results.append({"id": client_id, "status": "error", "message": str(e)})
+
+    return {"results": results, "state": _build_state(frappe.session.user, frappe.utils.today())}
 
 
 @frappe.whitelist()
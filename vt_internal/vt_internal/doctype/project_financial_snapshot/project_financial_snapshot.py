@@ -0,0 +1,234 @@
+# Copyright (c) 2026, Verre & Transparence and contributors
+# For license information, please see license.txt
+#
+# Instantané financier par projet (une ligne par projet, name = projet).
+#
+# Les vues de marge (rapports, page Chantiers, fiche projet) lisent ici une
+# ligne indexée par projet au lieu de ré-agréger Sales Order Item, Packed Item,
+# Purchase Order Item, Fabrication VT et Timesheet Detail à chaque affichage.
+#
+# Mise à jour incrémentale : les doc_events des documents sources appellent
+# `refresh_for_doc`, qui ne recalcule que les projets touchés. Une
+# reconstruction complète (`rebuild_all`, quotidienne + bouton en liste)
+# corrige toute dérive (ex. changement de `custom_pose_vt` sur un article).
+
+import frappe
+from frappe.model.document import Document
+
+from vt_internal.vt_internal.utils.margin_utils import (
+	AXIS_ACHATS,
+	AXIS_GLOBAL,
+	AXIS_TEMPS_PASSE,
+	get_project_costs_bulk,
+	get_project_labour_hours_bulk,
+	get_theoretical_bulk,
+)
+
+DOCTYPE = "Project Financial Snapshot"
+
+SNAPSHOT_FIELDS = (
+	"theo_vente_tp",
+	"theo_cost_tp",
+	"theo_vente_ach",
+	"theo_cost_ach",
+	"theo_vente_global",
+	"theo_cost_global",
+	"total_sales_order",
+	"total_purchase_order",
+	"total_manufacturing_cost",
+	"expected_hours",
+	"actual_hours",
+)
+
+# Taille des lots de projets pour la reconstruction complète.
+REBUILD_CHUNK_SIZE = 500
+
+
+class ProjectFinancialSnapshot(Document):
+	pass
+
+
+def compute_snapshots(projects):
+	"""Calcule les valeurs d'instantané de plusieurs projets (requêtes groupées).
+
+	Renvoie {projet: {champ: valeur}} pour chaque projet demandé."""
+	projects = list(dict.fromkeys(p for p in projects or [] if p))
+	if not projects:
+		return {}
+
+	theoretical = get_theoretical_bulk(projects)
+	costs = get_project_costs_bulk(projects)
+	labour = get_project_labour_hours_bulk(projects)
+	so_totals = dict(
+		frappe.db.sql(
+			"""
+			SELECT project, COALESCE(SUM(total), 0)
+			FROM `tabSales Order`
+			WHERE project IN %(projects)s AND docstatus = 1 AND custom_exclude_from_statistics != 1
+			GROUP BY project
+			""",
+			{"projects": projects},
+		)
+	)
+
+	result = {}
+	for project in projects:
+		theo = theoretical[project]
+		result[project] = {
+			"theo_vente_tp": theo[AXIS_TEMPS_PASSE][0],
+			"theo_cost_tp": theo[AXIS_TEMPS_PASSE][1],
+			"theo_vente_ach": theo[AXIS_ACHATS][0],
+			"theo_cost_ach": theo[AXIS_ACHATS][1],
+			"theo_vente_global": theo[AXIS_GLOBAL][0],
+			"theo_cost_global": theo[AXIS_GLOBAL][1],
+			"total_sales_order": so_totals.get(project) or 0,
+			"total_purchase_order": costs[project]["total_purchase_order"],
+			"total_manufacturing_cost": costs[project]["total_manufacturing_cost"],
+			"expected_hours": labour[project]["expected_hours"],
+			"actual_hours": labour[project]["actual_hours"],
+		}
+	return result
+
+
+def _upsert(values_by_project):
+	"""Écrit les instantanés en une requête (INSERT … ON DUPLICATE KEY UPDATE)."""
+	if not values_by_project:
+		return
+
+	now = frappe.utils.now_datetime()
+	user = frappe.session.user if frappe.session else "Administrator"
+	columns = ["name", "project", "creation", "modified", "modified_by", "owner", "last_refreshed", *SNAPSHOT_FIELDS]
+	rows = []
+	for project, values in values_by_project.items():
+		rows.append([project, project, now, now, user, user, now, *(values[f] for f in SNAPSHOT_FIELDS)])
+
+	placeholders = ", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(rows))
+	updates = ", ".join(f"`{c}` = VALUES(`{c}`)" for c in ("modified", "modified_by", "last_refreshed", *SNAPSHOT_FIELDS))
+	frappe.db.sql(
+		f"""
+		INSERT INTO `tab{DOCTYPE}` ({", ".join(f"`{c}`" for c in columns)})
+		VALUES {placeholders}
+		ON DUPLICATE KEY UPDATE {updates}
+		""",
+		tuple(v for row in rows for v in row),
+	)
+
+
+def refresh_snapshots(projects):
+	"""Recalcule et enregistre l'instantané des projets donnés. Renvoie les valeurs."""
+	projects = [p for p in dict.fromkeys(projects or []) if p]
+	# Ignore les projets supprimés (ou inexistants) : pas d'instantané orphelin.
+	if projects:
+		projects = frappe.get_all("Project", filters={"name": ["in", projects]}, pluck="name")
+	values = compute_snapshots(projects)
+	_upsert(values)
+	return values
+
+
+def refresh_snapshots_after_commit(projects):
+	"""Rafraîchit l'instantané de ces projets une fois la transaction validée
+	(un seul recalcul par projet et par transaction). Pour les enregistrements
+	fréquents (pointages) : la ligne d'instantané n'est pas verrouillée jusqu'au
+	commit, les équipiers d'un même projet ne s'attendent pas."""
+	pending = frappe.flags.get("vt_snapshot_pending")
+	if pending is None:
+		pending = frappe.flags.vt_snapshot_pending = set()
+		frappe.db.after_commit.add(_flush_pending_snapshots)
+		frappe.db.after_rollback.add(_discard_pending_snapshots)
+	pending.update(p for p in projects if p)
+
+
+def _flush_pending_snapshots():
+	projects = frappe.flags.pop("vt_snapshot_pending", None)
+	if not projects:
+		return
+	try:
+		refresh_snapshots(sorted(projects))
+		frappe.db.commit()
+	except Exception:
+		# Le document est déjà enregistré : la reconstruction quotidienne corrigera.
+		frappe.db.rollback()
+		frappe.logger("vt_internal").exception(f"Instantanés non rafraîchis : {sorted(projects)}")
+
+
+def _discard_pending_snapshots():
+	frappe.flags.pop("vt_snapshot_pending", None)
+
+
+def get_snapshots(projects):
+	"""Lit l'instantané de plusieurs projets : {projet: frappe._dict}.
+
+	Les projets sans instantané (jamais touchés depuis la mise en place) sont
+	calculés et enregistrés à la volée."""
+	projects = list(dict.fromkeys(p for p in projects or [] if p))
+	if not projects:
+		return {}
+
+	snapshots = {
+		r.project: r
+		for r in frappe.db.sql(
+			f"""
+			SELECT project, {", ".join(SNAPSHOT_FIELDS)}
+			FROM `tab{DOCTYPE}`
+			WHERE name IN %(projects)s
+			""",
+			{"projects": projects},
+			as_dict=True,
+		)
+	}
+	missing = [p for p in projects if p not in snapshots]
+	for project, values in refresh_snapshots(missing).items():
+		snapshots[project] = frappe._dict(project=project, **values)
+	return snapshots
+
+
+def _projects_of_doc(doc):
+	"""Projets référencés par un document (en-tête et lignes), avant ET après
+	modification : un projet retiré d'une ligne doit aussi être recalculé."""
+	projects = set()
+	for d in (doc, doc.get_doc_before_save()):
+		if not d:
+			continue
+		projects.add(d.get("project"))
+		for table in ("items", "packed_items", "time_logs"):
+			for row in d.get(table) or []:
+				projects.add(row.get("project"))
+	projects.discard(None)
+	projects.discard("")
+	return list(projects)
+
+
+def refresh_for_doc(doc, method=None):
+	"""doc_event générique : rafraîchit l'instantané des projets du document."""
+	refresh_snapshots(_projects_of_doc(doc))
+
+
+def rebuild_all():
+	"""Reconstruction complète de tous les instantanés (corrige la dérive)."""
+	projects = frappe.get_all("Project", pluck="name", order_by="name")
+	for i in range(0, len(projects), REBUILD_CHUNK_SIZE):
+		_upsert(compute_snapshots(projects[i : i + REBUILD_CHUNK_SIZE]))
+		frappe.db.commit()
+
+	# Purge des instantanés de projets supprimés
+	frappe.db.sql(
+		f"""
+		DELETE s FROM `tab{DOCTYPE}` s
+		LEFT JOIN `tabProject` p ON p.name = s.name
+		WHERE p.name IS NULL
+		"""
+	)
+	frappe.db.commit()
+
+
+@frappe.whitelist()
+def enqueue_rebuild():
+	"""Bouton « Reconstruire » de la liste : lance `rebuild_all` en tâche de fond."""
+	frappe.only_for("System Manager")
+	frappe.enqueue(
+		"vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot.rebuild_all",
+		queue="long",
+		timeout=3600,
+		job_id="rebuild_project_financial_snapshots",
+		deduplicate=True,
+	)
@@ -0,0 +1,15 @@
+// Instantanés financiers par projet : mis à jour par les doc_events, le bouton
+// relance une reconstruction complète en tâche de fond (correction de dérive).
+
+frappe.listview_settings['Project Financial Snapshot'] = {
+	onload(listview) {
+		if (!frappe.user.has_role('System Manager')) return;
+		listview.page.add_inner_button('Reconstruire', () => {
+			frappe.call({
+				method: 'vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot.enqueue_rebuild',
+			}).then(() => {
+				frappe.show_alert({ message: 'Reconstruction lancée', indicator: 'green' }, 5);
+			});
+		});
+	},
+};
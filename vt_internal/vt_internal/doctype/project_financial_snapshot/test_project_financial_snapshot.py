@@ -0,0 +1,9 @@
+# Copyright (c) 2026, Verre & Transparence and Contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.tests.utils import FrappeTestCase
+
+
+class TestProjectFinancialSnapshot(FrappeTestCase):
+	pass
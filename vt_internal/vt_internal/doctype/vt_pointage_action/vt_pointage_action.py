@@ -0,0 +1,42 @@
+# Copyright (c) 2026, Verre & Transparence and contributors
+# For license information, please see license.txt
+#
+# Journal des actions de pointage rejouées depuis la file hors ligne du widget
+# (api/timesheet.timesheet_post_batch). Le nom est l'identifiant généré par le
+# téléphone : une action renvoyée après une coupure réseau n'est appliquée
+# qu'une fois. Purgé après `RETENTION_DAYS` jours.
+
+import frappe
+from frappe.model.document import Document
+
+DOCTYPE = "VT Pointage Action"
+
+# Au-delà, plus aucun téléphone ne renvoie l'action (file vidée à la reconnexion).
+RETENTION_DAYS = 30
+
+
+class VTPointageAction(Document):
+	pass
+
+
+def record(client_id, employee, action, client_time, status, timesheet=None, message=None):
+	frappe.get_doc(
+		{
+			"doctype": DOCTYPE,
+			"name": client_id,
+			"employee": employee,
+			"action": action,
+			"client_time": client_time,
+			"status": status,
+			"timesheet": timesheet,
+			"message": message,
+		}
+	).db_insert()
+
+
+def purge_old_actions():
+	frappe.db.sql(
+		f"DELETE FROM `tab{DOCTYPE}` WHERE creation < %s",
+		(frappe.utils.add_days(frappe.utils.now_datetime(), -RETENTION_DAYS),),
+	)
+	frappe.db.commit()
@@ -0,0 +1,283 @@
+# Copyright (c) 2026, Verre & Transparence and contributors
+# For license information, please see license.txt
+#
+# Cube des ventes au jour : une ligne par (date, société, type de document,
+# statut, variante, exclusion, centre de coût, secteur, responsable, groupe de
+# client, assurance, type de projet), avec montants, nombre de documents et
+# composantes de marge.
+#
+# Les rapports d'analyse (vt_sales_analytics, performance_commerciale,
+# objectifs_commerciaux_vt) lisent ce cube au lieu de rebalayer Quotation,
+# Sales Order (+ lignes) et Sales Invoice quand leurs filtres correspondent à
+# ses dimensions.
+#
+# Mise à jour incrémentale : les doc_events des documents sources appellent
+# `refresh_for_doc`, qui note les cellules (type, société, date) touchées ; elles
+# sont recalculées depuis les documents juste avant le commit (recalcul
+# idempotent, pas de delta). Une reconstruction complète quotidienne
+# (`rebuild_all`) corrige la dérive (ex. groupe d'un client modifié), et marque
+# le cube comme utilisable (`is_ready`).
+#
+# Dimensions absentes : chaîne vide. Pour les factures, secteur et assurance
+# viennent du projet, le responsable est le chef de projet.
+
+import frappe
+from frappe.model.document import Document
+
+DOCTYPE = "VT Sales Cube"
+
+DIMENSIONS = (
+	"posting_date",
+	"company",
+	"source_docstatus",
+	"is_variant",
+	"excluded_from_statistics",
+	"cost_center",
+	"secteur_vt",
+	"responsable",
+	"customer_group",
+	"insurance",
+	"project_type",
+)
+
+MEASURES = (
+	"doc_count",
+	"total",
+	"base_net_total",
+	"grand_total",
+	"total_qty",
+	"margin_sale",
+	"margin_cost",
+)
+
+# Clé par défaut indiquant qu'une reconstruction complète a eu lieu.
+READY_KEY = "vt_sales_cube_ready"
+
+# Requêtes d'agrégation par document source, alias `d`, `{conditions}` portant
+# sur la société et la date du document.
+_SOURCES = {
+	"Quotation": (
+		"transaction_date",
+		"""
+		SELECT
+			d.transaction_date AS posting_date,
+			d.company,
+			d.docstatus AS source_docstatus,
+			IF(d.custom_dernier_statut_de_suivi = 'Variante', 1, 0) AS is_variant,
+			0 AS excluded_from_statistics,
+			IFNULL(d.cost_center, '') AS cost_center,
+			IFNULL(d.secteur_vt, '') AS secteur_vt,
+			IFNULL(d.custom_responsable_du_devis, '') AS responsable,
+			IFNULL(c.customer_group, '') AS customer_group,
+			IFNULL(d.custom_insurance_client, '') AS insurance,
+			IFNULL(d.custom_type_de_projet, '') AS project_type,
+			COUNT(*) AS doc_count,
+			SUM(d.total) AS total,
+			SUM(d.base_net_total) AS base_net_total,
+			SUM(d.grand_total) AS grand_total,
+			SUM(d.total_qty) AS total_qty,
+			0 AS margin_sale,
+			0 AS margin_cost
+		FROM `tabQuotation` d
+		LEFT JOIN `tabCustomer` c ON c.name = d.party_name
+		WHERE d.docstatus < 2 AND {conditions}
+		GROUP BY {dimensions}
+		""",
+	),
+	"Sales Order": (
+		"transaction_date",
+		"""
+		SELECT
+			d.transaction_date AS posting_date,
+			d.company,
+			d.docstatus AS source_docstatus,
+			0 AS is_variant,
+			IFNULL(d.custom_exclude_from_statistics, 0) AS excluded_from_statistics,
+			IFNULL(d.cost_center, '') AS cost_center,
+			IFNULL(d.secteur_vt, '') AS secteur_vt,
+			IFNULL(d.custom_responsable_du_devis, '') AS responsable,
+			IFNULL(c.customer_group, '') AS customer_group,
+			IFNULL(d.custom_insurance_client, '') AS insurance,
+			IFNULL(d.custom_type_de_projet, '') AS project_type,
+			COUNT(*) AS doc_count,
+			SUM(d.total) AS total,
+			SUM(d.base_net_total) AS base_net_total,
+			SUM(d.grand_total) AS grand_total,
+			SUM(d.total_qty) AS total_qty,
+			SUM(IFNULL(m.sale, 0)) AS margin_sale,
+			SUM(IFNULL(m.cost, 0)) AS margin_cost
+		FROM `tabSales Order` d
+		LEFT JOIN `tabCustomer` c ON c.name = d.customer
+		LEFT JOIN (
+			SELECT soi.parent, SUM(soi.amount) AS sale, SUM(soi.qty * COALESCE(soi.unit_cost_price, 0)) AS cost
+			FROM `tabSales Order Item` soi
+			INNER JOIN `tabSales Order` d ON d.name = soi.parent
+			WHERE d.docstatus < 2 AND {conditions}
+			GROUP BY soi.parent
+		) m ON m.parent = d.name
+		WHERE d.docstatus < 2 AND {conditions}
+		GROUP BY {dimensions}
+		""",
+	),
+	"Sales Invoice": (
+		"posting_date",
+		"""
+		SELECT
+			d.posting_date AS posting_date,
+			d.company,
+			d.docstatus AS source_docstatus,
+			0 AS is_variant,
+			0 AS excluded_from_statistics,
+			IFNULL(d.cost_center, '') AS cost_center,
+			IFNULL(p.secteur_vt, '') AS secteur_vt,
+			IFNULL(p.custom_project_manager, '') AS responsable,
+			IFNULL(c.customer_group, '') AS customer_group,
+			IFNULL(p.insurance, '') AS insurance,
+			IFNULL(d.custom_type_de_projet, '') AS project_type,
+			COUNT(*) AS doc_count,
+			SUM(d.total) AS total,
+			SUM(d.base_net_total) AS base_net_total,
+			SUM(d.grand_total) AS grand_total,
+			SUM(d.total_qty) AS total_qty,
+			0 AS margin_sale,
+			0 AS margin_cost
+		FROM `tabSales Invoice` d
+		LEFT JOIN `tabCustomer` c ON c.name = d.customer
+		LEFT JOIN `tabProject` p ON p.name = d.project
+		WHERE d.docstatus < 2 AND {conditions}
+		GROUP BY {dimensions}
+		""",
+	),
+}
+
+
+class VTSalesCube(Document):
+	pass
+
+
+def is_ready():
+	"""Vrai si le cube a été construit au moins une fois (lecture possible)."""
+	return bool(frappe.db.get_default(READY_KEY))
+
+
+def _insert_from_source(source_doctype, conditions, params):
+	"""Recalcule les lignes du cube d'un type de document pour les conditions
+	données (les lignes existantes doivent avoir été supprimées)."""
+	date_field, query = _SOURCES[source_doctype]
+	select = query.format(
+		conditions=conditions.format(date=f"d.{date_field}"),
+		# Regroupement par position : les alias (company, project_type…) sont
+		# aussi des colonnes des tables jointes.
+		dimensions=", ".join(str(i) for i in range(1, len(DIMENSIONS) + 1)),
+	)
+	columns = ("name", "creation", "modified", "modified_by", "owner", "source_doctype", *DIMENSIONS, *MEASURES)
+	frappe.db.sql(
+		f"""
+		INSERT INTO `tab{DOCTYPE}` ({", ".join(f"`{c}`" for c in columns)})
+		SELECT
+			MD5(CONCAT_WS('|', %(source_doctype)s, {", ".join(f"g.{d}" for d in DIMENSIONS)})),
+			NOW(6), NOW(6), 'Administrator', 'Administrator', %(source_doctype)s,
+			{", ".join(f"g.{c}" for c in (*DIMENSIONS, *MEASURES))}
+		FROM ({select}) g
+		""",
+		{**params, "source_doctype": source_doctype},
+	)
+
+
+def refresh_cells(cells):
+	"""Recalcule les cellules (type de document, société, date) données."""
+	by_source = {}
+	for source_doctype, company, posting_date in cells:
+		if source_doctype in _SOURCES and company and posting_date:
+			by_source.setdefault((source_doctype, company), set()).add(posting_date)
+
+	for (source_doctype, company), dates in by_source.items():
+		params = {"source_doctype": source_doctype, "company": company, "dates": list(dates)}
+		frappe.db.sql(
+			f"""
+			DELETE FROM `tab{DOCTYPE}`
+			WHERE source_doctype = %(source_doctype)s AND company = %(company)s AND posting_date IN %(dates)s
+			""",
+			params,
+		)
+		_insert_from_source(source_doctype, "d.company = %(company)s AND {date} IN %(dates)s", params)
+
+
+def _cells_of_doc(doc):
+	"""Cellules touchées par un document, avant ET après modification (une date
+	ou une société changée vide aussi l'ancienne cellule)."""
+	date_field = _SOURCES[doc.doctype][0]
+	cells = set()
+	for d in (doc, doc.get_doc_before_save()):
+		if d:
+			cells.add((doc.doctype, d.get("company"), frappe.utils.getdate(d.get(date_field)) if d.get(date_field) else None))
+	return cells
+
+
+def refresh_for_doc(doc, method=None):
+	"""doc_event générique : recalcule les cellules du document avant le commit.
+
+	Les cellules de tous les documents d'une même transaction sont regroupées
+	(un devis enregistré puis validé n'est recalculé qu'une fois)."""
+	pending = frappe.flags.get("vt_sales_cube_pending")
+	if pending is None:
+		pending = frappe.flags.vt_sales_cube_pending = set()
+		frappe.db.before_commit.add(_flush_pending)
+		frappe.db.after_rollback.add(_discard_pending)
+	pending.update(_cells_of_doc(doc))
+
+
+def _flush_pending():
+	refresh_cells(frappe.flags.pop("vt_sales_cube_pending", None) or ())
+
+
+def _discard_pending():
+	frappe.flags.pop("vt_sales_cube_pending", None)
+
+
+def rebuild_all():
+	"""Reconstruction complète du cube, par année (corrige la dérive)."""
+	for source_doctype, (date_field, _query) in _SOURCES.items():
+		bounds = frappe.db.sql(
+			f"SELECT MIN(YEAR({date_field})), MAX(YEAR({date_field})) FROM `tab{source_doctype}` WHERE docstatus < 2"
+		)[0]
+		if bounds[0] is None:
+			frappe.db.sql(f"DELETE FROM `tab{DOCTYPE}` WHERE source_doctype = %s", (source_doctype,))
+			frappe.db.commit()
+			continue
+
+		# Lignes hors des années couvertes (documents supprimés)
+		frappe.db.sql(
+			f"""
+			DELETE FROM `tab{DOCTYPE}`
+			WHERE source_doctype = %s AND (YEAR(posting_date) < %s OR YEAR(posting_date) > %s)
+			""",
+			(source_doctype, bounds[0], bounds[1]),
+		)
+		for year in range(bounds[0], bounds[1] + 1):
+			params = {"source_doctype": source_doctype, "from_date": f"{year}-01-01", "to_date": f"{year}-12-31"}
+			frappe.db.sql(
+				f"""
+				DELETE FROM `tab{DOCTYPE}`
+				WHERE source_doctype = %(source_doctype)s AND posting_date BETWEEN %(from_date)s AND %(to_date)s
+				""",
+				params,
+			)
+			_insert_from_source(source_doctype, "{date} BETWEEN %(from_date)s AND %(to_date)s", params)
+			frappe.db.commit()
+
+	frappe.db.set_default(READY_KEY, 1)
+	frappe.db.commit()
+
+
+@frappe.whitelist()
+def enqueue_rebuild():
+	"""Bouton « Reconstruire » de la liste : lance `rebuild_all` en tâche de fond."""
+	frappe.only_for("System Manager")
+	frappe.enqueue(
+		"vt_internal.vt_internal.doctype.vt_sales_cube.vt_sales_cube.rebuild_all",
+		queue="long",
+		timeout=3600,
+		job_id="rebuild_vt_sales_cube",
+		deduplicate=True,
+	)
@@ -0,0 +1,15 @@
+// Cube des ventes : mis à jour par les doc_events, le bouton relance une
+// reconstruction complète en tâche de fond (correction de dérive).
+
+frappe.listview_settings['VT Sales Cube'] = {
+	onload(listview) {
+		if (!frappe.user.has_role('System Manager')) return;
+		listview.page.add_inner_button('Reconstruire', () => {
+			frappe.call({
+				method: 'vt_internal.vt_internal.doctype.vt_sales_cube.vt_sales_cube.enqueue_rebuild',
+			}).then(() => {
+				frappe.show_alert({ message: 'Reconstruction lancée', indicator: 'green' }, 5);
+			});
+		});
+	},
+};
@@ -6,7 +6,15 @@ Source de vérité : ce fichier (versionné). Les records DB ont été supprimé
 
 import frappe
 
+from vt_internal.vt_internal.api.timesheet import invalidate_timesheet_state
+
 
 def validate(doc, method=None):
     # --- depuis Server Script « Titre employé » (Before Save) ---
     doc.employee_number = doc.first_name + " " + doc.last_name
+
+
+def on_update(doc, method=None):
+    # Nom et utilisateur repris dans l'état de pointage en cache.
+    before = doc.get_doc_before_save()
+    invalidate_timesheet_state([doc.user_id, before.user_id if before else None])
@@ -6,6 +6,9 @@ Source de vérité : ce fichier (versionné). Les records DB ont été supprimé
 
 import frappe
 
+from vt_internal.vt_internal.api.timesheet import invalidate_timesheet_state_for_employees
+from vt_internal.vt_internal.utils.time_utils import hours_between
+
 
 def validate(doc, method=None):
     # --- depuis Server Script « Événement avant la sauvegarde » (Before Save) ---
@@ -19,49 +22,65 @@ def validate(doc, method=None):
     doc.color = color
 
 
+def _invalidate_timesheet_state(doc):
+    """Événements du jour du widget de pointage : état en cache de l'employé
+    (avant et après modification) si l'événement tombe aujourd'hui."""
+    today = frappe.utils.getdate()
+    employees = [
+        d.custom_employé
+        for d in (doc, doc.get_doc_before_save())
+        if d and d.starts_on and frappe.utils.getdate(d.starts_on) == today
+    ]
+    invalidate_timesheet_state_for_employees(employees)
+
+
+def _duration(d):
+    """Durée planifiée d'un événement (heures), 0 sans projet ou sans horaires."""
+    if not d or not d.project or not d.starts_on or not d.ends_on:
+        return 0
+    return hours_between(d.starts_on, d.ends_on)
+
+
+def _add_planned_hours(project, delta):
+    """Incrément SQL des heures planifiées du projet (somme des durées de ses
+    événements) : pas de relecture des autres événements. Recalcul complet
+    nocturne : tasks/reconcile_planned_hours."""
+    if project and delta:
+        frappe.db.sql(
+            """
+            UPDATE `tabProject`
+            SET custom_planned_hours = IFNULL(custom_planned_hours, 0) + %s
+            WHERE name = %s
+            """,
+            (delta, project),
+        )
+
+
 def on_update(doc, method=None):
+    _invalidate_timesheet_state(doc)
+
     # --- depuis Server Script « Evénement après la sauvegarde » (After Save) ---
-    fiche = doc.custom_fiche_de_travail
-    project = doc.project
+    # Heures planifiées : ancienne durée retirée de l'ancien projet, nouvelle
+    # durée ajoutée au projet courant (déplacement dans le calendrier = delta).
+    before = doc.get_doc_before_save()
+    old_project, old_duration = (before.project, _duration(before)) if before else (None, 0)
+    new_duration = _duration(doc)
+    if old_project == doc.project:
+        _add_planned_hours(doc.project, new_duration - old_duration)
+    else:
+        _add_planned_hours(old_project, -old_duration)
+        _add_planned_hours(doc.project, new_duration)
 
     fiche_name = doc.custom_fiche_de_travail
     project = doc.project
 
     if fiche_name:
-        # Récupération de la fiche de travail et du projet associé
-        fiche = frappe.get_doc(
-            "Fiche de travail",
-            fiche_name,
-        )
-
-        # Calcul des heures planifiées depuis tous les events liés au projet
-        events = frappe.get_all(
-            "Event",
-            filters={"project": project},
-            fields=["starts_on", "ends_on"]
-        )
-
-        total_hours = 0
-        for e in events:
-            if e.starts_on and e.ends_on:
-                diff = frappe.utils.time_diff_in_hours(e.ends_on, e.starts_on)
-                total_hours = total_hours + diff
-
-        # Mise à jour des heures planifiées sur le projet
         if project:
-            frappe.db.set_value(
-                "Project",
-                project,
-                "custom_planned_hours",
-                total_hours
+            total_hours, estimated = frappe.db.get_value(
+                "Project", project, ["custom_planned_hours", "custom_estimated_labor_hours"]
             )
-
-            # Récupération de l'estimation
-            estimated = frappe.db.get_value(
-                "Project",
-                project,
-                "custom_estimated_labor_hours"
-            ) or 0
+            total_hours = total_hours or 0
+            estimated = estimated or 0
 
             # Arrondi des heures pour affichage
             total_rounded = round(total_hours, 1)
@@ -82,7 +101,9 @@ def on_update(doc, method=None):
                     alert=True
                 )
         # Passage du statut de la fiche de travail à "À faire" si nécessaire
-        if fiche.status in ("En attente de fabrication", "À planifier"):
+        # (document chargé seulement dans ce cas).
+        if frappe.db.get_value("Fiche de travail", fiche_name, "status") in ("En attente de fabrication", "À planifier"):
+            fiche = frappe.get_doc("Fiche de travail", fiche_name)
             fiche.status = "À faire"
             fiche.save()
 
@@ -99,23 +120,7 @@ def on_update(doc, method=None):
 
 
 def after_delete(doc, method=None):
-    # --- depuis Server Script « Evénement après la suppression » (After Delete) ---
-    # Server Script - DocType Event, Before Save
-
-    project = doc.project
-
-    if project:
-        events = frappe.get_all(
-            "Event",
-            filters={"project": project},
-            fields=["starts_on", "ends_on"]
-        )
+    _invalidate_timesheet_state(doc)
 
-        # Calculer la somme des heures existantes
-        total_hours = 0
-        for e in events:
-            if e.starts_on and e.ends_on:
-                total_hours = total_hours + frappe.utils.time_diff_in_hours(e.ends_on, e.starts_on)
-
-        # Mettre à jour le projet
-        frappe.db.set_value("Project", project, "custom_planned_hours", total_hours)
+    # --- depuis Server Script « Evénement après la suppression » (After Delete) ---
+    _add_planned_hours(doc.project, -_duration(doc))
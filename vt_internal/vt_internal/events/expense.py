@@ -6,6 +6,8 @@ Source de vérité : ce fichier (versionné). Les records DB ont été supprimé
 
 import frappe
 
+from vt_internal.vt_internal.api.chantiers import invalidate_for_doc
+
 
 def validate(doc, method=None):
     # --- depuis Server Script « Date des dépense » (Before Save) ---
@@ -74,6 +76,8 @@ def before_submit(doc, method=None):
 
 
 def on_submit(doc, method=None):
+    invalidate_for_doc(doc)
+
     # --- depuis Server Script « Après validation des dépenses » (After Submit) ---
     # 1. On enlève la personne assignée
     #todo = frappe.db.get_value("ToDo", {"reference_type": doc.doctype, "reference_name": doc.name})
@@ -108,3 +112,7 @@ def on_submit(doc, method=None):
     	},
     )
     bt.save()
+
+
+def on_cancel(doc, method=None):
+    invalidate_for_doc(doc)
@@ -6,12 +6,18 @@ Source de vérité : ce fichier (versionné). Les records DB ont été supprimé
 
 import frappe
 
+from vt_internal.vt_internal.api.chantiers import invalidate_for_doc
 from vt_internal.vt_internal.api.fabrication import update_manufacturing_status
+from vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot import (
+    refresh_for_doc,
+)
 
 
 def on_update(doc, method=None):
     # --- depuis Server Script « Fabrication VT » (After Save) ---
     update_manufacturing_status(fabrication=doc)
+    refresh_for_doc(doc)
+    invalidate_for_doc(doc)
 
 
 def on_trash(doc, method=None):
@@ -20,3 +26,8 @@ def on_trash(doc, method=None):
 
     for c in cts:
         frappe.delete_doc("Carte de travail VT", c.name)
+
+
+def after_delete(doc, method=None):
+    refresh_for_doc(doc)
+    invalidate_for_doc(doc)
@@ -6,6 +6,8 @@ Source de vérité : ce fichier (versionné). Les records DB ont été supprimé
 
 import frappe
 
+from vt_internal.vt_internal.api.timesheet import invalidate_timesheet_state_for_fiches
+
 
 def before_insert(doc, method=None):
     # --- depuis Server Script « En-tête Fiche de travail » (Before Insert) ---
@@ -126,11 +128,22 @@ def before_update_after_submit(doc, method=None):
         doc.scheduled_time = 0
 
 
+def on_update(doc, method=None):
+    # Référence, statut et adresse de la fiche apparaissent dans l'état de
+    # pointage en cache des employés planifiés dessus ou qui y pointent.
+    invalidate_timesheet_state_for_fiches([doc.name])
+
+
+def on_update_after_submit(doc, method=None):
+    invalidate_timesheet_state_for_fiches([doc.name])
+
+
 def on_cancel(doc, method=None):
     # --- depuis Server Script « Fiche de travail avant l'annulation » (After Cancel) ---
     if doc.sales_order:
         doc.status = "Annulé"
         frappe.db.set_value("Sales Order", doc.sales_order, "custom_statut_fiche_de_travail", "")
+    invalidate_timesheet_state_for_fiches([doc.name])
 
 
 def on_trash(doc, method=None):
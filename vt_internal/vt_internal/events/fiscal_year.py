@@ -0,0 +1,14 @@
+"""Événements du document Fiscal Year."""
+
+import frappe
+
+from vt_internal.vt_internal.utils.periods import clear_fiscal_years_cache
+
+
+def on_update(doc, method=None):
+    # Bornes d'exercice des rapports d'analyse (cf. utils.periods).
+    frappe.db.after_commit.add(clear_fiscal_years_cache)
+
+
+def after_delete(doc, method=None):
+    frappe.db.after_commit.add(clear_fiscal_years_cache)
@@ -0,0 +1,16 @@
+"""Événements du document Item."""
+
+import frappe
+
+from vt_internal.vt_internal.utils.labour_hours import clear_cache as clear_labour_hours_cache
+
+
+def on_update(doc, method=None):
+    # Heures de pose par article (Sales Order / Sales Invoice) : invalidées une
+    # fois la transaction validée, sinon un autre worker pourrait remettre en
+    # cache l'ancienne valeur.
+    frappe.db.after_commit.add(clear_labour_hours_cache)
+
+
+def after_delete(doc, method=None):
+    frappe.db.after_commit.add(clear_labour_hours_cache)
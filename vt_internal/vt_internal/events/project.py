@@ -11,3 +11,8 @@ def validate(doc, method=None):
     # --- depuis Server Script « Sauvegarde projet » (Before Save) ---
     doc.estimated_costing = (doc.total_expense_claim or 0) + (doc.total_purchase_cost or 0) + sum([f.montant for f in doc.custom_reste_à_facturer])
     doc.sales_order = None
+
+
+def on_trash(doc, method=None):
+    # L'instantané financier suit le projet (sinon le lien bloque la suppression).
+    frappe.db.delete("Project Financial Snapshot", {"name": doc.name})
@@ -6,7 +6,11 @@ Source de vérité : ce fichier (versionné). Les records DB ont été supprimé
 
 import frappe
 
+from vt_internal.vt_internal.api.chantiers import invalidate_for_doc
 from vt_internal.vt_internal.api.fabrication import update_manufacturing_status_in_order
+from vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot import (
+    refresh_for_doc,
+)
 
 
 def before_validate(doc, method=None):
@@ -39,7 +43,15 @@ def after_insert(doc, method=None):
         doc.submit()
 
 
+def on_update(doc, method=None):
+    # Les commandes brouillon comptent dans le coût réel (docstatus < 2) :
+    # instantané financier rafraîchi à chaque enregistrement ET à la validation.
+    refresh_for_doc(doc)
+
+
 def on_submit(doc, method=None):
+    invalidate_for_doc(doc)
+
     # --- depuis Server Script « Commande fournisseur validation » (After Submit) ---
     for item in doc.items:
         if item.sales_order_item:
@@ -54,3 +66,13 @@ def on_submit(doc, method=None):
 def before_update_after_submit(doc, method=None):
     # --- depuis Server Script « Commande fournisseur enregistrement validé » (Before Save (Submitted Document)) ---
     doc.custom_label_reference = (frappe.db.get_value("Project Type", doc.custom_type_de_projet, "custom_id") or "") + doc.name.split("ACH")[1].replace("-", "") + (doc.reference_piece or "").upper().replace(" ", "")
+
+
+def on_cancel(doc, method=None):
+    refresh_for_doc(doc)
+    invalidate_for_doc(doc)
+
+
+def after_delete(doc, method=None):
+    # Brouillon supprimé : ses montants sortent de l'instantané financier.
+    refresh_for_doc(doc)
@@ -1,6 +1,9 @@
 # vt_internal/quotation/events.py
 import frappe
 
+from vt_internal.vt_internal.doctype.vt_sales_cube.vt_sales_cube import refresh_for_doc as refresh_sales_cube
+from vt_internal.vt_internal.utils.print_context import get_bom_attributes, get_cached_print_context
+
 # ---------------------------------------------------------------------------
 # Hooks Quotation : événements du document Quotation
 # ---------------------------------------------------------------------------
@@ -91,24 +94,44 @@ def before_print(doc, method=None, print_settings=None, *args, **kwargs):
     doc.qty_of_visible_items = sum(
         i.qty for i in doc.items if i.row_print_style != "Hide Row" and i.row_type == ""
     )
-    doc.surface_of_visible_items = 0
+    context = get_cached_print_context(doc, "bom_surfaces", _bom_surfaces)
+    doc.surface_of_visible_items = context["surface"]
 
     for item in doc.items:
         if item.bom_no:
-            # get_value peut renvoyer None ; et avec plusieurs champs => tuple
-            bom = frappe.db.get_value("BOM", item.bom_no, ["reference_ligne", "hauteur", "largeur"])
-            if bom:
-                reference_ligne, hauteur, largeur = bom
-                item.reference_ligne = reference_ligne
-                surface = (hauteur or 0) / 1000 * (largeur or 0) / 1000
-                item.price_par_surface = round(item.rate / surface, 2) if surface else 0
-                doc.surface_of_visible_items = round(doc.surface_of_visible_items + (item.qty or 0) * surface, 2)
+            line = context["lines"].get(item.name)
+            if line:
+                item.reference_ligne = line["reference_ligne"]
+                item.price_par_surface = line["price_par_surface"]
             else:
                 # Pas de BOM trouvé : sécuriser les champs utilisés dans le print
                 item.reference_ligne = getattr(item, "reference_ligne", None)
                 item.price_par_surface = getattr(item, "price_par_surface", 0)
 
 
+def _bom_surfaces(doc):
+    """Référence, prix au m² par ligne et surface totale, à partir des BOM
+    des lignes (une requête pour tout le devis)."""
+    boms = get_bom_attributes(item.bom_no for item in doc.items)
+    lines = {}
+    surface_total = 0
+    for item in doc.items:
+        bom = boms.get(item.bom_no) if item.bom_no else None
+        if not bom:
+            continue
+        surface = (bom.hauteur or 0) / 1000 * (bom.largeur or 0) / 1000
+        lines[item.name] = {
+            "reference_ligne": bom.reference_ligne,
+            "price_par_surface": round(item.rate / surface, 2) if surface else 0,
+        }
+        surface_total = round(surface_total + (item.qty or 0) * surface, 2)
+    return {"lines": lines, "surface": surface_total}
+
+
+def on_update(doc, method=None):
+    """Après enregistrement (et soumission) : cube des ventes."""
+    refresh_sales_cube(doc)
+
 def after_save(doc, method=None):
     """Après sauvegarde complète."""
     pass
@@ -131,7 +154,7 @@ def before_cancel(doc, method=None):
 
 def on_cancel(doc, method=None):
     """Après annulation."""
-    pass
+    refresh_sales_cube(doc)
 
 def after_cancel(doc, method=None):
     """Après annulation (hook complémentaire)."""
@@ -145,7 +168,7 @@ def before_update_after_submit(doc, method=None):
 
 def on_update_after_submit(doc, method=None):
     """Après mise à jour d’un doc déjà soumis."""
-    pass
+    refresh_sales_cube(doc)
 
 def before_delete(doc, method=None):
     """Juste avant suppression."""
@@ -153,4 +176,4 @@ def before_delete(doc, method=None):
 
 def after_delete(doc, method=None):
     """Juste après suppression."""
-    pass
+    refresh_sales_cube(doc)
@@ -6,6 +6,11 @@ Source de vérité : ce fichier (versionné). Les records DB ont été supprimé
 
 import frappe
 
+from vt_internal.vt_internal.api.chantiers import invalidate_for_doc
+from vt_internal.vt_internal.doctype.vt_sales_cube.vt_sales_cube import refresh_for_doc as refresh_sales_cube
+from vt_internal.vt_internal.utils.labour_hours import compute_labour_hours
+from vt_internal.vt_internal.utils.print_context import get_cached_print_context
+
 
 def before_validate(doc, method=None):
     # --- depuis Server Script « Facture de vente ignore pricing rule » (Before Validate) ---
@@ -72,17 +77,17 @@ def validate(doc, method=None):
     if doc.custom_insurance:
         doc.custom_follow_up_automatically = 0
 
-    num_of_hours = 0
-    for i in doc.items:
-        if frappe.db.get_value("Item", i.item_code, "custom_pose_vt"):
-            num_of_hours = num_of_hours + i.qty*frappe.db.get_value("Item", i.item_code, "custom_number_of_labor_hours")
-    for i in doc.packed_items:
-        if frappe.db.get_value("Item", i.item_code, "custom_pose_vt"):
-            num_of_hours = num_of_hours + i.qty*frappe.db.get_value("Item", i.item_code, "custom_number_of_labor_hours")
-    doc.custom_labour_hours = num_of_hours
+    doc.custom_labour_hours = compute_labour_hours(doc)
+
+
+def on_update(doc, method=None):
+    # Enregistrement (brouillon ou soumission) : cube des ventes
+    refresh_sales_cube(doc)
 
 
 def on_submit(doc, method=None):
+    invalidate_for_doc(doc)
+
     # --- depuis Server Script « Cocher livré sur bon de livraison » (After Submit) ---
 
     # On parcourt chaque ligne de la facture
@@ -93,6 +98,11 @@ def on_submit(doc, method=None):
             frappe.db.set_value("Delivery Note", item.delivery_note, "custom_livré", 1)
 
 
+def on_cancel(doc, method=None):
+    invalidate_for_doc(doc)
+    refresh_sales_cube(doc)
+
+
 def before_update_after_submit(doc, method=None):
     # --- depuis Server Script « Après enregistrement » (Before Save (Submitted Document)) ---
     if doc.status == "Paid":
@@ -100,6 +110,14 @@ def before_update_after_submit(doc, method=None):
         doc.custom_déposé_sur_chorus = 0
 
 
+def on_update_after_submit(doc, method=None):
+    refresh_sales_cube(doc)
+
+
+def after_delete(doc, method=None):
+    refresh_sales_cube(doc)
+
+
 def before_print(doc, method=None, print_settings=None, **kwargs):
     # --- depuis Server Script « Avant l'impression » (Before Print) ---
     sales_orders = list(dict.fromkeys([item.sales_order for item in doc.items if item.sales_order]))
@@ -116,113 +134,81 @@ def before_print(doc, method=None, print_settings=None, **kwargs):
 
 
     if doc.is_progress_invoice:
-        # 1) Déterminer une Sales Order de référence (s'il y en a une)
-        sales_order = None
-        for item in doc.items:
-            if item.sales_order:
-                sales_order = item.sales_order
-                break
-
-        # 2) Récupérer les lignes de la commande (peut être vide si aucune SO)
-        order_items = []
-        if sales_order:
-            order_items = frappe.get_all(
-                "Sales Order Item",
-                filters={"parent": sales_order},
-                fields=[
-                    "item_code", "item_name", "qty", "rate", "amount", "name",
-                    "row_type", "row_print_style", "description", "idx", "with_subtotal"
-                ],
-                order_by="idx asc"
-            )
-
-        # 3) Associer aux factures et calculer les montants facturés
-        result = []
-        section_items = []
-        with_subtotal = False
-
-        for i, item in enumerate(order_items):
-            # Mise à jour du flag de sous-total par section si on rencontre un "title1"
-            if item.get("row_type") == "title1":
-                with_subtotal = bool(item.get("with_subtotal"))
-
-            # Si on démarre une nouvelle section ("title1") et qu'on a accumulé la précédente, pousser son total
-            if item.get("row_type") == "title1" and section_items:
-                section_total_amount = sum(x["amount"] for x in section_items)
-                section_total_invoiced_amount = sum(x["total_invoiced_amount"] for x in section_items)
-                section_current_invoiced_amount = sum(x["current_invoiced_amount"] for x in section_items)
-                section_remaining_amount = sum(x["remaining_amount"] for x in section_items)
-                section_invoiced_percentage = (section_total_invoiced_amount / section_total_amount) * 100 if section_total_amount > 0 else 0
-                section_current_percentage = (section_current_invoiced_amount / section_total_amount) * 100 if section_total_amount > 0 else 0
-
-                result.append({
-                    "description": "Total Section",
-                    "total_invoiced_amount": round(section_total_invoiced_amount, 2),
-                    "amount": round(section_total_amount, 2),
-                    "invoiced_percentage": round(section_invoiced_percentage, 2),
-                    "current_invoiced_amount": round(section_current_invoiced_amount, 2),
-                    "current_percentage": round(section_current_percentage, 2),
-                    "remaining_amount": round(section_remaining_amount, 2),
-                    "row_type": "total",
-                    "row_print_style": "",
-                    "idx": 0,
-                })
-                section_items = []
-
-            # Lignes de factures précédentes (uniquement factures de situation validées, avant la présente)
-            previous_invoice_items = frappe.db.sql(
-                """
-                SELECT si_item.parent AS invoice, si_item.qty, si_item.rate, si_item.amount
-                FROM `tabSales Invoice Item` si_item
-                JOIN `tabSales Invoice` si ON si.name = si_item.parent
-                WHERE si_item.so_detail = %s
-                  AND si.is_progress_invoice = 1
-                  AND si.docstatus = 1
-                  AND si.progress_invoice_no < %s
-                """,
-                (item["name"], doc.progress_invoice_no),
-                as_dict=True
-            )
-
-            # Lignes de la facture courante pour cet article de commande
-            current_invoice_items = frappe.db.sql(
-                """
-                SELECT si_item.parent AS invoice, si_item.qty, si_item.rate, si_item.amount
-                FROM `tabSales Invoice Item` si_item
-                JOIN `tabSales Invoice` si ON si.name = si_item.parent
-                WHERE si_item.so_detail = %s
-                  AND si.name = %s
-                """,
-                (item["name"], doc.name),
-                as_dict=True
-            )
-
-            total_invoiced_amount = sum(inv["amount"] for inv in previous_invoice_items)
-            invoiced_percentage = (total_invoiced_amount / item["amount"]) * 100 if item["amount"] > 0 else 0
-
-            current_invoiced_amount = sum(inv["amount"] for inv in current_invoice_items)
-            current_percentage = (current_invoiced_amount / item["amount"]) * 100 if item["amount"] > 0 else 0
-
-            remaining_amount = round(item["amount"] - (total_invoiced_amount + current_invoiced_amount), 2)
+        doc.sales_order_items = get_progress_statement(doc)
+
+
+def get_progress_statement(doc):
+    """État de situation (`sales_order_items`) d'une facture de situation,
+    mémorisé par version du document (cf. get_cached_print_context)."""
+    return get_cached_print_context(doc, "progress_statement", _build_progress_statement)
+
+
+def _invoiced_by_so_detail(doc, so_details):
+    """Lignes déjà facturées par ligne de commande, en une requête.
+
+    Renvoie ({so_detail: lignes des factures de situation validées antérieures},
+    {so_detail: lignes de la facture courante})."""
+    previous, current = {}, {}
+    if not so_details:
+        return previous, current
+    rows = frappe.db.sql(
+        """
+        SELECT si_item.so_detail, si_item.parent AS invoice, si_item.qty, si_item.rate, si_item.amount,
+               si.name = %(invoice)s AS is_current
+        FROM `tabSales Invoice Item` si_item
+        JOIN `tabSales Invoice` si ON si.name = si_item.parent
+        WHERE si_item.so_detail IN %(so_details)s
+          AND (
+              si.name = %(invoice)s
+              OR (si.is_progress_invoice = 1 AND si.docstatus = 1 AND si.progress_invoice_no < %(progress_invoice_no)s)
+          )
+        ORDER BY si_item.parent, si_item.idx
+        """,
+        {"invoice": doc.name, "so_details": so_details, "progress_invoice_no": doc.progress_invoice_no},
+        as_dict=True,
+    )
+    for r in rows:
+        target = current if r.pop("is_current") else previous
+        target.setdefault(r.pop("so_detail"), []).append(r)
+    return previous, current
 
-            item_data = {
-                **item,
-                "invoices": previous_invoice_items + current_invoice_items,
-                "total_invoiced_amount": total_invoiced_amount,
-                "invoiced_percentage": round(invoiced_percentage, 2),
-                "current_invoiced_amount": current_invoiced_amount,
-                "current_percentage": round(current_percentage, 2),
-                "remaining_amount": remaining_amount
-            }
 
-            # Accumuler dans la section si on est dans une section avec sous-totaux et que la ligne n'est pas un titre
-            if with_subtotal and item.get("row_type") != "title1":
-                section_items.append(item_data)
+def _build_progress_statement(doc):
+    # 1) Déterminer une Sales Order de référence (s'il y en a une)
+    sales_order = None
+    for item in doc.items:
+        if item.sales_order:
+            sales_order = item.sales_order
+            break
+
+    # 2) Récupérer les lignes de la commande (peut être vide si aucune SO)
+    order_items = []
+    if sales_order:
+        order_items = frappe.get_all(
+            "Sales Order Item",
+            filters={"parent": sales_order},
+            fields=[
+                "item_code", "item_name", "qty", "rate", "amount", "name",
+                "row_type", "row_print_style", "description", "idx", "with_subtotal"
+            ],
+            order_by="idx asc"
+        )
+
+    # 3) Associer aux factures et calculer les montants facturés
+    previous_by_so_detail, current_by_so_detail = _invoiced_by_so_detail(
+        doc, [item["name"] for item in order_items]
+    )
+    result = []
+    section_items = []
+    with_subtotal = False
 
-            result.append(item_data)
+    for i, item in enumerate(order_items):
+        # Mise à jour du flag de sous-total par section si on rencontre un "title1"
+        if item.get("row_type") == "title1":
+            with_subtotal = bool(item.get("with_subtotal"))
 
-        # Si la dernière section doit être totalisée
-        if section_items:
+        # Si on démarre une nouvelle section ("title1") et qu'on a accumulé la précédente, pousser son total
+        if item.get("row_type") == "title1" and section_items:
             section_total_amount = sum(x["amount"] for x in section_items)
             section_total_invoiced_amount = sum(x["total_invoiced_amount"] for x in section_items)
             section_current_invoiced_amount = sum(x["current_invoiced_amount"] for x in section_items)
@@ -233,8 +219,8 @@ def before_print(doc, method=None, print_settings=None, **kwargs):
             result.append({
                 "description": "Total Section",
                 "total_invoiced_amount": round(section_total_invoiced_amount, 2),
-                "invoiced_percentage": round(section_invoiced_percentage, 2),
                 "amount": round(section_total_amount, 2),
+                "invoiced_percentage": round(section_invoiced_percentage, 2),
                 "current_invoiced_amount": round(section_current_invoiced_amount, 2),
                 "current_percentage": round(section_current_percentage, 2),
                 "remaining_amount": round(section_remaining_amount, 2),
@@ -242,83 +228,133 @@ def before_print(doc, method=None, print_settings=None, **kwargs):
                 "row_print_style": "",
                 "idx": 0,
             })
+            section_items = []
 
-        # 4) SECTION "Articles hors commande" (items de la facture sans sales_order)
-        hors_commande_items = []
-        # Titre de section pour cohérence d'affichage
-        has_hors_commande = any(not it.sales_order for it in doc.items)
-        if has_hors_commande:
-            result.append({
-                "item_name": "ARTICLES HORS COMMANDE",
-                "description": "ARTICLES HORS COMMANDE",
-                "row_type": "title1",
-                "row_print_style": "",
-                "idx": 0,
-            })
+        previous_invoice_items = previous_by_so_detail.get(item["name"], [])
+        current_invoice_items = current_by_so_detail.get(item["name"], [])
 
-        for sales_invoice_item in doc.items:
-            if not sales_invoice_item.sales_order:
-                # Par définition ici, tout est "courant" (sur cette facture)
-                current_invoiced_amount = sales_invoice_item.amount
-
-                item_data = {
-                    **sales_invoice_item.as_dict(),
-                    "invoices": [{
-                        "invoice": doc.name,
-                        "qty": sales_invoice_item.qty,
-                        "rate": sales_invoice_item.rate,
-                        "amount": sales_invoice_item.amount
-                    }],
-                    "total_invoiced_amount": 0,
-                    "invoiced_percentage": 0,   # pas de pourcentage antérieur vs SO
-                    "current_invoiced_amount": current_invoiced_amount,
-                    "current_percentage": 100,  # 100% de ce qui est facturé ici
-                    "remaining_amount": 0
-                }
-                hors_commande_items.append(item_data)
-                result.append(item_data)
-
-        # Total de la section "Articles hors commande"
-        if hors_commande_items:
-            section_total_amount = sum(x["amount"] for x in hors_commande_items)
-            section_total_invoiced_amount = sum(x["total_invoiced_amount"] for x in hors_commande_items)
-            section_current_invoiced_amount = sum(x["current_invoiced_amount"] for x in hors_commande_items)
-            section_remaining_amount = sum(x["remaining_amount"] for x in hors_commande_items)
+        total_invoiced_amount = sum(inv["amount"] for inv in previous_invoice_items)
+        invoiced_percentage = (total_invoiced_amount / item["amount"]) * 100 if item["amount"] > 0 else 0
 
-            result.append({
-                "description": "Total Section",
-                "amount": round(section_total_amount, 2),
-                "total_invoiced_amount": round(section_total_invoiced_amount, 2),
-                "invoiced_percentage": 0,
-                "current_invoiced_amount": round(section_current_invoiced_amount, 2),
-                "current_percentage": 100,
-                "remaining_amount": 0,
-                "row_type": "total",
-                "row_print_style": "",
-                "idx": 0,
-            })
+        current_invoiced_amount = sum(inv["amount"] for inv in current_invoice_items)
+        current_percentage = (current_invoiced_amount / item["amount"]) * 100 if item["amount"] > 0 else 0
+
+        remaining_amount = round(item["amount"] - (total_invoiced_amount + current_invoiced_amount), 2)
 
-        # 5) TOTAL GÉNÉRAL (inclut les items hors commande, exclut titres et lignes de total)
-        total_amount = sum(i.get("amount", 0) for i in result if not i.get("row_type"))
-        total_invoiced_amount = sum(i.get("total_invoiced_amount", 0) for i in result if not i.get("row_type"))
-        total_current_invoiced_amount = sum(i.get("current_invoiced_amount", 0) for i in result if not i.get("row_type"))
-        total_remaining_amount = sum(i.get("remaining_amount", 0) for i in result if not i.get("row_type"))
+        item_data = {
+            **item,
+            "invoices": previous_invoice_items + current_invoice_items,
+            "total_invoiced_amount": total_invoiced_amount,
+            "invoiced_percentage": round(invoiced_percentage, 2),
+            "current_invoiced_amount": current_invoiced_amount,
+            "current_percentage": round(current_percentage, 2),
+            "remaining_amount": remaining_amount
+        }
 
-        total_invoiced_percentage = (total_invoiced_amount / total_amount) * 100 if total_amount > 0 else 0
-        total_current_percentage = (total_current_invoiced_amount / total_amount) * 100 if total_amount > 0 else 0
+        # Accumuler dans la section si on est dans une section avec sous-totaux et que la ligne n'est pas un titre
+        if with_subtotal and item.get("row_type") != "title1":
+            section_items.append(item_data)
+
+        result.append(item_data)
+
+    # Si la dernière section doit être totalisée
+    if section_items:
+        section_total_amount = sum(x["amount"] for x in section_items)
+        section_total_invoiced_amount = sum(x["total_invoiced_amount"] for x in section_items)
+        section_current_invoiced_amount = sum(x["current_invoiced_amount"] for x in section_items)
+        section_remaining_amount = sum(x["remaining_amount"] for x in section_items)
+        section_invoiced_percentage = (section_total_invoiced_amount / section_total_amount) * 100 if section_total_amount > 0 else 0
+        section_current_percentage = (section_current_invoiced_amount / section_total_amount) * 100 if section_total_amount > 0 else 0
 
         result.append({
-            "description": "Total Général",
-            "amount": round(total_amount, 2),
-            "total_invoiced_amount": round(total_invoiced_amount, 2),
-            "invoiced_percentage": round(total_invoiced_percentage, 2),
-            "current_invoiced_amount": round(total_current_invoiced_amount, 2),
-            "current_percentage": round(total_current_percentage, 2),
-            "remaining_amount": round(total_remaining_amount, 2),
+            "description": "Total Section",
+            "total_invoiced_amount": round(section_total_invoiced_amount, 2),
+            "invoiced_percentage": round(section_invoiced_percentage, 2),
+            "amount": round(section_total_amount, 2),
+            "current_invoiced_amount": round(section_current_invoiced_amount, 2),
+            "current_percentage": round(section_current_percentage, 2),
+            "remaining_amount": round(section_remaining_amount, 2),
             "row_type": "total",
             "row_print_style": "",
             "idx": 0,
         })
 
+    # 4) SECTION "Articles hors commande" (items de la facture sans sales_order)
+    hors_commande_items = []
+    # Titre de section pour cohérence d'affichage
+    has_hors_commande = any(not it.sales_order for it in doc.items)
+    if has_hors_commande:
+        result.append({
+            "item_name": "ARTICLES HORS COMMANDE",
+            "description": "ARTICLES HORS COMMANDE",
+            "row_type": "title1",
+            "row_print_style": "",
+            "idx": 0,
+        })
+
+    for sales_invoice_item in doc.items:
+        if not sales_invoice_item.sales_order:
+            # Par définition ici, tout est "courant" (sur cette facture)
+            current_invoiced_amount = sales_invoice_item.amount
+
+            item_data = {
+                **sales_invoice_item.as_dict(),
+                "invoices": [{
+                    "invoice": doc.name,
+                    "qty": sales_invoice_item.qty,
+                    "rate": sales_invoice_item.rate,
+                    "amount": sales_invoice_item.amount
+                }],
+                "total_invoiced_amount": 0,
+                "invoiced_percentage": 0,   # pas de pourcentage antérieur vs SO
+                "current_invoiced_amount": current_invoiced_amount,
+                "current_percentage": 100,  # 100% de ce qui est facturé ici
+                "remaining_amount": 0
+            }
+            hors_commande_items.append(item_data)
+            result.append(item_data)
+
+    # Total de la section "Articles hors commande"
+    if hors_commande_items:
+        section_total_amount = sum(x["amount"] for x in hors_commande_items)
+        section_total_invoiced_amount = sum(x["total_invoiced_amount"] for x in hors_commande_items)
+        section_current_invoiced_amount = sum(x["current_invoiced_amount"] for x in hors_commande_items)
+        section_remaining_amount = sum(x["remaining_amount"] for x in hors_commande_items)
+
+        result.append({
+            "description": "Total Section",
+            "amount": round(section_total_amount, 2),
+            "total_invoiced_amount": round(section_total_invoiced_amount, 2),
+            "invoiced_percentage": 0,
+            "current_invoiced_amount": round(section_current_invoiced_amount, 2),
+            "current_percentage": 100,
+            "remaining_amount": 0,
+            "row_type": "total",
+            "row_print_style": "",
+            "idx": 0,
+        })
 
-        doc.sales_order_items = result
+    # 5) TOTAL GÉNÉRAL (inclut les items hors commande, exclut titres et lignes de total)
+    total_amount = sum(i.get("amount", 0) for i in result if not i.get("row_type"))
+    total_invoiced_amount = sum(i.get("total_invoiced_amount", 0) for i in result if not i.get("row_type"))
+    total_current_invoiced_amount = sum(i.get("current_invoiced_amount", 0) for i in result if not i.get("row_type"))
+    total_remaining_amount = sum(i.get("remaining_amount", 0) for i in result if not i.get("row_type"))
+
+    total_invoiced_percentage = (total_invoiced_amount / total_amount) * 100 if total_amount > 0 else 0
+    total_current_percentage = (total_current_invoiced_amount / total_amount) * 100 if total_amount > 0 else 0
+
+    result.append({
+        "description": "Total Général",
+        "amount": round(total_amount, 2),
+        "total_invoiced_amount": round(total_invoiced_amount, 2),
+        "invoiced_percentage": round(total_invoiced_percentage, 2),
+        "current_invoiced_amount": round(total_current_invoiced_amount, 2),
+        "current_percentage": round(total_current_percentage, 2),
+        "remaining_amount": round(total_remaining_amount, 2),
+        "row_type": "total",
+        "row_print_style": "",
+        "idx": 0,
+    })
+
+
+    return result
@@ -6,6 +6,13 @@ Source de vérité : ce fichier (versionné). Les records DB ont été supprimé
 
 import frappe
 
+from vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot import (
+    refresh_for_doc,
+)
+from vt_internal.vt_internal.doctype.vt_sales_cube.vt_sales_cube import refresh_for_doc as refresh_sales_cube
+from vt_internal.vt_internal.utils.labour_hours import compute_labour_hours
+from vt_internal.vt_internal.utils.print_context import get_bom_attributes
+
 
 def before_validate(doc, method=None):
     # --- depuis Server Script « Ignore pricing rule » (Before Validate) ---
@@ -26,14 +33,7 @@ def validate(doc, method=None):
     doc.custom_remaining_amount = doc.grand_total - doc.advance_paid
     doc.total_qty = sum([i.qty if i.row_print_style != "Hide Row" and i.row_type == ""  else 0 for i in doc.items])
 
-    num_of_hours = 0
-    for i in doc.items:
-        if frappe.db.get_value("Item", i.item_code, "custom_pose_vt"):
-            num_of_hours = num_of_hours + i.qty*frappe.db.get_value("Item", i.item_code, "custom_number_of_labor_hours")
-    for i in doc.packed_items:
-        if frappe.db.get_value("Item", i.item_code, "custom_pose_vt"):
-            num_of_hours = num_of_hours + i.qty*frappe.db.get_value("Item", i.item_code, "custom_number_of_labor_hours")
-    doc.custom_labour_hours = num_of_hours
+    doc.custom_labour_hours = compute_labour_hours(doc)
 
 
     for item in doc.items:
@@ -81,6 +81,11 @@ def before_submit(doc, method=None):
         frappe.db.set_value("Quotation", q, "project", doc.project)
 
 
+def on_update(doc, method=None):
+    # Enregistrement (brouillon ou soumission) : cube des ventes
+    refresh_sales_cube(doc)
+
+
 def on_submit(doc, method=None):
     # --- depuis Server Script « Sales Order automation » (After Submit) ---
     # Update project hours
@@ -92,6 +97,9 @@ def on_submit(doc, method=None):
 
     frappe.db.set_value("Project", doc.project, "custom_estimated_labor_hours", hours)
 
+    # Instantané financier du projet (ventes/coûts théoriques, heures prévues)
+    refresh_for_doc(doc)
+
     # Reprendre les fichiers du devis
     if doc.items[0] and doc.items[0].prevdoc_docname:
         attachments = frappe.get_all("File", filters={
@@ -119,14 +127,7 @@ def before_update_after_submit(doc, method=None):
 
     doc.flags.ignore_pricing_rule = True
 
-    num_of_hours = 0
-    for i in doc.items:
-        if frappe.db.get_value("Item", i.item_code, "custom_pose_vt"):
-            num_of_hours = num_of_hours + i.qty*frappe.db.get_value("Item", i.item_code, "custom_number_of_labor_hours")
-    for i in doc.packed_items:
-        if frappe.db.get_value("Item", i.item_code, "custom_pose_vt"):
-            num_of_hours = num_of_hours + i.qty*frappe.db.get_value("Item", i.item_code, "custom_number_of_labor_hours")
-    doc.custom_labour_hours = num_of_hours
+    doc.custom_labour_hours = compute_labour_hours(doc)
 
     if doc.project:
         for i in doc.items:
@@ -143,6 +144,12 @@ def before_update_after_submit(doc, method=None):
             frappe.db.set_value("Project", doc.project, updates)
 
 
+def on_update_after_submit(doc, method=None):
+    # Lignes modifiées après validation : instantané financier du projet
+    refresh_for_doc(doc)
+    refresh_sales_cube(doc)
+
+
 def on_cancel(doc, method=None):
     # --- depuis Server Script « Commande client annulation » (After Cancel) ---
     fabrication_vts = frappe.db.get_list("Fabrication VT", {"customer_order": doc.name})
@@ -162,6 +169,9 @@ def on_cancel(doc, method=None):
 
     frappe.db.set_value("Project", doc.project, "custom_estimated_labor_hours", hours)
 
+    refresh_for_doc(doc)
+    refresh_sales_cube(doc)
+
 
 def on_trash(doc, method=None):
     # --- depuis Server Script « Suppression Commande Client » (Before Delete) ---
@@ -180,6 +190,10 @@ def on_trash(doc, method=None):
         print("Error")
 
 
+def after_delete(doc, method=None):
+    refresh_sales_cube(doc)
+
+
 def before_print(doc, method=None, print_settings=None, **kwargs):
     # --- depuis Server Script « Commande client impression » (Before Print) ---
 
@@ -189,6 +203,7 @@ def before_print(doc, method=None, print_settings=None, **kwargs):
 
     if doc.company == "Vitrerie Stéphanoise":
         doc.horraire = frappe.db.get_value("Company", doc.company, "custom_opening_hours")
+    boms = get_bom_attributes((item.bom_no for item in doc.items), fields=("reference_ligne",))
     for item in doc.items:
         if item.bom_no:
-            item.reference_ligne = frappe.db.get_value("BOM", item.bom_no, "reference_ligne")
+            item.reference_ligne = (boms.get(item.bom_no) or {}).get("reference_ligne")
@@ -6,12 +6,21 @@ Source de vérité : ce fichier (versionné). Les records DB ont été supprimé
 
 import frappe
 
+from vt_internal.vt_internal.api.chantiers import invalidate_for_doc
+from vt_internal.vt_internal.api.timesheet import (
+    invalidate_timesheet_state_for_employees,
+    invalidate_timesheet_state_for_fiches,
+)
 from vt_internal.vt_internal.constants import (
     ACTIVITY_CHANTIER,
     FT_STATUS_IN_PROGRESS,
     FT_STATUSES_TO_START,
 )
-from vt_internal.vt_internal.utils.time_utils import round_to_quarter
+from vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot import (
+    refresh_for_doc,
+    refresh_snapshots_after_commit,
+)
+from vt_internal.vt_internal.utils.time_utils import hours_between, round_to_quarter
 
 
 def before_insert(doc, method=None):
@@ -22,14 +31,12 @@ def before_insert(doc, method=None):
 
 def validate(doc, method=None):
     # --- depuis Server Script « Feuille de temps arrondi » (Before Save) ---
+    # Appelé à chaque enregistrement automatique du pointage mobile : nombre de
+    # requêtes constant, quel que soit le nombre de lignes.
+    start_fiches({row.custom_fiche_de_travail for row in doc.time_logs if row.custom_fiche_de_travail})
+
     total_hours = 0
     for row in doc.time_logs:
-        # Une fiche pointée passe automatiquement « En cours ».
-        if row.custom_fiche_de_travail:
-            ft_status = frappe.db.get_value("Fiche de travail", row.custom_fiche_de_travail, "status")
-            if ft_status in FT_STATUSES_TO_START:
-                frappe.db.set_value("Fiche de travail", row.custom_fiche_de_travail, "status", FT_STATUS_IN_PROGRESS)
-
         # Arrondi au quart d'heure (algorithme unique, cf. time_utils.round_to_quarter)
         if row.from_time:
             row.from_time = round_to_quarter(row.from_time)
@@ -38,16 +45,73 @@ def validate(doc, method=None):
 
         # Recalcul des heures seulement si les deux temps sont définis
         if row.from_time and row.to_time:
-            row.hours = frappe.utils.time_diff_in_hours(
-                frappe.utils.get_datetime(row.to_time),
-                frappe.utils.get_datetime(row.from_time),
-            )
+            row.hours = hours_between(row.from_time, row.to_time)
         else:
             row.hours = 0.0
         total_hours += row.hours
     doc.total_hours = total_hours
 
 
+def start_fiches(fiches):
+    """Une fiche pointée passe automatiquement « En cours ».
+
+    Lecture simple d'abord : un UPDATE filtré sur le statut poserait, à chaque
+    enregistrement de la feuille, un verrou exclusif sur toutes ses fiches
+    jusqu'au commit (même sans changement), et sérialiserait les équipiers qui
+    pointent sur la même fiche. L'UPDATE ne porte que sur les fiches à démarrer."""
+    if not fiches:
+        return
+    params = {"names": sorted(fiches), "to_start": list(FT_STATUSES_TO_START)}
+    to_start = frappe.db.sql_list(
+        "SELECT name FROM `tabFiche de travail` WHERE name IN %(names)s AND status IN %(to_start)s",
+        params,
+    )
+    if not to_start:
+        return
+    frappe.db.sql(
+        """
+        UPDATE `tabFiche de travail`
+        SET status = %(status)s, modified = %(now)s, modified_by = %(user)s
+        WHERE name IN %(names)s AND status IN %(to_start)s
+        """,
+        {
+            **params,
+            "names": to_start,
+            "status": FT_STATUS_IN_PROGRESS,
+            "now": frappe.utils.now(),
+            "user": frappe.session.user,
+        },
+    )
+    # Statut changé hors doc_events : état en cache des autres employés de la fiche.
+    invalidate_timesheet_state_for_fiches(to_start)
+
+
+def on_update(doc, method=None):
+    # Heures réalisées des projets (brouillons compris, docstatus != 2) : seuls
+    # les projets dont les heures changent, rafraîchis après le commit.
+    refresh_snapshots_after_commit(_projects_with_changed_hours(doc))
+    _invalidate_state(doc)
+
+
+def _projects_with_changed_hours(doc):
+    """Projets des lignes ajoutées, retirées ou dont le projet ou les heures
+    ont changé depuis la version enregistrée (toutes si la feuille est nouvelle)."""
+
+    def logs(d):
+        return {
+            (row.name, row.project, frappe.utils.flt(row.hours))
+            for row in (d.get("time_logs") or [] if d else [])
+        }
+
+    return {project for _name, project, _hours in logs(doc) ^ logs(doc.get_doc_before_save())}
+
+
+def _invalidate_state(doc):
+    """État de pointage en cache de l'employé (et de l'ancien, s'il a changé)."""
+    before = doc.get_doc_before_save()
+    invalidate_timesheet_state_for_employees([doc.employee, before.employee if before else None])
+
+
 def before_submit(doc, method=None):
     # --- depuis Server Script « Avant validation feuille de temps » (Before Submit) ---
     employee = frappe.get_doc("Employee", doc.employee)
@@ -83,28 +147,58 @@ def _hours_per_fiche(doc):
 def _apply_ft_costs(doc, sign):
     """Répartit heures et coûts de main-d'œuvre sur les fiches de travail.
 
-    sign = +1 à la validation, -1 à l'annulation.
+    sign = +1 à la validation, -1 à l'annulation. Une seule requête pour toutes
+    les fiches de la feuille, en incrément SQL (`time_spent = time_spent + …`) :
+    deux feuilles validées en même temps sur une même fiche ne s'écrasent plus.
+    La dérive éventuelle est contrôlée par tasks/verify_ft_labor_costs.
     """
     if not doc.total_hours:
         # Rien à répartir sans total (évite une division par zéro).
         return
 
-    for ft, hours in _hours_per_fiche(doc).items():
-        time_spent = max(0, frappe.utils.flt(frappe.db.get_value("Fiche de travail", ft, "time_spent")))
-        labor_costs = max(0, frappe.utils.flt(frappe.db.get_value("Fiche de travail", ft, "labor_costs")))
+    hours_per_ft = _hours_per_fiche(doc)
+    if not hours_per_ft:
+        return
 
-        percentage_of_time = hours / doc.total_hours
-        cost_delta = sign * percentage_of_time * frappe.utils.flt(doc.total_costing_amount)
-        frappe.db.set_value("Fiche de travail", ft, "labor_costs", round(labor_costs + cost_delta, 2))
-        frappe.db.set_value("Fiche de travail", ft, "time_spent", round(time_spent + sign * hours, 2))
+    params = {"names": list(hours_per_ft), "now": frappe.utils.now(), "user": frappe.session.user}
+    hours_case, costs_case = [], []
+    for i, (ft, hours) in enumerate(hours_per_ft.items()):
+        params[f"ft{i}"] = ft
+        params[f"hours{i}"] = sign * hours
+        params[f"cost{i}"] = sign * hours / doc.total_hours * frappe.utils.flt(doc.total_costing_amount)
+        hours_case.append(f"WHEN %(ft{i})s THEN %(hours{i})s")
+        costs_case.append(f"WHEN %(ft{i})s THEN %(cost{i})s")
+
+    # Valeur stockée négative ramenée à 0 avant l'incrément (comme avant).
+    frappe.db.sql(
+        f"""
+        UPDATE `tabFiche de travail`
+        SET time_spent = ROUND(GREATEST(IFNULL(time_spent, 0), 0) + CASE name {" ".join(hours_case)} END, 2),
+            labor_costs = ROUND(GREATEST(IFNULL(labor_costs, 0), 0) + CASE name {" ".join(costs_case)} END, 2),
+            modified = %(now)s,
+            modified_by = %(user)s
+        WHERE name IN %(names)s
+        """,
+        params,
+    )
 
 
 def on_submit(doc, method=None):
     # --- depuis Server Script « Feuille de temps validation » (After Submit) ---
     doc.custom_day_finished = True
     _apply_ft_costs(doc, sign=1)
+    invalidate_for_doc(doc)
 
 
 def on_cancel(doc, method=None):
     # --- depuis Server Script « Feuille de temps annulation » (After Cancel) ---
     _apply_ft_costs(doc, sign=-1)
+    refresh_for_doc(doc)
+    invalidate_for_doc(doc)
+    _invalidate_state(doc)
+
+
+def after_delete(doc, method=None):
+    # Brouillon supprimé : ses heures sortent de l'instantané financier.
+    refresh_for_doc(doc)
+    _invalidate_state(doc)
@@ -76,6 +76,22 @@ def get_events(
 	if filter_condition and "`tabEvent Participants`" in filter_condition:
 		tables.append("`tabEvent Participants`")
 
+	# Bornes en datetime (intervalle semi-ouvert [début, fin + 1 jour[) plutôt que
+	# date(starts_on) : les index (starts_on, ends_on) et (repeat_this_event,
+	# repeat_till) restent utilisables (cf. patches/add_event_calendar_indexes.py).
+	start_day, end_day = getdate(start), getdate(end)
+	range_start = datetime.datetime.combine(start_day, datetime.time.min)
+	range_end = (
+		datetime.datetime.combine(end_day, datetime.time.min) + datetime.timedelta(days=1)
+		if end_day < datetime.date.max
+		else datetime.datetime.max
+	)
+
+	# Événements partagés avec l'utilisateur, lus une fois (au lieu d'un EXISTS par ligne).
+	shared = frappe.get_all(
+		"DocShare", filters={"share_doctype": "Event", "user": user}, pluck="share_name"
+	)
+
 	events = frappe.db.sql(
 		"""
 		SELECT `tabEvent`.name,
@@ -96,17 +112,16 @@ def get_events(
 		FROM {tables}
 		WHERE (
 				(
-					(date(`tabEvent`.starts_on) BETWEEN date(%(start)s) AND date(%(end)s))
-					OR (date(`tabEvent`.ends_on) BETWEEN date(%(start)s) AND date(%(end)s))
-					OR (
-						date(`tabEvent`.starts_on) <= date(%(start)s)
-						AND date(`tabEvent`.ends_on) >= date(%(end)s)
+					`tabEvent`.starts_on < %(range_end)s
+					AND (
+						`tabEvent`.ends_on >= %(range_start)s
+						OR (`tabEvent`.ends_on IS NULL AND `tabEvent`.starts_on >= %(range_start)s)
 					)
 				)
 				OR (
-					date(`tabEvent`.starts_on) <= date(%(start)s)
-					AND `tabEvent`.repeat_this_event=1
-					AND coalesce(`tabEvent`.repeat_till, '3000-01-01') > date(%(start)s)
+					`tabEvent`.repeat_this_event=1
+					AND (`tabEvent`.repeat_till IS NULL OR `tabEvent`.repeat_till > %(start_date)s)
+					AND `tabEvent`.starts_on < %(range_start_next)s
 				)
 			)
 		{reminder_condition}
@@ -115,13 +130,7 @@ def get_events(
 		AND (
 				`tabEvent`.event_type='Public'
 				OR `tabEvent`.owner=%(user)s
-				OR EXISTS(
-					SELECT `tabDocShare`.name
-					FROM `tabDocShare`
-					WHERE `tabDocShare`.share_doctype='Event'
-						AND `tabDocShare`.share_name=`tabEvent`.name
-						AND `tabDocShare`.user=%(user)s
-				)
+				{shared_condition}
 			)
 		{additional_condition}
 		ORDER BY {order_by}
@@ -130,15 +139,19 @@ def get_events(
 			tables=", ".join(tables),
 			filter_condition=filter_condition,
 			match_conditions=match_conditions,  # <-- AJOUT CLÉ
+			shared_condition="OR `tabEvent`.name IN %(shared)s" if shared else "",
 			reminder_condition="AND coalesce(`tabEvent`.send_reminder, 0)=1" if for_reminder else "",
 			limit_condition=f"LIMIT {limit_page_length} OFFSET {limit_start}" if limit_page_length else "",
 			order_by="`tabEvent`.starts_on desc" if limit_page_length else "`tabEvent`.starts_on",
 			additional_condition=additional_condition or "",
 		),
 		{
-			"start": start,
-			"end": end,
+			"start_date": start_day,
+			"range_start": range_start,
+			"range_start_next": range_start + datetime.timedelta(days=1),
+			"range_end": range_end,
 			"user": user,
+			"shared": shared,
 		},
 		as_dict=1,
 	)
@@ -0,0 +1,13 @@
+"""Index composites sur tabEvent pour overrides/event.get_events.
+
+Le calendrier filtre sur des bornes datetime (starts_on / ends_on) et sur les
+événements récurrents encore actifs (repeat_this_event / repeat_till) : sans
+ces index, chaque affichage parcourt toute la table.
+"""
+
+import frappe
+
+
+def execute():
+    frappe.db.add_index("Event", ["starts_on", "ends_on"], index_name="starts_on_ends_on_index")
+    frappe.db.add_index("Event", ["repeat_this_event", "repeat_till"], index_name="repeat_this_event_repeat_till_index")
@@ -1,4 +1,8 @@
 frappe.query_reports["Délais de traitement des commandes"] = {
+    "onload": function(report) {
+        // Calcul en tâche de fond sur un an ou plus + bouton « Recalculer »
+        vt.report_jobs.setup(report);
+    },
     "filters": [
         {
             "fieldname": "from_date",
@@ -96,20 +100,5 @@ frappe.query_reports["Délais de traitement des commandes"] = {
 };
 
 window.openProjectDetails = function(project) {
-    const dialog = new frappe.ui.Dialog({
-        size: "extra-large",
-        title: __("Détails du projet"),
-        fields: [{ fieldname: "content", fieldtype: "HTML" }],
-        primary_action: function() {
-            frappe.set_route("Form", "Project", project);
-        },
-        primary_action_label: __("Ouvrir le projet"),
-    });
-
-    frappe.call({
-        method: "vt_internal.vt_internal.api.project_details.project_details",
-        args: { project: project }
-    }).then((r) => dialog.fields_dict.content.$wrapper.html(r.message.html));
-
-    dialog.show();
+    vt.project_details.show(project);
 };
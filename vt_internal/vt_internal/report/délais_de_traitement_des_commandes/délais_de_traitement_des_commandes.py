@@ -6,7 +6,16 @@ from frappe import _
 from frappe.utils import flt, getdate, date_diff
 import json
 
+from vt_internal.vt_internal.utils.report_jobs import background_report, long_date_range, report_progress
 
+
+@background_report(
+	"Délais de traitement des commandes",
+	depends_on=(
+		"Project", "Customer", "Quotation", "Sales Order", "Work Completion Receipt", "Sales Invoice", "Payment Entry",
+	),
+	is_long=long_date_range,
+)
 def execute(filters=None):
 	# Forcer prepared_report = 0 pour éviter le mode arrière-plan
 	frappe.db.set_value('Report', 'Délais de traitement des commandes', 'prepared_report', 0, update_modified=False)
@@ -15,6 +24,7 @@ def execute(filters=None):
 
 	columns = get_columns()
 	data = get_data(filters)
+	report_progress(80, _("Graphique"))
 
 	if not data:
 		return columns, [], None
@@ -7,6 +7,9 @@ from frappe.utils import flt, getdate, nowdate
 from collections import defaultdict
 import json
 
+from vt_internal.vt_internal.doctype.vt_sales_cube.vt_sales_cube import is_ready as sales_cube_ready
+from vt_internal.vt_internal.utils.periods import PeriodLookup
+
 
 def execute(filters: dict | None = None):
 	filters = frappe._dict(filters or {})
@@ -38,7 +41,8 @@ def execute(filters: dict | None = None):
 	objectives = get_objectives(users, filters.fiscal_year)
 
 	# Aggregate by period
-	data, chart_data = aggregate_data(quotations, sales_orders, invoices, objectives, range_type)
+	periods = PeriodLookup(start_date, end_date, range_type)
+	data, chart_data = aggregate_data(quotations, sales_orders, invoices, objectives, range_type, periods)
 
 	# Apply cumulative if requested
 	if filters.get("cumulative"):
@@ -70,6 +74,9 @@ def get_columns():
 
 
 def get_quotations(users, start_date, end_date):
+	if sales_cube_ready():
+		return get_from_cube("Quotation", (0, 1), users, start_date, end_date)
+
 	conditions = [
 		"docstatus IN (0, 1)",
 		"(custom_dernier_statut_de_suivi IS NULL OR custom_dernier_statut_de_suivi != 'Variante')",
@@ -94,6 +101,9 @@ def get_quotations(users, start_date, end_date):
 
 
 def get_sales_orders(users, start_date, end_date):
+	if sales_cube_ready():
+		return get_from_cube("Sales Order", (0, 1), users, start_date, end_date)
+
 	conditions = [
 		"docstatus IN (0, 1)",
 		"transaction_date BETWEEN %(start_date)s AND %(end_date)s"
@@ -117,6 +127,10 @@ def get_sales_orders(users, start_date, end_date):
 
 
 def get_invoices(users, start_date, end_date):
+	if sales_cube_ready():
+		# Dans le cube, le responsable d'une facture est le chef de projet.
+		return get_from_cube("Sales Invoice", (1,), users, start_date, end_date)
+
 	conditions = [
 		"si.docstatus = 1",
 		"si.posting_date BETWEEN %(start_date)s AND %(end_date)s"
@@ -140,6 +154,34 @@ def get_invoices(users, start_date, end_date):
 	return frappe.db.sql(query, params, as_dict=True)
 
 
+def get_from_cube(source_doctype, docstatus, users, start_date, end_date):
+	"""Totaux et nombre de documents par jour, lus dans le cube des ventes
+	(mêmes colonnes que les requêtes sur les documents)."""
+	conditions = [
+		"source_doctype = %(source_doctype)s",
+		"source_docstatus IN %(docstatus)s",
+		"is_variant = 0",
+		"posting_date BETWEEN %(start_date)s AND %(end_date)s"
+	]
+	params = {"source_doctype": source_doctype, "docstatus": docstatus, "start_date": start_date, "end_date": end_date}
+
+	if users:
+		conditions.append("responsable IN %(users)s")
+		params["users"] = users
+
+	query = f"""
+		SELECT
+			posting_date as transaction_date,
+			SUM(total) as total,
+			SUM(doc_count) as count
+		FROM `tabVT Sales Cube`
+		WHERE {' AND '.join(conditions)}
+		GROUP BY posting_date
+	"""
+
+	return frappe.db.sql(query, params, as_dict=True)
+
+
 def get_objectives(users, fiscal_year):
 	"""Get objectives from VT Objective doctype, aggregated by week."""
 	conditions = ["vo.fiscal_year = %(fiscal_year)s"]
@@ -175,22 +217,6 @@ def get_objectives(users, fiscal_year):
 	return objectives_by_week
 
 
-def get_week_number(date):
-	"""Get ISO week number from date."""
-	return getdate(date).isocalendar()[1]
-
-
-def get_month_number(date):
-	"""Get month number from date."""
-	return getdate(date).month
-
-
-def get_quarter_number(date):
-	"""Get quarter number from date."""
-	month = getdate(date).month
-	return (month - 1) // 3 + 1
-
-
 def get_period_label(period_num, range_type):
 	"""Get label for a period."""
 	if range_type == "Semaine":
@@ -202,16 +228,6 @@ def get_period_label(period_num, range_type):
 		return f"T{period_num}"
 
 
-def get_period_number(date, range_type):
-	"""Get period number based on range type."""
-	if range_type == "Semaine":
-		return get_week_number(date)
-	elif range_type == "Mois":
-		return get_month_number(date)
-	else:  # Trimestre
-		return get_quarter_number(date)
-
-
 def get_weeks_for_period(period_num, range_type):
 	"""Get list of week numbers for a given period."""
 	if range_type == "Semaine":
@@ -243,13 +259,13 @@ def get_period_count(range_type):
 		return 4
 
 
-def aggregate_data(quotations, sales_orders, invoices, objectives, range_type):
-	"""Aggregate data by period."""
+def aggregate_data(quotations, sales_orders, invoices, objectives, range_type, periods):
+	"""Aggregate data by period (numéros de période via `periods`, un PeriodLookup)."""
 	period_count = get_period_count(range_type)
 
 	# Get current period to exclude future periods
 	today = getdate(nowdate())
-	current_period = get_period_number(today, range_type)
+	current_period = periods.period(today).number
 
 	# Initialize aggregated data
 	aggregated = defaultdict(lambda: {
@@ -266,20 +282,20 @@ def aggregate_data(quotations, sales_orders, invoices, objectives, range_type):
 
 	# Aggregate quotations
 	for q in quotations:
-		period = get_period_number(q.transaction_date, range_type)
-		aggregated[period]["nb_quotations"] += 1
+		period = periods.period(q.transaction_date).number
+		aggregated[period]["nb_quotations"] += q.count
 		aggregated[period]["quotation_amount"] += flt(q.total)
 
 	# Aggregate sales orders
 	for so in sales_orders:
-		period = get_period_number(so.transaction_date, range_type)
-		aggregated[period]["nb_orders"] += 1
+		period = periods.period(so.transaction_date).number
+		aggregated[period]["nb_orders"] += so.count
 		aggregated[period]["order_amount"] += flt(so.total)
 
 	# Aggregate invoices
 	for inv in invoices:
-		period = get_period_number(inv.transaction_date, range_type)
-		aggregated[period]["nb_invoices"] += 1
+		period = periods.period(inv.transaction_date).number
+		aggregated[period]["nb_invoices"] += inv.count
 		aggregated[period]["invoice_amount"] += flt(inv.total)
 
 	# Aggregate objectives by period
@@ -90,21 +90,6 @@ frappe.query_reports["Order book"] = {
 
 if (!window.openProjectDetails) {
     window.openProjectDetails = function(project) {
-        const dialog = new frappe.ui.Dialog({
-            size: "extra-large",
-            title: __("Details du projet"),
-            fields: [{ fieldname: "content", fieldtype: "HTML" }],
-            primary_action: function() {
-                frappe.set_route('Form', "Project", project);
-            },
-            primary_action_label: __("Projet"),
-        });
-
-        frappe.call({
-            method: "vt_internal.vt_internal.api.project_details.project_details",
-            args: { project: project }
-        }).then((r) => dialog.fields_dict.content.$wrapper.html(r.message.html));
-
-        dialog.show();
+        vt.project_details.show(project);
     };
 }
\ No newline at end of file
@@ -6,6 +6,8 @@ from frappe import _
 from frappe.utils import flt
 from collections import defaultdict
 
+from vt_internal.vt_internal.doctype.vt_sales_cube.vt_sales_cube import is_ready as sales_cube_ready
+
 
 def execute(filters: dict | None = None):
 	"""Point d'entrée principal du rapport."""
@@ -150,12 +152,16 @@ class PerformanceCommercialeReport:
 		return conditions, params
 
 	def get_quotations(self) -> list[dict]:
-		"""Récupère les devis (hors variantes)."""
+		"""Récupère les devis (hors variantes) ; `nb` : nombre de devis de la ligne."""
+		if sales_cube_ready():
+			return self.get_from_cube("Quotation")
+
 		conditions, params = self.get_base_conditions("q")
 
 		query = """
 			SELECT
 				q.name,
+				1 as nb,
 				q.cost_center,
 				q.secteur_vt,
 				q.grand_total,
@@ -172,11 +178,15 @@ class PerformanceCommercialeReport:
 
 	def get_sales_orders_with_margin(self) -> list[dict]:
 		"""Récupère les commandes avec calcul des marges via les items."""
+		if sales_cube_ready():
+			return self.get_from_cube("Sales Order")
+
 		conditions, params = self.get_base_conditions("so")
 
 		query = """
 			SELECT
 				so.name,
+				1 as nb,
 				so.cost_center,
 				so.secteur_vt,
 				so.base_net_total,
@@ -195,6 +205,33 @@ class PerformanceCommercialeReport:
 
 		return frappe.db.sql(query, params, as_dict=True)
 
+	def get_from_cube(self, source_doctype: str) -> list[dict]:
+		"""Devis ou commandes (brouillons et validés) agrégés par centre de coût,
+		secteur et groupe de client, lus dans le cube des ventes."""
+		conditions, params = self.get_base_conditions("c")
+		conditions = [cond.replace("c.transaction_date", "c.posting_date") for cond in conditions]
+		params["source_doctype"] = source_doctype
+
+		query = """
+			SELECT
+				c.cost_center,
+				c.secteur_vt,
+				c.customer_group,
+				SUM(c.doc_count) as nb,
+				SUM(c.grand_total) as grand_total,
+				SUM(c.base_net_total) as base_net_total,
+				SUM(c.margin_sale) as prix_vente,
+				SUM(c.margin_cost) as prix_achat
+			FROM `tabVT Sales Cube` c
+			WHERE c.source_doctype = %(source_doctype)s
+				AND c.source_docstatus IN (0, 1)
+				AND c.is_variant = 0
+				AND {conditions}
+			GROUP BY c.cost_center, c.secteur_vt, c.customer_group
+		""".format(conditions=" AND ".join(conditions))
+
+		return frappe.db.sql(query, params, as_dict=True)
+
 	def get_cost_center_hierarchy(self) -> dict:
 		"""Récupère la hiérarchie des centres de coûts (enfant → parent)."""
 		cost_centers = frappe.get_all(
@@ -223,14 +260,14 @@ class PerformanceCommercialeReport:
 		for q in quotations:
 			secteur = q.get("secteur_vt") or _("(Non défini)")
 			cc = q.get("cost_center") or _("(Non défini)")
-			aggregated[secteur][cc]["nb_devis"] += 1
+			aggregated[secteur][cc]["nb_devis"] += q.nb
 			aggregated[secteur][cc]["valeur_devis"] += flt(q.grand_total)
 
 		# Agréger les commandes
 		for so in sales_orders:
 			secteur = so.get("secteur_vt") or _("(Non défini)")
 			cc = so.get("cost_center") or _("(Non défini)")
-			aggregated[secteur][cc]["nb_commandes"] += 1
+			aggregated[secteur][cc]["nb_commandes"] += so.nb
 			aggregated[secteur][cc]["valeur_commandes"] += flt(so.base_net_total)
 			aggregated[secteur][cc]["prix_vente"] += flt(so.prix_vente)
 			aggregated[secteur][cc]["prix_achat"] += flt(so.prix_achat)
@@ -299,7 +336,7 @@ class PerformanceCommercialeReport:
 			parent_cc = cc_hierarchy.get(cc) or cc  # Si pas de parent, utiliser le CC lui-même
 			secteur = q.get("secteur_vt") or _("(Non défini)")
 
-			aggregated[parent_cc][cc][secteur]["nb_devis"] += 1
+			aggregated[parent_cc][cc][secteur]["nb_devis"] += q.nb
 			aggregated[parent_cc][cc][secteur]["valeur_devis"] += flt(q.grand_total)
 
 		# Agréger les commandes
@@ -308,7 +345,7 @@ class PerformanceCommercialeReport:
 			parent_cc = cc_hierarchy.get(cc) or cc
 			secteur = so.get("secteur_vt") or _("(Non défini)")
 
-			aggregated[parent_cc][cc][secteur]["nb_commandes"] += 1
+			aggregated[parent_cc][cc][secteur]["nb_commandes"] += so.nb
 			aggregated[parent_cc][cc][secteur]["valeur_commandes"] += flt(so.base_net_total)
 			aggregated[parent_cc][cc][secteur]["prix_vente"] += flt(so.prix_vente)
 			aggregated[parent_cc][cc][secteur]["prix_achat"] += flt(so.prix_achat)
@@ -406,13 +443,13 @@ class PerformanceCommercialeReport:
 		# Agréger les devis
 		for q in quotations:
 			group = q.get("customer_group") or _("(Non défini)")
-			aggregated[group]["nb_devis"] += 1
+			aggregated[group]["nb_devis"] += q.nb
 			aggregated[group]["valeur_devis"] += flt(q.grand_total)
 
 		# Agréger les commandes
 		for so in sales_orders:
 			group = so.get("customer_group") or _("(Non défini)")
-			aggregated[group]["nb_commandes"] += 1
+			aggregated[group]["nb_commandes"] += so.nb
 			aggregated[group]["valeur_commandes"] += flt(so.base_net_total)
 			aggregated[group]["prix_vente"] += flt(so.prix_vente)
 			aggregated[group]["prix_achat"] += flt(so.prix_achat)
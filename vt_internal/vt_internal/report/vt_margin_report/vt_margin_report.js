@@ -1,4 +1,8 @@
 frappe.query_reports["VT Margin Report"] = {
+    "onload": function(report) {
+        // Calcul en tâche de fond sur un an ou plus + bouton « Recalculer »
+        vt.report_jobs.setup(report);
+    },
     "filters": [
         {
             "fieldname": "grouped_by",
@@ -2,11 +2,19 @@ import frappe
 from frappe import _
 from frappe.utils import getdate
 from collections import defaultdict
-from datetime import date
-from dateutil.relativedelta import relativedelta
-
-from vt_internal.vt_internal.utils.margin_utils import get_theoretical
 
+from vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot import (
+    SNAPSHOT_FIELDS,
+    refresh_snapshots,
+)
+from vt_internal.vt_internal.utils.periods import PeriodLookup
+from vt_internal.vt_internal.utils.report_jobs import background_report, long_date_range, report_progress
+
+@background_report(
+    "VT Margin Report",
+    depends_on=("Project", "Project Financial Snapshot", "Cost Center"),
+    is_long=long_date_range,
+)
 def execute(filters=None):
     if not filters:
         filters = {}
@@ -73,64 +81,18 @@ def get_columns(filters):
 
     return columns
 
+def get_period_lookup(filters):
+    return PeriodLookup(filters["from_date"], filters["to_date"], filters.get("range", "Mensuel"))
+
 def get_periods(filters):
-    from_date = getdate(filters["from_date"])
-    to_date = getdate(filters["to_date"])
-    range_type = filters.get("range", "Mensuel")
-    periods = []
-
-    if range_type == "Mensuel":
-        current = date(from_date.year, from_date.month, 1)
-        while current <= to_date:
-            key = current.strftime("%Y_%m")
-            label = current.strftime("%b %Y")
-            end = current + relativedelta(months=1, days=-1)
-            if end > to_date:
-                end = to_date
-            periods.append({"key": key, "label": label, "start": current, "end": end})
-            current += relativedelta(months=1)
-
-    elif range_type == "Trimestriel":
-        current_year = from_date.year
-        current_quarter = (from_date.month - 1) // 3 + 1
-        while True:
-            key = f"{current_year}_q{current_quarter}"
-            label = f"Q{current_quarter} {current_year}"
-            start_month = (current_quarter - 1) * 3 + 1
-            start = date(current_year, start_month, 1)
-            end = start + relativedelta(months=3, days=-1)
-            if start > to_date:
-                break
-            if end > to_date:
-                end = to_date
-            if start < from_date:
-                start = from_date
-            periods.append({"key": key, "label": label, "start": start, "end": end})
-            current_quarter += 1
-            if current_quarter > 4:
-                current_quarter = 1
-                current_year += 1
-
-    elif range_type == "Annuel":
-        current_year = from_date.year
-        while current_year <= to_date.year:
-            key = str(current_year)
-            label = str(current_year)
-            start = date(current_year, 1, 1)
-            end = date(current_year, 12, 31)
-            if start < from_date:
-                start = from_date
-            if end > to_date:
-                end = to_date
-            periods.append({"key": key, "label": label, "start": start, "end": end})
-            current_year += 1
-
-    return periods
+    return get_period_lookup(filters).periods
 
 def get_data(filters):
     conditions, params = get_conditions(filters)
+    # Une seule requête : projets + instantané financier pré-agrégé (ventes et
+    # coûts théoriques par axe, commandes fournisseur, fabrications)
     projects = frappe.db.sql("""
-        SELECT 
+        SELECT
             p.name AS project,
             p.company,
             p.cost_center,
@@ -143,15 +105,26 @@ def get_data(filters):
             p.insurance,
             p.project_type,
             p.secteur_vt,
-            (SELECT COALESCE(SUM(f.manufacturing_costs), 0) FROM `tabFabrication VT` f WHERE f.project = p.name) AS total_manufacturing_cost,
-            (SELECT COALESCE(SUM(poi.amount), 0) FROM `tabPurchase Order Item` poi INNER JOIN `tabPurchase Order` po ON po.name = poi.parent WHERE poi.project = p.name AND po.docstatus < 2) AS total_purchase_order
+            s.name AS snapshot,
+            {snapshot_fields}
         FROM `tabProject` p
+        LEFT JOIN `tabProject Financial Snapshot` s ON s.name = p.name
         WHERE {conditions}
-    """.format(conditions=" AND ".join(conditions)), params, as_dict=1)
+    """.format(
+        snapshot_fields=", ".join(f"s.{f}" for f in SNAPSHOT_FIELDS),
+        conditions=" AND ".join(conditions),
+    ), params, as_dict=1)
+
+    report_progress(30, _("Instantanés financiers"))
+
+    # Projets jamais instantanés : calculés en un lot
+    missing = {p.project: p for p in projects if not p.snapshot}
+    for name, values in refresh_snapshots(list(missing)).items():
+        missing[name].update(values)
 
     analysis_axis = filters.get("analysis_axis")
     grouped_by = filters.get("grouped_by")
-    range_type = filters.get("range", "Mensuel")
+    period_lookup = get_period_lookup(filters)
 
     aggregated = defaultdict(lambda: defaultdict(lambda: {
         'real_vente': 0, 'real_cost': 0, 'theo_vente': 0, 'theo_cost': 0
@@ -169,12 +142,11 @@ def get_data(filters):
     for project in projects:
         if not project.expected_end_date:
             continue
-        period_key = get_period_key(project.expected_end_date, range_type)
+        period_key = period_lookup.key(project.expected_end_date)
         group_value = get_group_value(grouped_by, project)
 
-        # Compute theoretical values once for both axes
-        theo_vente_tp, theo_cost_tp = get_theoretical(project.project, "Temps passé")
-        theo_vente_ach, theo_cost_ach = get_theoretical(project.project, "Achats")
+        theo_vente_tp, theo_cost_tp = project.theo_vente_tp or 0, project.theo_cost_tp or 0
+        theo_vente_ach, theo_cost_ach = project.theo_vente_ach or 0, project.theo_cost_ach or 0
 
         # Determine real_vente and real_cost based on analysis_axis
         if analysis_axis == "Marge globale":
@@ -210,7 +182,7 @@ def get_data(filters):
         grand_theo_vente += theo_vente
         grand_theo_cost += theo_cost
 
-    periods = get_periods(filters)
+    periods = period_lookup.periods
     data = []
     fieldname = get_fieldname(grouped_by)
 		
@@ -224,29 +196,15 @@ def get_data(filters):
         for period in periods:
             p_key = period["key"]
             if p_key in aggregated[group]:
-                rv = aggregated[group][p_key]['real_vente']
-                rc = aggregated[group][p_key]['real_cost']
-                tv = aggregated[group][p_key]['theo_vente']
-                tc = aggregated[group][p_key]['theo_cost']
-
-                real_m = (rv - rc) / rv * 100 if rv > 0 else 0
-                theo_m = (tv - tc) / tv * 100 if tv > 0 else 0
-                row[p_key] = real_m
-
-                montant_val = (rv - rc)
-                row[p_key + "_montant"] = montant_val
+                agg = aggregated[group][p_key]
+                set_period_cells(row, p_key, agg)
 
-                diff_val = montant_val - ((tv - tc))
-                row[p_key + "_diff"] = diff_val
-
-                group_total_real_vente += rv
-                group_total_real_cost += rc
-                group_total_theo_vente += tv
-                group_total_theo_cost += tc
+                group_total_real_vente += agg['real_vente']
+                group_total_real_cost += agg['real_cost']
+                group_total_theo_vente += agg['theo_vente']
+                group_total_theo_cost += agg['theo_cost']
             else:
-                row[p_key] = 0
-                row[p_key + "_montant"] = 0
-                row[p_key + "_diff"] = 0
+                set_period_cells(row, p_key, None)
 
         group_total_real_m = (group_total_real_vente - group_total_real_cost) / group_total_real_vente * 100 if group_total_real_vente > 0 else 0
         row["total"] = group_total_real_m
@@ -264,30 +222,25 @@ def get_data(filters):
 
         for period in periods:
             p_key = period["key"]
-            if p_key in period_agg:
-                rv = period_agg[p_key]['real_vente']
-                rc = period_agg[p_key]['real_cost']
-                tv = period_agg[p_key]['theo_vente']
-                tc = period_agg[p_key]['theo_cost']
-
-                real_m = (rv - rc) / rv * 100 if rv > 0 else 0
-                theo_m = (tv - tc) / tv * 100 if tv > 0 else 0
-                total_row[p_key] = real_m
-
-                montant_val = (rv - rc)
-                total_row[p_key + "_montant"] = montant_val
-
-                diff_val = montant_val - ((tv - tc))
-                total_row[p_key + "_diff"] = diff_val
-            else:
-                total_row[p_key] = 0
-                total_row[p_key + "_montant"] = 0
-                total_row[p_key + "_diff"] = 0
+            set_period_cells(total_row, p_key, period_agg.get(p_key))
 
         data.append(total_row)
 
     return data
 
+def set_period_cells(row, p_key, agg):
+    """Marge réelle %, montant et écart au théorique d'une période."""
+    if not agg:
+        row[p_key] = 0
+        row[p_key + "_montant"] = 0
+        row[p_key + "_diff"] = 0
+        return
+    rv, rc = agg['real_vente'], agg['real_cost']
+    tv, tc = agg['theo_vente'], agg['theo_cost']
+    row[p_key] = (rv - rc) / rv * 100 if rv > 0 else 0
+    row[p_key + "_montant"] = rv - rc
+    row[p_key + "_diff"] = (rv - rc) - (tv - tc)
+
 def get_conditions(filters):
     conditions = ["p.status = 'Completed'"]
     params = {
@@ -330,16 +283,6 @@ def get_conditions(filters):
 
     return conditions, params
 
-def get_period_key(end_date, range_type):
-    end_date = getdate(end_date)
-    if range_type == "Mensuel":
-        return end_date.strftime("%Y_%m")
-    elif range_type == "Trimestriel":
-        quarter = (end_date.month - 1) // 3 + 1
-        return f"{end_date.year}_q{quarter}"
-    elif range_type == "Annuel":
-        return str(end_date.year)
-
 def get_group_value(grouped_by, project):
     if grouped_by == "Project":
         return project["project"]
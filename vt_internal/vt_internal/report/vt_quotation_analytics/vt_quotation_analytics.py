@@ -2,8 +2,8 @@ import frappe
 from frappe import _
 from frappe.utils import getdate
 from collections import defaultdict
-from datetime import date
-from dateutil.relativedelta import relativedelta
+
+from vt_internal.vt_internal.utils.periods import PeriodLookup
 
 def execute(filters=None):
     if not filters:
@@ -74,72 +74,11 @@ def get_metric_fieldtype(metric):
         return "Percent"
     return "Data"
 
+def get_period_lookup(filters):
+    return PeriodLookup(filters["from_date"], filters["to_date"], filters.get("range", "Mensuel"))
+
 def get_periods(filters):
-    from_date = getdate(filters["from_date"])
-    to_date = getdate(filters["to_date"])
-    range_type = filters.get("range", "Mensuel")
-    periods = []
-
-    if range_type == "Hebdomadaire":
-        current = from_date
-        week_num = 1
-        while current <= to_date:
-            key = f"{from_date.year}_w{week_num}"
-            label = f"Sem {week_num} ({current.strftime('%Y-%m-%d')})"
-            end = current + relativedelta(days=6)
-            if end > to_date:
-                end = to_date
-            periods.append({"key": key, "label": label, "start": current, "end": end})
-            current = end + relativedelta(days=1)
-            week_num += 1
-
-    elif range_type == "Mensuel":
-        current = date(from_date.year, from_date.month, 1)
-        while current <= to_date:
-            key = current.strftime("%Y_%m")
-            label = current.strftime("%b %Y")
-            end = current + relativedelta(months=1, days=-1)
-            if end > to_date:
-                end = to_date
-            periods.append({"key": key, "label": label, "start": current, "end": end})
-            current += relativedelta(months=1)
-
-    elif range_type == "Trimestriel":
-        current_year = from_date.year
-        current_quarter = (from_date.month - 1) // 3 + 1
-        while True:
-            key = f"{current_year}_q{current_quarter}"
-            label = f"Q{current_quarter} {current_year}"
-            start_month = (current_quarter - 1) * 3 + 1
-            start = date(current_year, start_month, 1)
-            end = start + relativedelta(months=3, days=-1)
-            if start > to_date:
-                break
-            if end > to_date:
-                end = to_date
-            if start < from_date:
-                start = from_date
-            periods.append({"key": key, "label": label, "start": start, "end": end})
-            current_quarter += 1
-            if current_quarter > 4:
-                current_quarter = 1
-                current_year += 1
-
-    elif range_type == "Annuel":
-        current_year = from_date.year
-        while current_year <= to_date.year:
-            key = str(current_year)
-            label = str(current_year)
-            start = date(current_year, 1, 1)
-            end = date(current_year, 12, 31)
-            if start < from_date:
-                start = from_date
-            if end > to_date:
-                end = to_date
-            periods.append({"key": key, "label": label, "start": start, "end": end})
-            current_year += 1
-
-    return periods
+    return get_period_lookup(filters).periods
 
 def get_data(filters):
     conditions, params = get_conditions(filters)
@@ -166,7 +105,7 @@ def get_data(filters):
 
     grouped_by = filters.get("grouped_by")
     metric = filters.get("metric")
-    range_type = filters.get("range", "Mensuel")
+    period_lookup = get_period_lookup(filters)
 
     aggregated = defaultdict(lambda: defaultdict(lambda: {
         'qty': 0,
@@ -201,7 +140,7 @@ def get_data(filters):
     for quot in quotations:
         if not quot.transaction_date:
             continue
-        period_key = get_period_key(quot.transaction_date, range_type)
+        period_key = period_lookup.key(quot.transaction_date)
         group_value = get_group_value(grouped_by, quot)
 
         if grouped_by == "Devis":
@@ -248,7 +187,7 @@ def get_data(filters):
             grand_conv_qty += 1
             grand_conv_montant += montant
 
-    periods = get_periods(filters)
+    periods = period_lookup.periods
     data = []
     fieldname = get_fieldname(grouped_by)
 
@@ -371,19 +310,6 @@ def get_conditions(filters):
 
     return conditions, params
 
-def get_period_key(trans_date, range_type):
-    trans_date = getdate(trans_date)
-    if range_type == "Hebdomadaire":
-        year, week, _ = trans_date.isocalendar()
-        return f"{year}_w{week}"
-    elif range_type == "Mensuel":
-        return trans_date.strftime("%Y_%m")
-    elif range_type == "Trimestriel":
-        quarter = (trans_date.month - 1) // 3 + 1
-        return f"{trans_date.year}_q{quarter}"
-    elif range_type == "Annuel":
-        return str(trans_date.year)
-
 def get_group_value(grouped_by, quot):
     if grouped_by == "Devis":
         return quot["quotation"] or ""
@@ -6,6 +6,8 @@ frappe.query_reports["VT Sales Analytics"] = {
 		// état initial : ajuster l'affichage de Range / Column Limit
 		const column_by = report.get_filter("column_by").get_value();
 		toggle_period_vs_dimension_ui(report, column_by);
+		// Calcul en tâche de fond (Article / Par verre sur un an) + « Recalculer »
+		vt.report_jobs.setup(report);
 	},
 
 	"filters": [
@@ -1,12 +1,26 @@
 # Copyright (c) 2013, Frappe Technologies Pvt. Ltd.
 # For license information, please see license.txt
 
+from operator import add
+
 import frappe
 from frappe import _, scrub
-from frappe.utils import add_days, add_to_date, flt, getdate, cint
-from erpnext.accounts.utils import get_fiscal_year
-
-
+from frappe.utils import cint, flt
+
+from vt_internal.vt_internal.doctype.vt_sales_cube import vt_sales_cube
+from vt_internal.vt_internal.utils.periods import PeriodLookup
+from vt_internal.vt_internal.utils.report_jobs import background_report, long_date_range, report_progress
+
+
+@background_report(
+    "VT Sales Analytics",
+    depends_on=(
+        "Sales Order", "Sales Order Item", "BOM", "BOM Item", "Supplier",
+        "Cost Center", "Item Group", "Customer Group", "Territory", "Supplier Group", "Secteur VT",
+    ),
+    # Analyses par article / par verre sur un an ou plus : en tâche de fond
+    is_long=lambda filters: filters.get("tree_type") in ("Item", "Par verre") and long_date_range(filters),
+)
 def execute(filters=None):
     return Analytics(filters).run()
 
@@ -46,6 +60,7 @@ class Analytics(object):
             self.get_data()
             self.get_columns()
 
+        report_progress(80, _("Graphique"))
         self.get_chart_data()
 
         skip_total_row = 0
@@ -56,46 +71,34 @@ class Analytics(object):
 
     # ----------------------------- Helpers pivot -----------------------------
 
-    def get_col_entity_select(self, table_alias="s", item_alias=None):
-        """
-        Pour SQL: renvoie (select_expression, label, fieldtype, options) pour la colonne dynamique.
-        Si Période, None (on reste sur les dates).
-        """
-        if self.column_by == "Période":
-            return (None, None, None, None)
-
+    def get_col_entity_expr(self, table_alias="s"):
+        """Expression SQL de l'entité colonne (None si colonnes = périodes ou
+        axe non géré)."""
         match self.column_by:
             case "Secteur VT":
-                return (f"{table_alias}.secteur_vt as col_entity", _("Secteur VT"), "Link", "Secteur VT")
+                return f"{table_alias}.secteur_vt"
             case "Assurance":
-                return (f"{table_alias}.custom_insurance_client as col_entity", _("Assurance"), "Data", "")
+                return f"{table_alias}.custom_insurance_client"
             case "Responsable du devis":
-                return (f"{table_alias}.custom_responsable_du_devis as col_entity", _("Responsable du devis"), "Link", "User")
+                return f"{table_alias}.custom_responsable_du_devis"
             # (Retiré: case "Origine" — on ne permet plus column_by = "Origine")
             case _:
-                return (None, None, None, None)
+                return None
 
-    def get_col_entity_field_for_get_all(self):
-        """
-        Pour frappe.get_all: champ équivalent 'as col_entity' si disponible sans jointure.
-        (Origine nécessite une jointure et n'est donc pas proposée ici.)
-        """
-        if self.column_by == "Période":
-            return None
-        if self.column_by == "Secteur VT":
-            return "secteur_vt as col_entity"
-        if self.column_by == "Assurance":
-            return "custom_insurance_client as col_entity"
-        if self.column_by == "Responsable du devis":
-            return "custom_responsable_du_devis as col_entity"
-        # Origine -> non pris en charge via get_all (besoin de jointure item)
-        return None
-
-    def current_col_key(self, d):
-        """Clé de colonne effective selon le mode."""
+    def get_col_key_sql(self, table_alias="s", with_col_entity=True):
+        """Expression SQL de la clé de colonne : clé de période (cf. PeriodLookup)
+        ou entité colonne."""
         if self.column_by == "Période":
-            return self.get_period(d.get(self.date_field))
-        return (getattr(d, "col_entity", None) or _("(vide)"))
+            return self.period_lookup.key_sql(f"{table_alias}.{self.date_field}")
+        return (self.get_col_entity_expr(table_alias) if with_col_entity else None) or "NULL"
+
+    def get_col_key_resolver(self):
+        """Fonction ligne agrégée -> libellé de colonne."""
+        if self.column_by != "Période":
+            return lambda d: d.col_key or _("(vide)")
+
+        label_by_key = {p.key: self.get_period_label(p) for p in self.periods}
+        return lambda d: label_by_key.get(d.col_key)
 
     # ----------------------------- Colonnes ----------------------------------
 
@@ -158,8 +161,8 @@ class Analytics(object):
 
         # 2) Colonnes dynamiques
         if self.column_by == "Période":
-            for end_date in self.periodic_daterange:
-                period = self.get_period(end_date)
+            for p in self.periods:
+                period = self.get_period_label(p)
                 self.columns.append(
                     {"label": _(period), "fieldname": scrub(period), "fieldtype": "Float", "width": 120}
                 )
@@ -214,25 +217,6 @@ class Analytics(object):
 
     # ----------------------------- Fetchers ----------------------------------
 
-    def _common_filters_dict(self):
-        filters = {
-            "docstatus": 1,
-            "company": self.filters.company,
-            self.date_field: ("between", [self.filters.from_date, self.filters.to_date]),
-            "custom_exclude_from_statistics": ["!=", 1],
-        }
-        if self.filters.get("secteur"):
-            filters["secteur_vt"] = self.filters.secteur
-        if self.filters.get("cost_center"):
-            cc = self.filters.cost_center
-            descendants = frappe.db.get_descendants("Cost Center", cc)
-            filters["cost_center"] = ["in", [cc] + descendants]
-        if self.filters.get("insurance"):
-            filters["custom_insurance_client"] = self.filters.insurance
-        if self.filters.get("custom_responsable_du_devis"):
-            filters["custom_responsable_du_devis"] = self.filters.custom_responsable_du_devis
-        return filters
-
     def _common_sql_filters(self, alias="s"):
         secteur_filter = ""
         cost_center_filter = ""
@@ -260,18 +244,90 @@ class Analytics(object):
 
         return secteur_filter, cost_center_filter, insurance_filter, responsable_filter, exclude_filter, params
 
-    # -- Secteur (hiérarchique) via get_all
+    def fetch_grouped(self, entity, value, from_clause, alias="s", where="", extra_fields="", with_col_entity=True, cube=None):
+        """Agrège en base : une ligne par (entité, clé de colonne).
+
+        `value` est une expression d'agrégat ; `extra_fields` des colonnes
+        agrégées supplémentaires (ex. libellé de l'entité). `cube` :
+        (dimension, mesure) du cube des ventes équivalents, lus à la place des
+        commandes quand le cube est construit."""
+        if cube and vt_sales_cube.is_ready():
+            return self.fetch_grouped_from_cube(*cube, with_col_entity=with_col_entity)
+
+        secteur_filter, cost_center_filter, insurance_filter, responsable_filter, exclude_filter, params = self._common_sql_filters(alias)
+        col_key = self.get_col_key_sql(alias, with_col_entity=with_col_entity)
+
+        return frappe.db.sql(
+            f"""
+            select {entity} as entity, {value} as value_field, {col_key} as col_key{extra_fields}
+            {from_clause}
+            where {alias}.docstatus = 1 and {alias}.company = %s
+              and {alias}.{self.date_field} between %s and %s{where}
+              {secteur_filter}{cost_center_filter}{insurance_filter}{responsable_filter}{exclude_filter}
+            group by entity, col_key
+            """,
+            tuple(params),
+            as_dict=1,
+        )
+
+    def fetch_grouped_from_cube(self, dimension, measure, with_col_entity=True):
+        """Même résultat que fetch_grouped, lu dans le cube des ventes (une ligne
+        par jour et combinaison de dimensions au lieu d'une par commande)."""
+        conditions = [
+            "c.source_doctype = 'Sales Order'",
+            "c.source_docstatus = 1",
+            "c.excluded_from_statistics = 0",
+            "c.company = %s",
+            "c.posting_date between %s and %s",
+        ]
+        params = [self.filters.company, self.filters.from_date, self.filters.to_date]
+        if self.filters.get("secteur"):
+            conditions.append("c.secteur_vt = %s")
+            params.append(self.filters.secteur)
+        if self.filters.get("cost_center"):
+            cc = self.filters.cost_center
+            cost_centers = [cc] + frappe.db.get_descendants("Cost Center", cc)
+            conditions.append(f"c.cost_center IN ({', '.join(['%s'] * len(cost_centers))})")
+            params.extend(cost_centers)
+        if self.filters.get("insurance"):
+            conditions.append("c.insurance = %s")
+            params.append(self.filters.insurance)
+        if self.filters.get("custom_responsable_du_devis"):
+            conditions.append("c.responsable = %s")
+            params.append(self.filters.custom_responsable_du_devis)
+
+        if self.column_by == "Période":
+            col_key = self.period_lookup.key_sql("c.posting_date")
+        else:
+            col_dimension = {"Secteur VT": "secteur_vt", "Assurance": "insurance", "Responsable du devis": "responsable"}.get(
+                self.column_by
+            )
+            col_key = f"nullif(c.{col_dimension}, '')" if col_dimension and with_col_entity else "NULL"
+
+        return frappe.db.sql(
+            f"""
+            select nullif(c.{dimension}, '') as entity, SUM(c.{measure}) as value_field, {col_key} as col_key
+            from `tabVT Sales Cube` c
+            where {" and ".join(conditions)}
+            group by entity, col_key
+            """,
+            tuple(params),
+            as_dict=1,
+        )
+
+    def _cube_measure(self, qty_measure="total_qty"):
+        """Mesure du cube correspondant au filtre value_quantity."""
+        return "base_net_total" if self.filters["value_quantity"] == "Value" else qty_measure
+
+    def _order_value(self, value_field="base_net_total", qty_field="total_qty", alias="s"):
+        """SUM de la valeur ou de la quantité selon le filtre value_quantity."""
+        field = value_field if self.filters["value_quantity"] == "Value" else qty_field
+        return f"SUM({alias}.{field})"
+
+    # -- Secteur (hiérarchique)
     def get_sales_transactions_based_on_secteur(self):
-        value_field = "base_net_total as value_field" if self.filters["value_quantity"] == "Value" else "total_qty as value_field"
-        fields = ["secteur_vt as entity", value_field, self.date_field]
-        col_field = self.get_col_entity_field_for_get_all()
-        if col_field:
-            fields.append(col_field)
-
-        self.entries = frappe.get_all(
-            self.filters.doc_type,
-            fields=fields,
-            filters=self._common_filters_dict(),
+        self.entries = self.fetch_grouped(
+            "s.secteur_vt", self._order_value(), "from `tabSales Order` s", cube=("secteur_vt", self._cube_measure()),
         )
         self.get_secteur_groups()
 
@@ -284,264 +340,124 @@ class Analytics(object):
         for d in self.group_entries:
             self.depth_map.setdefault(d["name"], 0)
 
-    # -- Order Type (SQL)
+    # -- Order Type
     def get_sales_transactions_based_on_order_type(self):
-        value_field = "base_net_total" if self.filters["value_quantity"] == "Value" else "total_qty"
-        secteur_filter, cost_center_filter, insurance_filter, responsable_filter, exclude_filter, params = self._common_sql_filters("s")
-        col_select, _, _, _ = self.get_col_entity_select("s", item_alias="i")
-
-        select_col = f", {col_select}" if (col_select and self.column_by != "Période") else ""
-        date_select = f", s.{self.date_field}" if self.column_by == "Période" else ""
-
-        self.entries = frappe.db.sql(
-            f"""
-            select s.order_type as entity, s.{value_field} as value_field{date_select}{select_col}
-            from `tabSales Order` s
-            where s.docstatus = 1 and s.company = %s and s.{self.date_field} between %s and %s
-              and ifnull(s.order_type, '') != ''{secteur_filter}{cost_center_filter}{insurance_filter}{responsable_filter}{exclude_filter}
-            order by s.order_type
-            """,
-            tuple(params),
-            as_dict=1,
+        self.entries = self.fetch_grouped(
+            "s.order_type", self._order_value(), "from `tabSales Order` s",
+            where=" and ifnull(s.order_type, '') != ''",
         )
         self.get_teams()
 
-    # -- Origine (SQL)
+    # -- Origine
     def get_sales_transactions_based_on_origine(self):
         value_field = "SUM(i.base_net_amount)" if self.filters["value_quantity"] == "Value" else "COUNT(DISTINCT s.name)"
-        secteur_filter, cost_center_filter, insurance_filter, responsable_filter, exclude_filter, params = self._common_sql_filters("s")
-        # colonne dynamique éventuelle
-        col_select, _, _, _ = self.get_col_entity_select("s", item_alias="i")
-        select_col = f", {col_select}" if (col_select and self.column_by != "Période") else ""
-        date_select = f", s.{self.date_field}" if self.column_by == "Période" else ""
-
-        self.entries = frappe.db.sql(
-            f"""
-            select 
-                case when i.prevdoc_docname is not null then 'Devis' else 'Commande' end as entity,
-                {value_field} as value_field
-                {date_select}
-                {select_col}
-            from `tabSales Order Item` i
-            join `tabSales Order` s on s.name = i.parent
-            where s.docstatus = 1 and s.company = %s
-              and s.{self.date_field} between %s and %s
-              {secteur_filter}{cost_center_filter}{insurance_filter}{responsable_filter}{exclude_filter}
-            group by entity{', s.' + self.date_field if self.column_by == 'Période' else ''}{', col_entity' if (self.column_by != 'Période' and select_col) else ''}
-            """,
-            tuple(params),
-            as_dict=1,
+        self.entries = self.fetch_grouped(
+            "case when i.prevdoc_docname is not null then 'Devis' else 'Commande' end",
+            value_field,
+            "from `tabSales Order Item` i join `tabSales Order` s on s.name = i.parent",
         )
 
-    # -- Assurance (SQL)
+    # -- Assurance
     def get_sales_transactions_based_on_assurance(self):
         value_field = "SUM(s.base_net_total)" if self.filters["value_quantity"] == "Value" else "COUNT(DISTINCT s.name)"
-        secteur_filter, cost_center_filter, insurance_filter, responsable_filter, exclude_filter, params = self._common_sql_filters("s")
-        col_select, _, _, _ = self.get_col_entity_select("s", item_alias="i")
-        select_col = f", {col_select}" if (col_select and self.column_by != "Période") else ""
-        date_select = f", s.{self.date_field}" if self.column_by == "Période" else ""
-
-        self.entries = frappe.db.sql(
-            f"""
-            select s.custom_insurance_client as entity, {value_field} as value_field{date_select}{select_col}
-            from `tabSales Order` s
-            where s.docstatus = 1 and s.company = %s and s.{self.date_field} between %s and %s
-              {secteur_filter}{cost_center_filter}{insurance_filter}{responsable_filter}{exclude_filter}
-            group by entity{', s.' + self.date_field if self.column_by == 'Période' else ''}{', col_entity' if (self.column_by != 'Période' and select_col) else ''}
-            """,
-            tuple(params),
-            as_dict=1,
+        self.entries = self.fetch_grouped(
+            "s.custom_insurance_client", value_field, "from `tabSales Order` s",
+            cube=("insurance", self._cube_measure("doc_count")),
         )
-        
-    # -- Cost Center (SQL)
+
+    # -- Cost Center (pas de colonne par entité : tout en « (vide) »)
     def get_sales_transactions_based_on_cost_center(self):
-        # Fetch sales grouped by Cost Center
-        value_field = "SUM(s.base_net_total)" if self.filters["value_quantity"] == "Value" else "SUM(s.total_qty)"
-        secteur_filter, cost_center_filter, insurance_filter, responsable_filter, exclude_filter, params = self._common_sql_filters("s")
-        date_select = f", s.{self.date_field}" if self.column_by == "Période" else ""
-        
-        self.entries = frappe.db.sql(
-            f"""
-            select s.cost_center as entity, {value_field} as value_field{date_select}
-            from `tabSales Order` s
-            where s.docstatus = 1 and s.company = %s and s.{self.date_field} between %s and %s
-              {secteur_filter}{cost_center_filter}{insurance_filter}{responsable_filter}{exclude_filter}
-            group by entity{', s.' + self.date_field if self.column_by == 'Période' else ''}
-            """,
-            tuple(params),
-            as_dict=1,
+        self.entries = self.fetch_grouped(
+            "s.cost_center", self._order_value(), "from `tabSales Order` s", with_col_entity=False,
+            cube=("cost_center", self._cube_measure()),
         )
 
-
-    # -- Customer / Supplier (get_all)
+    # -- Customer / Supplier
     def get_sales_transactions_based_on_customers_or_suppliers(self):
-        value_field = "base_net_total as value_field" if self.filters["value_quantity"] == "Value" else "total_qty as value_field"
-
         if self.filters.tree_type == "Customer":
-            entity = "customer as entity"
-            entity_name = "customer_name as entity_name"
+            entity, entity_name = "s.customer", "s.customer_name"
         else:
-            entity = "supplier as entity"
-            entity_name = "supplier_name as entity_name"
-
-        fields = [entity, entity_name, value_field, self.date_field]
-        col_field = self.get_col_entity_field_for_get_all()
-        if col_field:
-            fields.append(col_field)
-
-        self.entries = frappe.get_all(
-            "Sales Order",
-            fields=fields,
-            filters=self._common_filters_dict(),
+            entity, entity_name = "s.supplier", "s.supplier_name"
+
+        self.entries = self.fetch_grouped(
+            entity, self._order_value(), "from `tabSales Order` s",
+            extra_fields=f", max({entity_name}) as entity_name",
         )
 
         self.entity_names = {}
         for d in self.entries:
             self.entity_names.setdefault(d.entity, d.entity_name)
 
-    # -- Items (SQL)
+    # -- Items
     def get_sales_transactions_based_on_items(self):
-        value_field = "base_net_amount" if self.filters["value_quantity"] == "Value" else "stock_qty"
-        secteur_filter, cost_center_filter, insurance_filter, responsable_filter, exclude_filter, params = self._common_sql_filters("s")
-        col_select, _, _, _ = self.get_col_entity_select("s", item_alias="i")
-        select_col = f", {col_select}" if (col_select and self.column_by != "Période") else ""
-        date_select = f", s.{self.date_field}" if self.column_by == "Période" else ""
-
-        self.entries = frappe.db.sql(
-            f"""
-            select i.item_code as entity, i.item_name as entity_name, i.stock_uom,
-                   i.{value_field} as value_field{date_select}{select_col}
-            from `tabSales Order Item` i
-            join `tabSales Order` s on s.name = i.parent
-            where i.docstatus = 1 and s.company = %s
-              and s.{self.date_field} between %s and %s
-              {secteur_filter}{cost_center_filter}{insurance_filter}{responsable_filter}{exclude_filter}
-            """,
-            tuple(params),
-            as_dict=1,
+        self.entries = self.fetch_grouped(
+            "i.item_code",
+            self._order_value("base_net_amount", "stock_qty", alias="i"),
+            "from `tabSales Order Item` i join `tabSales Order` s on s.name = i.parent",
+            extra_fields=", max(i.item_name) as entity_name, max(i.stock_uom) as stock_uom",
         )
 
         self.entity_names = {}
         for d in self.entries:
             self.entity_names.setdefault(d.entity, d.entity_name)
 
-    # -- Customer Group / Supplier Group / Territory (get_all + tree)
+    # -- Customer Group / Supplier Group / Territory (+ arbre)
     def get_sales_transactions_based_on_customer_or_territory_group(self):
-        value_field = "base_net_total as value_field" if self.filters["value_quantity"] == "Value" else "total_qty as value_field"
-
         if self.filters.tree_type == "Customer Group":
-            entity_field = "customer_group as entity"
+            entity = "s.customer_group"
         elif self.filters.tree_type == "Supplier Group":
-            entity_field = "supplier as entity"
+            entity = "s.supplier"
             self.get_supplier_parent_child_map()
         else:
-            entity_field = "territory as entity"
-
-        fields = [entity_field, value_field, self.date_field]
-        col_field = self.get_col_entity_field_for_get_all()
-        if col_field:
-            fields.append(col_field)
+            entity = "s.territory"
 
-        self.entries = frappe.get_all(
-            "Sales Order",
-            fields=fields,
-            filters=self._common_filters_dict(),
-        )
+        self.entries = self.fetch_grouped(entity, self._order_value(), "from `tabSales Order` s")
         self.get_groups()
 
-    # -- Item Group (SQL)
+    # -- Item Group
     def get_sales_transactions_based_on_item_group(self):
-        value_field = "base_net_amount" if self.filters["value_quantity"] == "Value" else "qty"
-        secteur_filter, cost_center_filter, insurance_filter, responsable_filter, exclude_filter, params = self._common_sql_filters("s")
-        col_select, _, _, _ = self.get_col_entity_select("s", item_alias="i")
-        select_col = f", {col_select}" if (col_select and self.column_by != "Période") else ""
-        date_select = f", s.{self.date_field}" if self.column_by == "Période" else ""
-
-        self.entries = frappe.db.sql(
-            f"""
-            select i.item_group as entity, i.{value_field} as value_field{date_select}{select_col}
-            from `tabSales Order Item` i
-            join `tabSales Order` s on s.name = i.parent
-            where i.docstatus = 1 and s.company = %s
-              and s.{self.date_field} between %s and %s
-              {secteur_filter}{cost_center_filter}{insurance_filter}{responsable_filter}{exclude_filter}
-            """,
-            tuple(params),
-            as_dict=1,
+        self.entries = self.fetch_grouped(
+            "i.item_group",
+            self._order_value("base_net_amount", "qty", alias="i"),
+            "from `tabSales Order Item` i join `tabSales Order` s on s.name = i.parent",
         )
-
         self.get_groups()
 
-    # -- Project (get_all)
+    # -- Project
     def get_sales_transactions_based_on_project(self):
-        value_field = "base_net_total as value_field" if self.filters["value_quantity"] == "Value" else "total_qty as value_field"
-
-        fields = ["project as entity", value_field, self.date_field]
-        col_field = self.get_col_entity_field_for_get_all()
-        if col_field:
-            fields.append(col_field)
-
-        filters = self._common_filters_dict()
-        filters["project"] = ["!=", ""]
-
-        self.entries = frappe.get_all(
-            "Sales Order",
-            fields=fields,
-            filters=filters,
+        self.entries = self.fetch_grouped(
+            "s.project", self._order_value(), "from `tabSales Order` s",
+            where=" and ifnull(s.project, '') != ''",
         )
 
-    # -- Responsable (get_all)
+    # -- Responsable
     def get_sales_transactions_based_on_responsable(self):
-        value_field = "base_net_total as value_field" if self.filters["value_quantity"] == "Value" else "total_qty as value_field"
-
-        fields = ["custom_responsable_du_devis as entity", value_field, self.date_field]
-        col_field = self.get_col_entity_field_for_get_all()
-        if col_field:
-            fields.append(col_field)
-
-        self.entries = frappe.get_all(
-            "Sales Order",
-            fields=fields,
-            filters=self._common_filters_dict(),
+        self.entries = self.fetch_grouped(
+            "s.custom_responsable_du_devis", self._order_value(), "from `tabSales Order` s",
+            cube=("responsable", self._cube_measure()),
         )
 
-    # -- Par verre (SQL)
+    # -- Par verre
     def get_sales_transactions_based_on_glass(self):
         if self.filters["value_quantity"] == "Value":
-            value_field = "SUM(soi.base_net_amount) AS value_field"
+            value_field = "SUM(soi.base_net_amount)"
         else:
-            value_field = "SUM((bom.hauteur / 1000) * (bom.largeur / 1000)) AS value_field"
-
-        secteur_filter, cost_center_filter, insurance_filter, responsable_filter, exclude_filter, params = self._common_sql_filters("so")
-        col_select, _, _, _ = self.get_col_entity_select("so", item_alias="soi")
-        select_col = f", {col_select}" if (col_select and self.column_by != "Période") else ""
-        date_select = f", so.{self.date_field}" if self.column_by == "Période" else ""
-
-        self.entries = frappe.db.sql(
-            f"""
-            SELECT
-                (
-                    SELECT bi.item_code
-                    FROM `tabBOM Item` bi
-                    WHERE bi.parent = bom.name
-                    ORDER BY bi.idx ASC
-                    LIMIT 1
-                ) AS entity,
-                {value_field}
-                {date_select}
-                {select_col}
-            FROM `tabSales Order Item` soi
+            value_field = "SUM((bom.hauteur / 1000) * (bom.largeur / 1000))"
+
+        self.entries = self.fetch_grouped(
+            """(
+                SELECT bi.item_code
+                FROM `tabBOM Item` bi
+                WHERE bi.parent = bom.name
+                ORDER BY bi.idx ASC
+                LIMIT 1
+            )""",
+            value_field,
+            """FROM `tabSales Order Item` soi
             JOIN `tabSales Order` so ON soi.parent = so.name
-            JOIN `tabBOM` bom ON soi.bom_no = bom.name
-            WHERE so.docstatus = 1
-              AND soi.item_code IN ('Produit fini (double vitrage)', 'Produit fini (verre)')
-              AND so.company = %s
-              AND so.{self.date_field} BETWEEN %s AND %s
-              {secteur_filter}{cost_center_filter}{insurance_filter}{responsable_filter}{exclude_filter}
-            GROUP BY entity{', so.' + self.date_field if self.column_by == 'Période' else ''}{', col_entity' if (self.column_by != 'Période' and select_col) else ''}
-            """,
-            tuple(params),
-            as_dict=1,
+            JOIN `tabBOM` bom ON soi.bom_no = bom.name""",
+            alias="so",
+            where=" AND soi.item_code IN ('Produit fini (double vitrage)', 'Produit fini (verre)')",
         )
 
     # ----------------------------- Agrégation 2D -----------------------------
@@ -556,112 +472,93 @@ class Analytics(object):
 
     def iter_column_labels(self):
         if self.column_by == "Période":
-            return [self.get_period(d) for d in self.periodic_daterange]
+            return [self.get_period_label(p) for p in self.periods]
         else:
             return sorted(self.all_column_keys or [])
 
     def get_rows_generic(self):
         self.data = []
         col_labels = self.iter_column_labels()
+        pivot = self.pivot
+        order = [pivot.col_index.get(label) for label in col_labels]
+        entity_names = getattr(self, "entity_names", {})
 
-        for entity, pdata in self.entity_periodic_data.items():
+        for entity, values in pivot.iter_rows():
             row = {
                 "entity": entity,
-                "entity_name": getattr(self, "entity_names", {}).get(entity),
+                "entity_name": entity_names.get(entity),
             }
             total = 0.0
-            for label in col_labels:
-                amount = flt(pdata.get(label, 0.0))
+            for label, i in zip(col_labels, order, strict=True):
+                amount = values[i] if i is not None else 0.0
                 row[scrub(str(label))] = amount
                 total += amount
             row["total"] = total
             if self.filters.tree_type == "Item":
-                row["stock_uom"] = pdata.get("stock_uom")
+                row["stock_uom"] = pivot.extra.get(entity)
             self.data.append(row)
 
     def get_rows_by_group_generic(self):
         col_labels = self.iter_column_labels()
+        pivot = self.pivot
+        order = [pivot.col_index.get(label) for label in col_labels]
         out = []
 
         for d in reversed(self.group_entries):
+            values = pivot.get(d.name)
             row = {"entity": d.name, "indent": self.depth_map.get(d.name)}
             total = 0.0
-            for label in col_labels:
-                amount = flt(self.entity_periodic_data.get(d.name, {}).get(label, 0.0))
+            for label, i in zip(col_labels, order, strict=True):
+                amount = values[i] if (values is not None and i is not None) else 0.0
                 row[scrub(str(label))] = amount
-                if d.parent and (self.filters.tree_type != "Order Type" or d.parent == "Order Types"):
-                    self.entity_periodic_data.setdefault(d.parent, frappe._dict()).setdefault(label, 0.0)
-                    self.entity_periodic_data[d.parent][label] += amount
                 total += amount
             row["total"] = total
-            out = [row] + out
+            # Remontée au parent : somme de tableaux (les enfants sont traités
+            # avant leurs parents, ordre lft inversé)
+            if values is not None and d.parent and (self.filters.tree_type != "Order Type" or d.parent == "Order Types"):
+                pivot.add_to(d.parent, values)
+            out.append(row)
 
+        out.reverse()
         self.data = out
 
     def get_periodic_data(self):
-        self.entity_periodic_data = frappe._dict()
-        self.all_column_keys = set()
-
-        for d in self.entries:
-            if self.filters.tree_type == "Supplier Group":
-                d.entity = self.parent_child_map.get(d.entity)
+        """Tableau croisé entité x colonne (cf. Pivot)."""
+        if self.column_by == "Période":
+            self.pivot = Pivot(self.iter_column_labels())
+        else:
+            self.pivot = Pivot()
 
-            col_key = self.current_col_key(d)
-            self.all_column_keys.add(col_key)
+        col_key = self.get_col_key_resolver()
+        supplier_group = self.parent_child_map if self.filters.tree_type == "Supplier Group" else None
+        track_uom = self.filters.tree_type == "Item"
+        pivot = self.pivot
 
-            self.entity_periodic_data.setdefault(d.entity, frappe._dict()).setdefault(col_key, 0.0)
-            self.entity_periodic_data[d.entity][col_key] += flt(d.value_field)
+        for d in self.entries:
+            entity = supplier_group.get(d.entity) if supplier_group is not None else d.entity
+            pivot.add(entity, col_key(d), flt(d.value_field))
+            if track_uom:
+                pivot.extra[entity] = d.get("stock_uom")
 
-            if self.filters.tree_type == "Item":
-                self.entity_periodic_data[d.entity]["stock_uom"] = getattr(d, "stock_uom", None)
+        self.all_column_keys = set(pivot.labels)
 
     # ----------------------------- Périodes ----------------------------------
 
-    def get_period(self, posting_date):
+    def get_period_label(self, period):
         if self.filters.range == "Weekly":
-            period = _("Week {0} {1}").format(str(posting_date.isocalendar()[1]), str(posting_date.year))
+            return _("Week {0} {1}").format(str(period.number), str(period.year))
         elif self.filters.range == "Monthly":
-            period = _(str(self.months[posting_date.month - 1])) + " " + str(posting_date.year)
+            return _(str(self.months[period.number - 1])) + " " + str(period.year)
         elif self.filters.range == "Quarterly":
-            period = _("Quarter {0} {1}").format(
-                str(((posting_date.month - 1) // 3) + 1), str(posting_date.year)
-            )
-        else:
-            year = get_fiscal_year(posting_date, company=self.filters.company)
-            period = str(year[0])
-        return period
+            return _("Quarter {0} {1}").format(str(period.number), str(period.year))
+        return period.label
 
     def get_period_date_ranges(self):
-        from dateutil.relativedelta import MO, relativedelta
-
-        from_date, to_date = getdate(self.filters.from_date), getdate(self.filters.to_date)
-
-        increment = {"Monthly": 1, "Quarterly": 3, "Half-Yearly": 6, "Yearly": 12}.get(
-            self.filters.range, 1
+        self.period_lookup = PeriodLookup(
+            self.filters.from_date, self.filters.to_date, self.filters.range, company=self.filters.company
         )
-
-        if self.filters.range in ["Monthly", "Quarterly"]:
-            from_date = from_date.replace(day=1)
-        elif self.filters.range == "Yearly":
-            from_date = get_fiscal_year(from_date)[1]
-        else:
-            from_date = from_date + relativedelta(from_date, weekday=MO(-1))
-
-        self.periodic_daterange = []
-        for dummy in range(1, 53):
-            if self.filters.range == "Weekly":
-                period_end_date = add_days(from_date, 6)
-            else:
-                period_end_date = add_to_date(from_date, months=increment, days=-1)
-
-            if period_end_date > to_date:
-                period_end_date = to_date
-
-            self.periodic_daterange.append(period_end_date)
-
-            from_date = add_days(period_end_date, 1)
-            if period_end_date == to_date:
-                break
+        # Au plus 52 colonnes de périodes
+        self.periods = self.period_lookup.periods[:52]
 
     # ----------------------------- Groupes -----------------------------------
 
@@ -754,3 +651,58 @@ class Analytics(object):
         if self.filters.get("insurance"):
             filters.append("so.custom_insurance_client = '{}'".format(self.filters.insurance))
         return " AND " + " AND ".join(filters) if filters else ""
+
+
+class Pivot:
+    """Tableau croisé dense : une liste de floats par entité, une position par
+    colonne.
+
+    Colonnes fixes (libellés de périodes connus d'avance : les valeurs hors
+    colonnes sont ignorées, comme à l'affichage) ou ouvertes (une colonne est
+    ajoutée à chaque nouvelle clé rencontrée)."""
+
+    def __init__(self, labels=None):
+        self.fixed = labels is not None
+        self.labels = []
+        self.col_index = {}
+        for label in labels or []:
+            if label not in self.col_index:
+                self.col_index[label] = len(self.labels)
+                self.labels.append(label)
+        self.row_index = {}
+        self.rows = []
+        self.extra = {}
+
+    def _col(self, key):
+        i = self.col_index.get(key)
+        if i is None and not self.fixed:
+            i = self.col_index[key] = len(self.labels)
+            self.labels.append(key)
+            for values in self.rows:
+                values.append(0.0)
+        return i
+
+    def _row(self, entity):
+        i = self.row_index.get(entity)
+        if i is None:
+            i = self.row_index[entity] = len(self.rows)
+            self.rows.append([0.0] * len(self.labels))
+        return self.rows[i]
+
+    def get(self, entity):
+        i = self.row_index.get(entity)
+        return self.rows[i] if i is not None else None
+
+    def add(self, entity, key, value):
+        values = self._row(entity)
+        i = self._col(key)
+        if i is not None:
+            values[i] += value
+
+    def add_to(self, entity, values):
+        row = self._row(entity)
+        row[:] = map(add, row, values)
+
+    def iter_rows(self):
+        for entity, i in self.row_index.items():
+            yield entity, self.rows[i]
@@ -4,12 +4,8 @@
 import frappe
 from frappe import _
 
-from vt_internal.vt_internal.utils.margin_utils import (
-	get_theoretical,
-	get_project_costs,
-	calculate_margin,
-	get_project_labour_hours,
-)
+from vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot import get_snapshots
+from vt_internal.vt_internal.utils.margin_utils import calculate_margin
 
 
 def execute(filters: dict | None = None):
@@ -47,12 +43,23 @@ def execute(filters: dict | None = None):
 	if filters.get('project_manager'):
 		where.append("p.custom_project_manager = %s")
 		params.append(filters.get('project_manager'))
+	# Filtre uniquement facturé (statut Completed)
+	if filters.get('only_completed'):
+		where.append("p.status = 'Completed'")
+	# Filtre par type de projet
+	type_sql, type_params = _project_type_clause(filters.get('project_type'))
+	if type_sql:
+		where.append(type_sql)
+		params.extend(type_params)
 
+	# Une ligne par projet, avec les champs Projet nécessaires à l'affichage
 	sql = f"""
 		SELECT
 			d.project AS project,
 			SUM(d.costing_amount) AS costing_amount,
-			SUM(d.hours) AS hours
+			SUM(d.hours) AS hours,
+			p.status, p.project_type, p.expected_end_date, p.customer,
+			p.total_costing_amount, p.total_consumed_material_cost, p.total_expense_claim
 		FROM `tabTimesheet` t
 		JOIN `tabTimesheet Detail` d ON d.parent = t.name
 		JOIN `tabProject` p ON p.name = d.project
@@ -164,58 +171,45 @@ def execute(filters: dict | None = None):
 	ca_by_project_result = frappe.db.sql(ca_by_project_sql, tuple(ca_params), as_dict=True)
 	ca_by_project = {r.project: r.ca_total for r in ca_by_project_result}
 
-	for t in tss:
-		project_name = t.get('project')
-		p = frappe.db.get_value(
-			"Project",
-			project_name,
-			["status", 'project_type', 'expected_end_date', 'customer', 'total_sales_amount', 'custom_construction_manager', 'custom_project_manager'],
-			as_dict=True
-		)
-
-		if not p:
-			continue
+	# Marges, coûts réels et heures : une ligne d'instantané financier par projet ;
+	# réceptions et incidents chargés en une requête chacun
+	project_names = [t.project for t in tss]
+	snapshots = get_snapshots(project_names)
+	receptions = _receptions_by_project(project_names)
+	incidents = _incidents_by_project(project_names)
 
-		# Filtre uniquement facturé (statut Completed)
-		if filters.get('only_completed') and p.status != "Completed":
-			continue
-
-		# Filtre par type de projet
-		if filters.get('project_type') and p.project_type not in filters.get('project_type'):
-			continue
-
-		# Filtre par conducteur de travaux
-		if filters.get('construction_manager') and p.custom_construction_manager != filters.get('construction_manager'):
-			continue
-
-		# Filtre par responsable du devis
-		if filters.get('project_manager') and p.custom_project_manager != filters.get('project_manager'):
-			continue
+	for t in tss:
+		project_name = t.project
 
 		# Déterminer si le chantier est facturé (statut Completed)
-		is_facture = p.status == "Completed"
+		is_facture = t.status == "Completed"
 
 		# Calcul des marges
-		theo_vente_tp, theo_cost_tp = get_theoretical(project_name, "Temps passé")
-		theo_vente_ach, theo_cost_ach = get_theoretical(project_name, "Achats")
+		snapshot = snapshots[project_name]
+		theo_vente_tp, theo_cost_tp = snapshot.theo_vente_tp, snapshot.theo_cost_tp
+		theo_vente_ach, theo_cost_ach = snapshot.theo_vente_ach, snapshot.theo_cost_ach
 
 		theo_vente = theo_vente_tp + theo_vente_ach
 		theo_cost = theo_cost_tp + theo_cost_ach
 		theo_margin = calculate_margin(theo_vente, theo_cost)
 
 		# Coûts réels
-		costs = get_project_costs(project_name)
-		real_cost = costs['total_real_cost']
+		real_cost = (
+			(t.total_costing_amount or 0)
+			+ (snapshot.total_purchase_order or 0)
+			+ (t.total_consumed_material_cost or 0)
+			+ (t.total_expense_claim or 0)
+			+ (snapshot.total_manufacturing_cost or 0)
+		)
 		real_vente = theo_vente  # Même base de vente
 		real_margin = calculate_margin(real_vente, real_cost)
 
 		margin_diff = real_margin - theo_margin
 
 		# Heures
-		labour_data = get_project_labour_hours(project_name)
 		hours_periode = round(t.get('hours') or 0)  # Heures sur la plage de temps
-		hours_expected = round(labour_data['expected_hours'])
-		hours_total_project = round(labour_data.get('actual_hours', 0))  # Heures totales du projet
+		hours_expected = round(snapshot.expected_hours or 0)
+		hours_total_project = round(snapshot.actual_hours or 0)  # Heures totales du projet
 		hours_diff = hours_total_project - hours_expected
 		
 		# Accumulation selon le type de chantier
@@ -238,17 +232,17 @@ def execute(filters: dict | None = None):
 		total_ca += ca
 
 		# Liens
-		reception_name = frappe.db.get_value('Work Completion Receipt', {'project': project_name}, ['name'])
+		reception_name = receptions.get(project_name)
 		reception_link = reception_name and f"<a href={frappe.utils.get_url_to_form('Work Completion Receipt', reception_name)}>📝</a>" or ""
 		if reception_name:
 			nb_chantiers_receptionnes += 1
 
-		incident_names = frappe.db.get_all('Quality Incident', filters={'project': project_name}, pluck='name')
+		incident_names = incidents.get(project_name, [])
 		incident_link = ' '.join([f"<a href={frappe.utils.get_url_to_form('Quality Incident', name)}>⚠️</a>" for name in incident_names]) if incident_names else ""
 		nb_incidents_qualite += len(incident_names)
 
 		# Date de fin (affichée uniquement si le projet est facturé/Completed)
-		date = p.expected_end_date if p.status == "Completed" else ''
+		date = t.expected_end_date if t.status == "Completed" else ''
 
 		# Formatage couleurs (géré côté JS maintenant)
 		margin_diff_int = round(margin_diff)
@@ -266,13 +260,13 @@ def execute(filters: dict | None = None):
 		heures_combined = f"{hours_total_project}|{hours_expected}|{hours_diff_int}"
 
 		mydata.append({
-			"client": p.customer or '',
+			"client": t.customer or '',
 			"projet": project_link,
 			"ca_ht": ca,
 			"marge": marge_combined,
 			"heures": heures_combined,
 			"heures_periode": hours_periode,
-			"type_projet": p.project_type or '',
+			"type_projet": t.project_type or '',
 			"date_fin": date,
 			"reception": reception_link,
 			"incident": incident_link,
@@ -314,15 +308,9 @@ def execute(filters: dict | None = None):
 		ca_periode_params.append(company_filter)
 
 	# Filtre par type de projet
-	if filters.get('project_type'):
-		project_types = filters.get('project_type')
-		if isinstance(project_types, list):
-			placeholders = ','.join(['%s'] * len(project_types))
-			ca_periode_where.append(f"p.project_type IN ({placeholders})")
-			ca_periode_params.extend(project_types)
-		else:
-			ca_periode_where.append("p.project_type = %s")
-			ca_periode_params.append(project_types)
+	if type_sql:
+		ca_periode_where.append(type_sql)
+		ca_periode_params.extend(type_params)
 
 	# Filtre par conducteur de travaux
 	if filters.get('construction_manager'):
@@ -334,8 +322,9 @@ def execute(filters: dict | None = None):
 		ca_periode_where.append("p.custom_project_manager = %s")
 		ca_periode_params.append(filters.get('project_manager'))
 
+	# CA et heures facturées (custom_labour_hours) des mêmes factures
 	ca_periode_sql = f"""
-		SELECT SUM(si.total) AS ca_total
+		SELECT SUM(si.total) AS ca_total, SUM(si.custom_labour_hours) AS heures_total
 		FROM `tabSales Invoice` si
 		LEFT JOIN `tabProject` p ON p.name = si.project
 		WHERE {' AND '.join(ca_periode_where)}
@@ -343,16 +332,7 @@ def execute(filters: dict | None = None):
 
 	ca_periode_result = frappe.db.sql(ca_periode_sql, tuple(ca_periode_params), as_dict=True)
 	ca_periode_total = round(ca_periode_result[0].get('ca_total') or 0) if ca_periode_result else 0
-
-	# Heures facturées (somme de custom_labour_hours des factures avec les mêmes filtres)
-	heures_facturees_sql = f"""
-		SELECT SUM(si.custom_labour_hours) AS heures_total
-		FROM `tabSales Invoice` si
-		LEFT JOIN `tabProject` p ON p.name = si.project
-		WHERE {' AND '.join(ca_periode_where)}
-	"""
-	heures_facturees_result = frappe.db.sql(heures_facturees_sql, tuple(ca_periode_params), as_dict=True)
-	heures_facturees = round(heures_facturees_result[0].get('heures_total') or 0) if heures_facturees_result else 0
+	heures_facturees = round(ca_periode_result[0].get('heures_total') or 0) if ca_periode_result else 0
 
 	# Heures réalisées (toutes les timesheets validées, hors Fabrication et Livraison)
 	where_heures_realisees = [
@@ -476,3 +456,50 @@ def execute(filters: dict | None = None):
 
 	return columns, mydata, message
 
+
+def _project_type_clause(project_types):
+	"""(fragment_sql, params) du filtre type de projet (liste ou valeur seule)."""
+	if not project_types:
+		return "", []
+	if isinstance(project_types, list):
+		placeholders = ','.join(['%s'] * len(project_types))
+		return f"p.project_type IN ({placeholders})", list(project_types)
+	return "p.project_type = %s", [project_types]
+
+
+def _receptions_by_project(projects):
+	"""{projet: réception de travaux la plus récente}."""
+	if not projects:
+		return {}
+	receptions = {}
+	for r in frappe.db.sql(
+		"""
+		SELECT project, name
+		FROM `tabWork Completion Receipt`
+		WHERE project IN %(projects)s
+		ORDER BY modified DESC
+		""",
+		{"projects": projects},
+		as_dict=True,
+	):
+		receptions.setdefault(r.project, r.name)
+	return receptions
+
+
+def _incidents_by_project(projects):
+	"""{projet: [incidents qualité]}."""
+	if not projects:
+		return {}
+	incidents = {}
+	for r in frappe.db.sql(
+		"""
+		SELECT project, name
+		FROM `tabQuality Incident`
+		WHERE project IN %(projects)s
+		ORDER BY modified DESC
+		""",
+		{"projects": projects},
+		as_dict=True,
+	):
+		incidents.setdefault(r.project, []).append(r.name)
+	return incidents
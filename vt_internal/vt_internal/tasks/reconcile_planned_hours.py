@@ -0,0 +1,26 @@
+"""Tâche planifiée « Heures planifiées des projets » (fréquence : Daily long).
+
+custom_planned_hours (somme des durées des événements du projet) est tenu par
+incréments dans events/event.py ; cette tâche le recalcule entièrement et
+corrige les projets en écart (arrondis, modifications hors doc_events).
+Câblage de la fréquence dans hooks.py (scheduler_events).
+"""
+
+import frappe
+
+
+def reconcile_planned_hours():
+    frappe.db.sql(
+        """
+        UPDATE `tabProject` p
+        LEFT JOIN (
+            SELECT project, SUM(TIMESTAMPDIFF(SECOND, starts_on, ends_on)) / 3600 AS hours
+            FROM `tabEvent`
+            WHERE IFNULL(project, '') != '' AND starts_on IS NOT NULL AND ends_on IS NOT NULL
+            GROUP BY project
+        ) e ON e.project = p.name
+        SET p.custom_planned_hours = IFNULL(e.hours, 0)
+        WHERE ABS(IFNULL(p.custom_planned_hours, 0) - IFNULL(e.hours, 0)) > 0.001
+        """
+    )
+    frappe.db.commit()
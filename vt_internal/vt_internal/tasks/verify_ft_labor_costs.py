@@ -0,0 +1,75 @@
+"""Tâche planifiée « Contrôle des coûts des fiches de travail » (fréquence : Daily long).
+
+time_spent / labor_costs des Fiches de travail sont tenus par incréments à la
+validation / annulation des feuilles de temps (events/timesheet._apply_ft_costs).
+Cette tâche les recalcule depuis les feuilles validées (même règle : heures de
+la fiche / heures de la feuille x coût de la feuille) et corrige les écarts.
+Câblage de la fréquence dans hooks.py (scheduler_events).
+"""
+
+import frappe
+
+# Écart d'arrondi admis par feuille de temps (chaque incrément est arrondi à 2 décimales).
+ROUNDING_PER_TIMESHEET = 0.005
+
+
+def get_ft_labor_drift():
+    """Fiches dont les totaux stockés s'écartent du recalcul :
+    [{name, time_spent, labor_costs, expected_time_spent, expected_labor_costs}]."""
+    return frappe.db.sql(
+        """
+        SELECT ft.name,
+               IFNULL(ft.time_spent, 0) AS time_spent,
+               IFNULL(ft.labor_costs, 0) AS labor_costs,
+               ROUND(IFNULL(agg.hours, 0), 2) AS expected_time_spent,
+               ROUND(IFNULL(agg.costs, 0), 2) AS expected_labor_costs
+        FROM `tabFiche de travail` ft
+        LEFT JOIN (
+            SELECT tsd.custom_fiche_de_travail AS ft,
+                   SUM(tsd.hours) AS hours,
+                   SUM(tsd.hours / ts.total_hours * IFNULL(ts.total_costing_amount, 0)) AS costs,
+                   COUNT(DISTINCT ts.name) AS nb_timesheets
+            FROM `tabTimesheet Detail` tsd
+            INNER JOIN `tabTimesheet` ts ON ts.name = tsd.parent
+            WHERE ts.docstatus = 1 AND ts.total_hours > 0 AND tsd.custom_fiche_de_travail IS NOT NULL
+            GROUP BY tsd.custom_fiche_de_travail
+        ) agg ON agg.ft = ft.name
+        WHERE ABS(IFNULL(ft.time_spent, 0) - IFNULL(agg.hours, 0)) > %(tolerance)s * (1 + IFNULL(agg.nb_timesheets, 0))
+           OR ABS(IFNULL(ft.labor_costs, 0) - IFNULL(agg.costs, 0)) > %(tolerance)s * (1 + IFNULL(agg.nb_timesheets, 0))
+        """,
+        {"tolerance": ROUNDING_PER_TIMESHEET},
+        as_dict=True,
+    )
+
+
+def verify_ft_labor_costs(fix=True):
+    """Recalcule les fiches en écart ; trace les corrections dans l'Error Log."""
+    drift = get_ft_labor_drift()
+    if not drift:
+        return drift
+
+    if fix:
+        for r in drift:
+            frappe.db.set_value(
+                "Fiche de travail", r.name,
+                {"time_spent": r.expected_time_spent, "labor_costs": r.expected_labor_costs},
+                update_modified=False,
+            )
+        frappe.db.commit()
+
+    lines = "\n".join(
+        f"{r.name} : heures {r.time_spent} -> {r.expected_time_spent}, coûts {r.labor_costs} -> {r.expected_labor_costs}"
+        for r in drift
+    )
+    frappe.log_error(
+        message=f"{len(drift)} fiche(s) de travail en écart{' (corrigées)' if fix else ''} :\n{lines}",
+        title="Contrôle des coûts des fiches de travail",
+    )
+    return drift
+
+
+@frappe.whitelist()
+def check_ft_labor_costs(fix=0):
+    """Contrôle à la demande (System Manager) ; corrige si `fix`."""
+    frappe.only_for("System Manager")
+    return verify_ft_labor_costs(fix=frappe.utils.cint(fix))
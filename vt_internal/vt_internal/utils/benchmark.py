@@ -0,0 +1,247 @@
+"""Matrice de mesures des rapports et API (commande `bench vt-benchmark`).
+
+Pour chaque taille de jeu de données (cf. utils/synthetic_data.py) et chaque
+cible (`TARGETS` : get_chantiers, project_details, les Script Reports du module,
+les endpoints de pointage) : requêtes SQL, lignes lues, pic mémoire Python et
+durée (cf. `measure`). Chaque exécution est suivie d'un rollback : les cibles
+qui écrivent (pointage) repartent du même état.
+
+Les caches applicatifs (get_chantiers, résultats de rapports) sont contournés
+pour mesurer le calcul. Le résultat est un JSON (commit, site, mesures) ;
+`compare` affiche l'écart avec un JSON précédent.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import frappe
+from frappe.modules import get_report_module_dotted_path
+from frappe.utils import add_days, getdate, now, today
+
+from vt_internal.vt_internal.utils import synthetic_data
+from vt_internal.vt_internal.utils.instrumentation import sql_counters
+
+MODULE = "VT internal"
+
+REPORTS = (
+    "Délais de traitement des commandes",
+    "Objectifs commerciaux VT",
+    "Order book",
+    "P&L — Marges brute & nette (%)",
+    "Performance Commerciale",
+    "Previsionnel Chantier",
+    "Suivi délais fournisseurs",
+    "VT Margin Report",
+    "VT Quotation Analytics",
+    "VT Sales Analytics",
+    "👷Chantiers",
+)
+
+
+def _report_filters(ctx):
+    """Filtres par défaut (ceux des .js) des Script Reports du module."""
+    company, from_date, to_date = ctx.company, ctx.from_date, ctx.to_date
+    return {
+        "Délais de traitement des commandes": {"company": company, "from_date": from_date, "to_date": to_date},
+        "Objectifs commerciaux VT": {"user": ctx.user, "fiscal_year": ctx.fiscal_year, "range": "Mois", "cumulative": 1},
+        "Order book": {"company": company},
+        "P&L — Marges brute & nette (%)": {
+            "company": company, "filter_based_on": "Fiscal Year", "periodicity": "Monthly",
+            "from_fiscal_year": ctx.fiscal_year, "to_fiscal_year": ctx.fiscal_year, "accumulated_values": 0,
+        },
+        "Performance Commerciale": {
+            "company": company, "fiscal_year": ctx.fiscal_year, "view_type": "Secteur / Centre de coût",
+        },
+        "Previsionnel Chantier": {"start_date": today(), "end_date": add_days(today(), 14), "grouped_by": "Projet"},
+        "Suivi délais fournisseurs": {"company": company, "from_date": from_date, "to_date": to_date},
+        "VT Margin Report": {
+            "company": company, "grouped_by": "Project", "analysis_axis": "Marge globale",
+            "from_date": from_date, "to_date": to_date, "range": "Mensuel",
+        },
+        "VT Quotation Analytics": {
+            "company": company, "grouped_by": "Secteur VT", "metric": "Montant",
+            "from_date": from_date, "to_date": to_date, "range": "Mensuel",
+        },
+        "VT Sales Analytics": {
+            "company": company, "tree_type": "Customer", "column_by": "Période", "value_quantity": "Value",
+            "from_date": from_date, "to_date": to_date, "range": "Monthly",
+        },
+        "👷Chantiers": {"company": company, "start_date": add_days(today(), -30), "end_date": today()},
+    }
+
+
+def _run_report(report_name):
+    def target(ctx):
+        execute = frappe.get_attr(get_report_module_dotted_path(MODULE, report_name) + ".execute")
+        # Sans le cache de résultats de utils/report_jobs.
+        execute = getattr(execute, "__wrapped__", execute)
+        return execute(frappe._dict(_report_filters(ctx)[report_name]))
+
+    return target
+
+
+def _get_chantiers(ctx):
+    from vt_internal.vt_internal.api import chantiers
+
+    start_date, end_date = add_days(today(), -30), today()
+    frappe.cache.delete_value(chantiers._cache_key(start_date, end_date, ctx.company, []))
+    return chantiers.get_chantiers(start_date, end_date, ctx.company)
+
+
+def _project_details(ctx):
+    from vt_internal.vt_internal.api.project_details import SECTIONS, get_project_details
+
+    return [get_project_details(ctx.project, section) for section in SECTIONS]
+
+
+def _as_employee(fn, **form_dict):
+    """Cible exécutée sous l'utilisateur d'un employé, avec ces paramètres de requête."""
+
+    def target(ctx):
+        frappe.set_user(ctx.employee_user)
+        frappe.local.form_dict = frappe._dict({k: v(ctx) if callable(v) else v for k, v in form_dict.items()})
+        try:
+            return frappe.get_attr(f"vt_internal.vt_internal.api.timesheet.{fn}")()
+        finally:
+            frappe.set_user("Administrator")
+
+    return target
+
+
+TARGETS = {
+    "api.get_chantiers": _get_chantiers,
+    "api.project_details": _project_details,
+    "api.timesheet_state": _as_employee("timesheet_state"),
+    "api.timesheet_post_api": _as_employee("timesheet_post_api", action="add_comment", comment="benchmark"),
+    "api.ft_timer_html": _as_employee("ft_timer_html", ft=lambda ctx: ctx.fiche),
+    **{f"report.{name}": _run_report(name) for name in REPORTS},
+}
+
+
+def _context():
+    """Paramètres des cibles, pris dans le jeu de données généré."""
+    from erpnext.accounts.utils import get_fiscal_year
+
+    prefix = f"{synthetic_data.PREFIX}%"
+    company = frappe.db.get_value("Company", {"name": ["like", prefix]})
+    # Employé de la feuille du jour laissée ouverte par le générateur.
+    employee = frappe.db.get_value("Timesheet", f"{synthetic_data.PREFIX}TS-00001", "employee")
+
+    return frappe._dict(
+        company=company,
+        from_date=str(add_days(today(), -365)),
+        to_date=today(),
+        fiscal_year=get_fiscal_year(getdate(), company=company)[0],
+        project=frappe.db.get_value("Project", {"name": ["like", prefix], "company": company}),
+        fiche=frappe.db.get_value("Fiche de travail", {"name": ["like", prefix]}),
+        user=frappe.db.get_value("User", {"name": ["like", prefix]}),
+        employee_user=frappe.db.get_value("Employee", employee, "user_id"),
+    )
+
+
+def measure(target, ctx, repeat=3):
+    """Un premier passage à froid sous tracemalloc (requêtes, lignes, pic
+    mémoire, durée à froid), puis `repeat` passages chronométrés (médiane) :
+    tracemalloc ralentit trop le code pour chronométrer en même temps."""
+
+    def run():
+        counters = sql_counters()
+        queries, rows = counters[0], counters[1]
+        start = time.perf_counter()
+        error = None
+        try:
+            target(ctx)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        wall_ms = (time.perf_counter() - start) * 1000
+        frappe.db.rollback()
+        return wall_ms, counters[0] - queries, counters[1] - rows, error
+
+    tracemalloc.start()
+    cold_ms, queries, rows, error = run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings = [run()[0] for _ in range(repeat)] or [cold_ms]
+    return {
+        "wall_ms": round(statistics.median(timings), 2),
+        "wall_ms_min": round(min(timings), 2),
+        "cold_ms": round(cold_ms, 2),
+        "queries": queries,
+        "rows": rows,
+        "peak_kb": round(peak / 1024, 1),
+        "error": error,
+    }
+
+
+def run_matrix(scales=(1,), companies=2, repeat=3, seed=42, targets=None, keep_data=False, echo=print):
+    """Génère chaque taille de jeu de données et mesure toutes les cibles."""
+    selected = {k: v for k, v in TARGETS.items() if not targets or k in targets}
+    results = []
+    try:
+        for scale in scales:
+            echo(f"Jeu de données x{scale}…")
+            counts = synthetic_data.generate(scale, companies, seed)
+            ctx = _context()
+            for name, target in selected.items():
+                result = {"scale": scale, "target": name, **measure(target, ctx, repeat)}
+                results.append(result)
+                echo(_format(result))
+            results.append({"scale": scale, "target": "_dataset", "counts": counts})
+    finally:
+        if not keep_data:
+            synthetic_data.purge()
+
+    return {
+        "commit": _git_commit(),
+        "site": frappe.local.site,
+        "created": now(),
+        "scales": list(scales),
+        "repeat": repeat,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def write(payload, output):
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(payload, f, indent=1, ensure_ascii=False, default=str)
+
+
+def compare(payload, baseline_path, echo=print):
+    """Écart (durée, requêtes) avec un résultat précédent, par (taille, cible)."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r["scale"], r["target"]): r for r in baseline["results"] if "wall_ms" in r}
+    echo(f"Comparaison avec {baseline.get('commit') or baseline_path}")
+    for r in payload["results"]:
+        b = before.get((r["scale"], r["target"]))
+        if not b or "wall_ms" not in r:
+            continue
+        ratio = r["wall_ms"] / b["wall_ms"] if b["wall_ms"] else 0
+        echo(
+            f"x{r['scale']:<3} {r['target'][:45]:45} {b['wall_ms']:>9.1f} -> {r['wall_ms']:>9.1f} ms"
+            f" ({ratio:4.2f}x)  req {b['queries']:>5} -> {r['queries']:>5}"
+        )
+
+
+def _format(r):
+    line = (
+        f"x{r['scale']:<3} {r['target'][:45]:45} {r['wall_ms']:>9.1f} ms {r['queries']:>6} req"
+        f" {r['rows']:>8} lignes {r['peak_kb'] / 1024:>7.1f} Mo"
+    )
+    return f"{line}  ERREUR {r['error']}" if r["error"] else line
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=frappe.get_app_path("vt_internal"), text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,197 @@
+"""Mesure des doc_events vt_internal (durée, requêtes SQL, lignes lues).
+
+Activation : `bench --site <site> set-config vt_instrument_doc_events 1` (ou
+`set_instrumentation`). Désactivé, aucun handler n'est enveloppé : coût nul.
+
+`install` (hooks before_request / before_job) remplace, une fois par processus,
+chaque handler `vt_internal.vt_internal.events.*` déclaré dans doc_events par
+une enveloppe qui mesure l'appel. Chaque mesure (ms, requêtes, lignes) est
+poussée dans une liste Redis par (doctype, event, handler), bornée à
+`SAMPLES_PER_HANDLER` entrées (tampon circulaire). Les mesures sont inclusives :
+un handler qui enregistre un autre document compte aussi les handlers imbriqués.
+
+`get_handler_stats` renvoie p50/p95 par handler et par doctype.
+"""
+
+import functools
+import time
+
+import frappe
+
+CONFIG_KEY = "vt_instrument_doc_events"
+EVENTS_PREFIX = "vt_internal.vt_internal.events."
+SAMPLES_PER_HANDLER = 500
+
+_REGISTRY_KEY = "vt_instrumentation:handlers"
+_SAMPLES_KEY = "vt_instrumentation:samples:"
+
+# Vrai une fois les handlers enveloppés dans ce processus.
+_installed = False
+
+
+def is_enabled():
+    return bool(frappe.conf.get(CONFIG_KEY))
+
+
+def install():
+    """Hook before_request / before_job : enveloppe les handlers si activé."""
+    global _installed
+    if _installed or not is_enabled():
+        return
+
+    for events in (frappe.get_hooks("doc_events") or {}).values():
+        for paths in events.values():
+            for path in paths if isinstance(paths, list) else [paths]:
+                if path.startswith(EVENTS_PREFIX):
+                    _wrap(path)
+    _installed = True
+
+
+def _wrap(path):
+    module_name, fn_name = path.rsplit(".", 1)
+    module = frappe.get_module(module_name)
+    fn = getattr(module, fn_name, None)
+    if fn is None or getattr(fn, "_vt_instrumented", False):
+        return
+    setattr(module, fn_name, instrumented(fn, path[len(EVENTS_PREFIX) :]))
+
+
+def instrumented(fn, handler):
+    """Enveloppe mesurant `fn(doc, method, ...)` quand l'instrumentation est active."""
+
+    @functools.wraps(fn)
+    def wrapper(doc, *args, **kwargs):
+        if not is_enabled():
+            return fn(doc, *args, **kwargs)
+
+        stats = sql_counters()
+        queries, rows = stats[0], stats[1]
+        start = time.perf_counter()
+        try:
+            return fn(doc, *args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            event = args[0] if args and isinstance(args[0], str) else kwargs.get("method") or fn.__name__
+            # La mesure ne doit ni masquer l'exception du handler ni faire
+            # échouer un enregistrement réussi (Redis indisponible…).
+            try:
+                _record(f"{doc.doctype}|{event}|{handler}", elapsed_ms, stats[0] - queries, stats[1] - rows)
+            except Exception:
+                frappe.logger("vt_internal").exception(f"Instrumentation : mesure de {handler} non enregistrée")
+
+    wrapper._vt_instrumented = True
+    return wrapper
+
+
+def sql_counters():
+    """Compteurs [requêtes, lignes] de la connexion courante (frappe.db.sql
+    compté à la première mesure de la requête HTTP / du job)."""
+    db = frappe.db
+    stats = getattr(db, "_vt_sql_stats", None)
+    if stats is None:
+        stats = db._vt_sql_stats = [0, 0]
+        sql = db.sql
+
+        def counting_sql(*args, **kwargs):
+            result = sql(*args, **kwargs)
+            stats[0] += 1
+            if isinstance(result, list | tuple):
+                stats[1] += len(result)
+            return result
+
+        db.sql = counting_sql
+    return stats
+
+
+# Lectures et écritures passent toutes par un pipeline Redis brut, avec des clés
+# préfixées une seule fois par `_key` (les méthodes de RedisWrapper, elles,
+# préfixent d'office : ne pas les mélanger).
+def _key(name):
+    return frappe.cache.make_key(name)
+
+
+def _handler_keys():
+    (members,) = frappe.cache.pipeline().smembers(_key(_REGISTRY_KEY)).execute()
+    return [frappe.safe_decode(m) for m in members]
+
+
+def _record(handler_key, elapsed_ms, queries, rows):
+    pipe = frappe.cache.pipeline()
+    pipe.sadd(_key(_REGISTRY_KEY), handler_key)
+    pipe.lpush(_key(_SAMPLES_KEY + handler_key), f"{elapsed_ms:.3f},{queries},{rows}")
+    pipe.ltrim(_key(_SAMPLES_KEY + handler_key), 0, SAMPLES_PER_HANDLER - 1)
+    pipe.execute()
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _summary(samples):
+    wall = [s[0] for s in samples]
+    queries = [s[1] for s in samples]
+    rows = [s[2] for s in samples]
+    return {
+        "calls": len(samples),
+        "p50_ms": round(_percentile(wall, 50), 2),
+        "p95_ms": round(_percentile(wall, 95), 2),
+        "max_ms": round(max(wall), 2),
+        "p50_queries": _percentile(queries, 50),
+        "p95_queries": _percentile(queries, 95),
+        "avg_rows": round(sum(rows) / len(rows), 1),
+    }
+
+
+@frappe.whitelist()
+def get_handler_stats():
+    """p50/p95 (durée, requêtes) par handler et par doctype, triés par p95 décroissant."""
+    frappe.only_for("System Manager")
+
+    handler_keys = _handler_keys()
+    pipe = frappe.cache.pipeline()
+    for handler_key in handler_keys:
+        pipe.lrange(_key(_SAMPLES_KEY + handler_key), 0, -1)
+
+    by_handler = {}
+    for handler_key, raw in zip(handler_keys, pipe.execute(), strict=True):
+        samples = []
+        for entry in raw:
+            wall, queries, rows = frappe.safe_decode(entry).split(",")
+            samples.append((float(wall), int(queries), int(rows)))
+        if samples:
+            by_handler[handler_key] = samples
+
+    handlers, by_doctype = [], {}
+    for handler_key, samples in by_handler.items():
+        doctype, event, handler = handler_key.split("|", 2)
+        handlers.append({"doctype": doctype, "event": event, "handler": handler, **_summary(samples)})
+        by_doctype.setdefault(doctype, []).extend(samples)
+
+    doctypes = [{"doctype": doctype, **_summary(samples)} for doctype, samples in by_doctype.items()]
+    return {
+        "enabled": is_enabled(),
+        "handlers": sorted(handlers, key=lambda r: r["p95_ms"], reverse=True),
+        "doctypes": sorted(doctypes, key=lambda r: r["p95_ms"], reverse=True),
+    }
+
+
+@frappe.whitelist()
+def reset_handler_stats():
+    frappe.only_for("System Manager")
+    pipe = frappe.cache.pipeline()
+    for handler_key in _handler_keys():
+        pipe.delete(_key(_SAMPLES_KEY + handler_key))
+    pipe.delete(_key(_REGISTRY_KEY))
+    pipe.execute()
+
+
+@frappe.whitelist()
+def set_instrumentation(enabled):
+    """Active / désactive la mesure (site_config ; pris en compte à la requête suivante)."""
+    frappe.only_for("System Manager")
+    from frappe.installer import update_site_config
+
+    update_site_config(CONFIG_KEY, 1 if frappe.utils.cint(enabled) else 0)
@@ -0,0 +1,68 @@
+"""Heures de main-d'œuvre par article (champs Item `custom_pose_vt` et
+`custom_number_of_labor_hours`).
+
+Utilisé par le calcul de `custom_labour_hours` des Sales Order / Sales Invoice :
+les deux champs de tous les articles d'un document sont lus en UNE requête, puis
+gardés dans un cache du processus.
+
+Le cache est invalidé par les events Item (`clear_cache`) : le processus courant
+vide son dict, les autres workers voient changer le numéro de génération
+stocké dans Redis (une lecture par appel) et vident le leur.
+"""
+
+import frappe
+
+GENERATION_KEY = "vt_item_labour_hours_generation"
+
+# {site: (génération, {item_code: heures de pose par unité, 0 hors pose VT})}
+# Un worker peut servir plusieurs sites : un cache par site.
+_cache = {}
+
+
+def _generation_key():
+    return frappe.cache.make_key(GENERATION_KEY)
+
+
+def _site_cache():
+    """Cache du site courant, vidé si la génération Redis a changé."""
+    generation = frappe.cache.get(_generation_key())
+    cached = _cache.get(frappe.local.site)
+    if not cached or cached[0] != generation:
+        cached = _cache[frappe.local.site] = (generation, {})
+    return cached[1]
+
+
+def get_labour_hours_per_unit(item_codes):
+    """{item_code: heures par unité} pour les articles donnés (0 hors pose VT)."""
+    cache = _site_cache()
+    codes = {c for c in item_codes if c}
+    missing = [c for c in codes if c not in cache]
+    if missing:
+        rows = frappe.db.sql(
+            """
+            SELECT name, custom_pose_vt, custom_number_of_labor_hours
+            FROM `tabItem`
+            WHERE name IN %(codes)s
+            """,
+            {"codes": missing},
+            as_dict=True,
+        )
+        for r in rows:
+            cache[r.name] = (r.custom_number_of_labor_hours or 0) if r.custom_pose_vt else 0
+        for c in missing:
+            # Article inexistant : pas d'heures (et pas de nouvelle requête).
+            cache.setdefault(c, 0)
+    return {c: cache[c] for c in codes}
+
+
+def compute_labour_hours(doc):
+    """Total des heures de pose d'un document (lignes + articles packés)."""
+    rows = list(doc.get("items") or []) + list(doc.get("packed_items") or [])
+    per_unit = get_labour_hours_per_unit(r.item_code for r in rows)
+    return sum((r.qty or 0) * per_unit.get(r.item_code, 0) for r in rows)
+
+
+def clear_cache():
+    """Invalide le cache dans ce processus et dans tous les autres workers."""
+    _cache.pop(frappe.local.site, None)
+    frappe.cache.incr(_generation_key())
@@ -3,59 +3,185 @@
 
 import frappe
 
+AXIS_TEMPS_PASSE = "Temps passé"
+AXIS_ACHATS = "Achats"
+AXIS_GLOBAL = "global"
 
-def get_theoretical(project, analysis_axis):
+# Répartition d'une ligne de vente selon l'article : identique aux conditions
+# historiques de get_theoretical (`custom_pose_vt = 1` / `NOT custom_pose_vt = 1`).
+# Les articles à custom_pose_vt NULL ne tombent dans aucun des deux axes mais
+# comptent dans le global, comme avant.
+_AXIS_CASE = """
+    CASE
+        WHEN i.custom_pose_vt = 1 THEN 'tp'
+        WHEN NOT i.custom_pose_vt = 1 THEN 'ach'
+        ELSE 'other'
+    END
+"""
+
+
+def _unique(projects):
+    return list(dict.fromkeys(projects or []))
+
+
+def get_theoretical_bulk(projects):
     """
-    Calcule les ventes et coûts théoriques d'un projet basé sur les Sales Order Items.
-    
+    Calcule les ventes et coûts théoriques de plusieurs projets en une passe.
+
+    Deux requêtes groupées (Sales Order Items hors bundles + Packed Items),
+    quel que soit le nombre de projets.
+
     Args:
-        project: Le nom du projet
-        analysis_axis: "Temps passé", "Achats", ou autre pour global
-        
+        projects: Liste de noms de projets
+
     Returns:
-        tuple: (total_vente, total_cost)
+        dict: {projet: {"Temps passé": (vente, cost), "Achats": (vente, cost),
+        "global": (vente, cost)}} — chaque projet demandé est présent.
     """
-    params = {"project": project}
-    item_group_condition = ""
+    projects = _unique(projects)
+    if not projects:
+        return {}
 
-    if analysis_axis == "Temps passé":
-        item_group_condition = "AND i.custom_pose_vt = 1"
-    elif analysis_axis == "Achats":
-        item_group_condition = "AND NOT i.custom_pose_vt = 1"
+    params = {"projects": projects}
 
-    # Récupération des ventes et coûts des lignes NON bundles
+    # Lignes NON bundles
     regular_items = frappe.db.sql(f"""
-        SELECT 
+        SELECT
+            so.project AS project,
+            {_AXIS_CASE} AS axis,
             SUM(soi.amount) AS vente,
             SUM(soi.qty * COALESCE(soi.base_unit_cost_price, 0)) AS cost
         FROM `tabSales Order Item` soi
         INNER JOIN `tabSales Order` so ON so.name = soi.parent
         INNER JOIN `tabItem` i ON i.name = soi.item_code
-        WHERE so.project = %(project)s
+        WHERE so.project IN %(projects)s
         AND so.docstatus = 1
         AND so.custom_exclude_from_statistics != 1
         AND COALESCE(soi.product_bundle_name, '') = ''
-        {item_group_condition}
-    """, params, as_dict=1)[0]
+        GROUP BY so.project, axis
+    """, params, as_dict=1)
 
-    # Récupération des packed_items (enfants des bundles)
+    # Packed items (enfants des bundles)
     packed_items = frappe.db.sql(f"""
-        SELECT 
+        SELECT
+            so.project AS project,
+            {_AXIS_CASE} AS axis,
             SUM(pi.qty * pi.rate) AS vente,
             SUM(pi.qty * COALESCE(pi.base_unit_cost_price, 0)) AS cost
         FROM `tabPacked Item` pi
         INNER JOIN `tabSales Order` so ON so.name = pi.parent AND pi.parenttype = 'Sales Order'
         INNER JOIN `tabItem` i ON i.name = pi.item_code
-        WHERE so.project = %(project)s
+        WHERE so.project IN %(projects)s
         AND so.docstatus = 1
         AND so.custom_exclude_from_statistics != 1
-        {item_group_condition}
-    """, params, as_dict=1)[0]
+        GROUP BY so.project, axis
+    """, params, as_dict=1)
+
+    acc = {p: {"tp": [0, 0], "ach": [0, 0], "other": [0, 0]} for p in projects}
+    for r in regular_items + packed_items:
+        e = acc[r.project][r.axis]
+        e[0] += r.vente or 0
+        e[1] += r.cost or 0
+
+    result = {}
+    for project, a in acc.items():
+        result[project] = {
+            AXIS_TEMPS_PASSE: (a["tp"][0], a["tp"][1]),
+            AXIS_ACHATS: (a["ach"][0], a["ach"][1]),
+            AXIS_GLOBAL: (
+                a["tp"][0] + a["ach"][0] + a["other"][0],
+                a["tp"][1] + a["ach"][1] + a["other"][1],
+            ),
+        }
+    return result
+
+
+def get_theoretical(project, analysis_axis):
+    """
+    Calcule les ventes et coûts théoriques d'un projet basé sur les Sales Order Items.
+    
+    Args:
+        project: Le nom du projet
+        analysis_axis: "Temps passé", "Achats", ou autre pour global
+        
+    Returns:
+        tuple: (total_vente, total_cost)
+    """
+    theo = get_theoretical_bulk([project])[project]
+    if analysis_axis not in (AXIS_TEMPS_PASSE, AXIS_ACHATS):
+        analysis_axis = AXIS_GLOBAL
+    return theo[analysis_axis]
+
+
+def get_project_costs_bulk(projects):
+    """
+    Récupère les coûts réels de plusieurs projets (trois requêtes au total).
+
+    Args:
+        projects: Liste de noms de projets
+
+    Returns:
+        dict: {projet: dict au format de get_project_costs}
+    """
+    projects = _unique(projects)
+    if not projects:
+        return {}
+
+    params = {"projects": projects}
 
-    total_vente = (regular_items.vente or 0) + (packed_items.vente or 0)
-    total_cost = (regular_items.cost or 0) + (packed_items.cost or 0)
+    # Champs natifs des projets
+    native = {
+        r.name: r
+        for r in frappe.db.sql("""
+            SELECT name, total_costing_amount, total_consumed_material_cost, total_expense_claim
+            FROM `tabProject`
+            WHERE name IN %(projects)s
+        """, params, as_dict=1)
+    }
 
-    return total_vente, total_cost
+    # Commandes fournisseur
+    purchase_orders = dict(frappe.db.sql("""
+        SELECT poi.project, COALESCE(SUM(poi.amount), 0)
+        FROM `tabPurchase Order Item` poi
+        INNER JOIN `tabPurchase Order` po ON po.name = poi.parent
+        WHERE poi.project IN %(projects)s AND po.docstatus < 2
+        GROUP BY poi.project
+    """, params))
+
+    # Fabrications VT
+    manufacturing = dict(frappe.db.sql("""
+        SELECT project, COALESCE(SUM(manufacturing_costs), 0)
+        FROM `tabFabrication VT`
+        WHERE project IN %(projects)s AND docstatus < 2
+        GROUP BY project
+    """, params))
+
+    result = {}
+    for project_name in projects:
+        project = native.get(project_name) or {}
+        total_costing_amount = project.get("total_costing_amount") or 0
+        total_consumed_material_cost = project.get("total_consumed_material_cost") or 0
+        total_expense_claim = project.get("total_expense_claim") or 0
+        total_purchase_order = purchase_orders.get(project_name) or 0
+        total_manufacturing_cost = manufacturing.get(project_name) or 0
+
+        total_real_cost = (
+            total_costing_amount +
+            total_purchase_order +
+            total_consumed_material_cost +
+            total_expense_claim +
+            total_manufacturing_cost
+        )
+
+        result[project_name] = {
+            'total_costing_amount': total_costing_amount,
+            'total_purchase_order': total_purchase_order,
+            'total_consumed_material_cost': total_consumed_material_cost,
+            'total_expense_claim': total_expense_claim,
+            'total_manufacturing_cost': total_manufacturing_cost,
+            'total_real_cost': total_real_cost,
+        }
+    return result
 
 
 def get_project_costs(project_name):
@@ -75,49 +201,7 @@ def get_project_costs(project_name):
             'total_real_cost': float,  # Total de tous les coûts
         }
     """
-    # Récupérer les champs natifs du projet
-    project = frappe.db.get_value(
-        "Project",
-        project_name,
-        ["total_costing_amount", "total_consumed_material_cost", "total_expense_claim"],
-        as_dict=True
-    ) or {}
-    
-    total_costing_amount = project.get("total_costing_amount") or 0
-    total_consumed_material_cost = project.get("total_consumed_material_cost") or 0
-    total_expense_claim = project.get("total_expense_claim") or 0
-    
-    # Calculer total_purchase_order via SQL
-    total_purchase_order = frappe.db.sql("""
-        SELECT COALESCE(SUM(poi.amount), 0) as total
-        FROM `tabPurchase Order Item` poi
-        INNER JOIN `tabPurchase Order` po ON po.name = poi.parent
-        WHERE poi.project = %s AND po.docstatus < 2
-    """, project_name)[0][0] or 0
-    
-    # Calculer total_manufacturing_cost via SQL
-    total_manufacturing_cost = frappe.db.sql("""
-        SELECT COALESCE(SUM(manufacturing_costs), 0) as total
-        FROM `tabFabrication VT`
-        WHERE project = %s AND docstatus < 2
-    """, project_name)[0][0] or 0
-    
-    total_real_cost = (
-        total_costing_amount +
-        total_purchase_order +
-        total_consumed_material_cost +
-        total_expense_claim +
-        total_manufacturing_cost
-    )
-    
-    return {
-        'total_costing_amount': total_costing_amount,
-        'total_purchase_order': total_purchase_order,
-        'total_consumed_material_cost': total_consumed_material_cost,
-        'total_expense_claim': total_expense_claim,
-        'total_manufacturing_cost': total_manufacturing_cost,
-        'total_real_cost': total_real_cost,
-    }
+    return get_project_costs_bulk([project_name])[project_name]
 
 
 def calculate_margin(vente, cost):
@@ -136,6 +220,48 @@ def calculate_margin(vente, cost):
     return (vente - cost) / vente * 100
 
 
+def get_project_margins_bulk(projects):
+    """
+    Calcule les marges théorique et réelle de plusieurs projets.
+
+    Cinq requêtes au total (2 théoriques + 3 coûts réels), quel que soit le
+    nombre de projets.
+
+    Args:
+        projects: Liste de noms de projets
+
+    Returns:
+        dict: {projet: dict au format de get_project_margins}
+    """
+    theoretical = get_theoretical_bulk(projects)
+    costs = get_project_costs_bulk(projects)
+
+    result = {}
+    for project_name, theo in theoretical.items():
+        theo_vente_tp, theo_cost_tp = theo[AXIS_TEMPS_PASSE]
+        theo_vente_ach, theo_cost_ach = theo[AXIS_ACHATS]
+
+        theo_vente = theo_vente_tp + theo_vente_ach
+        theo_cost = theo_cost_tp + theo_cost_ach
+        theo_margin = calculate_margin(theo_vente, theo_cost)
+
+        # Calcul réel
+        real_vente = theo_vente  # Même base de vente
+        real_cost = costs[project_name]['total_real_cost']
+        real_margin = calculate_margin(real_vente, real_cost)
+
+        result[project_name] = {
+            'theo_vente': theo_vente,
+            'theo_cost': theo_cost,
+            'theo_margin': theo_margin,
+            'real_vente': real_vente,
+            'real_cost': real_cost,
+            'real_margin': real_margin,
+            'margin_diff': real_margin - theo_margin,
+        }
+    return result
+
+
 def get_project_margins(project_name):
     """
     Calcule les marges théorique et réelle d'un projet.
@@ -154,31 +280,52 @@ def get_project_margins(project_name):
             'margin_diff': float,  # Écart en points de pourcentage
         }
     """
-    # Calcul théorique
-    theo_vente_tp, theo_cost_tp = get_theoretical(project_name, "Temps passé")
-    theo_vente_ach, theo_cost_ach = get_theoretical(project_name, "Achats")
-    
-    theo_vente = theo_vente_tp + theo_vente_ach
-    theo_cost = theo_cost_tp + theo_cost_ach
-    theo_margin = calculate_margin(theo_vente, theo_cost)
-    
-    # Calcul réel
-    real_vente = theo_vente  # Même base de vente
-    costs = get_project_costs(project_name)
-    real_cost = costs['total_real_cost']
-    real_margin = calculate_margin(real_vente, real_cost)
-    
-    margin_diff = real_margin - theo_margin
-    
-    return {
-        'theo_vente': theo_vente,
-        'theo_cost': theo_cost,
-        'theo_margin': theo_margin,
-        'real_vente': real_vente,
-        'real_cost': real_cost,
-        'real_margin': real_margin,
-        'margin_diff': margin_diff,
-    }
+    return get_project_margins_bulk([project_name])[project_name]
+
+
+def get_project_labour_hours_bulk(projects):
+    """
+    Récupère les heures prévues et réalisées de plusieurs projets (deux requêtes).
+
+    Args:
+        projects: Liste de noms de projets
+
+    Returns:
+        dict: {projet: dict au format de get_project_labour_hours}
+    """
+    projects = _unique(projects)
+    if not projects:
+        return {}
+
+    params = {"projects": projects}
+
+    # Heures prévues via Sales Orders
+    expected = dict(frappe.db.sql("""
+        SELECT project, COALESCE(SUM(custom_labour_hours), 0)
+        FROM `tabSales Order`
+        WHERE project IN %(projects)s AND docstatus = 1 AND custom_exclude_from_statistics != 1
+        GROUP BY project
+    """, params))
+
+    # Heures réalisées via Timesheets
+    actual = dict(frappe.db.sql("""
+        SELECT d.project, COALESCE(SUM(d.hours), 0)
+        FROM `tabTimesheet` t
+        JOIN `tabTimesheet Detail` d ON d.parent = t.name
+        WHERE d.project IN %(projects)s AND t.docstatus != 2
+        GROUP BY d.project
+    """, params))
+
+    result = {}
+    for project_name in projects:
+        expected_hours = expected.get(project_name) or 0
+        actual_hours = actual.get(project_name) or 0
+        result[project_name] = {
+            'expected_hours': expected_hours,
+            'actual_hours': actual_hours,
+            'hours_diff': actual_hours - expected_hours,
+        }
+    return result
 
 
 def get_project_labour_hours(project_name):
@@ -195,25 +342,4 @@ def get_project_labour_hours(project_name):
             'hours_diff': float,
         }
     """
-    # Heures prévues via Sales Orders
-    expected_hours = frappe.db.sql("""
-        SELECT COALESCE(SUM(custom_labour_hours), 0) as hours
-        FROM `tabSales Order`
-        WHERE project = %s AND docstatus = 1 AND custom_exclude_from_statistics != 1
-    """, project_name)[0][0] or 0
-    
-    # Heures réalisées via Timesheets
-    actual_hours = frappe.db.sql("""
-        SELECT COALESCE(SUM(d.hours), 0) as hours
-        FROM `tabTimesheet` t
-        JOIN `tabTimesheet Detail` d ON d.parent = t.name
-        WHERE d.project = %s AND t.docstatus != 2
-    """, project_name)[0][0] or 0
-    
-    hours_diff = actual_hours - expected_hours
-    
-    return {
-        'expected_hours': expected_hours,
-        'actual_hours': actual_hours,
-        'hours_diff': hours_diff,
-    }
+    return get_project_labour_hours_bulk([project_name])[project_name]
@@ -0,0 +1,172 @@
+"""Périodes des rapports d'analyse (semaine, mois, trimestre, année, exercice).
+
+Service commun à vt_sales_analytics, vt_margin_report, vt_quotation_analytics
+et objectifs_commerciaux_vt :
+
+- `get_fiscal_years` : bornes des exercices d'une société, en cache Redis
+  (invalidé par les events Fiscal Year) ;
+- `PeriodLookup` : pour une plage et une granularité, la liste des périodes
+  (colonnes) et une table date -> période construite une seule fois ; les
+  lignes ne refont plus de calcul de date.
+
+Clés de période (identiques en Python et en SQL, cf. `PeriodLookup.key_sql`) :
+semaine ISO `2025_w7`, mois `2025_03`, trimestre `2025_q1`, année `2025`,
+exercice : nom du Fiscal Year.
+"""
+
+from datetime import date, timedelta
+
+import frappe
+from dateutil.relativedelta import relativedelta
+from frappe.utils import getdate
+
+WEEK = "week"
+MONTH = "month"
+QUARTER = "quarter"
+YEAR = "year"
+FISCAL_YEAR = "fiscal_year"
+
+# Valeurs du filtre `range` des rapports -> granularité.
+RANGE_GRANULARITY = {
+    "Weekly": WEEK,
+    "Hebdomadaire": WEEK,
+    "Semaine": WEEK,
+    "Monthly": MONTH,
+    "Mensuel": MONTH,
+    "Mois": MONTH,
+    "Quarterly": QUARTER,
+    "Trimestriel": QUARTER,
+    "Trimestre": QUARTER,
+    "Annuel": YEAR,
+    "Yearly": FISCAL_YEAR,
+}
+
+FISCAL_YEARS_CACHE_KEY = "vt_fiscal_years"
+
+
+def get_fiscal_years(company=None):
+    """[(nom, début, fin)] des exercices actifs d'une société (ou communs),
+    triés par date de début. Mis en cache par société."""
+    return frappe.cache.hget(FISCAL_YEARS_CACHE_KEY, company or "", generator=lambda: _load_fiscal_years(company))
+
+
+def _load_fiscal_years(company):
+    return [
+        tuple(r)
+        for r in frappe.db.sql(
+            """
+            SELECT fy.name, fy.year_start_date, fy.year_end_date
+            FROM `tabFiscal Year` fy
+            WHERE fy.disabled = 0
+              AND (
+                NOT EXISTS (SELECT 1 FROM `tabFiscal Year Company` c WHERE c.parent = fy.name)
+                OR EXISTS (SELECT 1 FROM `tabFiscal Year Company` c WHERE c.parent = fy.name AND c.company = %(company)s)
+              )
+            ORDER BY fy.year_start_date
+            """,
+            {"company": company or ""},
+        )
+    ]
+
+
+def clear_fiscal_years_cache():
+    frappe.cache.delete_key(FISCAL_YEARS_CACHE_KEY)
+
+
+def get_fiscal_year_of(posting_date, company=None):
+    """(nom, début, fin) de l'exercice contenant la date."""
+    for fiscal_year in get_fiscal_years(company):
+        if fiscal_year[1] <= posting_date <= fiscal_year[2]:
+            return fiscal_year
+
+    # Aucun exercice : même erreur que le reste d'ERPNext.
+    from erpnext.accounts.utils import get_fiscal_year
+
+    return tuple(get_fiscal_year(posting_date, company=company)[:3])
+
+
+class PeriodLookup:
+    """Périodes d'une plage de dates pour une granularité donnée.
+
+    `periods` : liste de frappe._dict(key, label, year, number, start, end),
+    bornées à la plage ; `period(d)` / `key(d)` : période d'une date (table
+    précalculée, calcul direct hors plage)."""
+
+    def __init__(self, from_date, to_date, range_type, company=None):
+        self.from_date = getdate(from_date)
+        self.to_date = getdate(to_date)
+        self.granularity = RANGE_GRANULARITY.get(range_type, range_type)
+        self.company = company
+
+        self.periods = []
+        self._by_date = {}
+        current = self.from_date
+        while current <= self.to_date:
+            period = self._compute(current)
+            period.start = max(period.start, self.from_date)
+            period.end = min(period.end, self.to_date)
+            self.periods.append(period)
+            for offset in range((period.end - period.start).days + 1):
+                self._by_date[period.start + timedelta(days=offset)] = period
+            current = period.end + timedelta(days=1)
+
+    def period(self, posting_date):
+        if type(posting_date) is not date:
+            posting_date = getdate(posting_date)
+        period = self._by_date.get(posting_date)
+        if period is None:
+            period = self._by_date[posting_date] = self._compute(posting_date)
+        return period
+
+    def key(self, posting_date):
+        return self.period(posting_date).key
+
+    def key_sql(self, date_expr):
+        """Expression SQL donnant la clé de période de `date_expr` (à utiliser
+        dans une requête avec paramètres : les % sont doublés)."""
+        if self.granularity == WEEK:
+            return f"CONCAT(YEARWEEK({date_expr}, 3) DIV 100, '_w', YEARWEEK({date_expr}, 3) MOD 100)"
+        if self.granularity == MONTH:
+            return f"DATE_FORMAT({date_expr}, '%%Y_%%m')"
+        if self.granularity == QUARTER:
+            return f"CONCAT(YEAR({date_expr}), '_q', QUARTER({date_expr}))"
+        if self.granularity == YEAR:
+            return f"CAST(YEAR({date_expr}) AS CHAR)"
+
+        cases = " ".join(
+            f"WHEN {date_expr} BETWEEN {frappe.db.escape(str(p.start))} AND {frappe.db.escape(str(p.end))} "
+            f"THEN {frappe.db.escape(p.key)}"
+            for p in self.periods
+        )
+        return f"CASE {cases} END" if cases else "NULL"
+
+    def _compute(self, d):
+        """Période complète (non bornée) contenant la date."""
+        if self.granularity == WEEK:
+            year, week, weekday = d.isocalendar()
+            start = d - timedelta(days=weekday - 1)
+            return frappe._dict(
+                key=f"{year}_w{week}", label=f"Sem {week} {year}", year=year, number=week,
+                start=start, end=start + timedelta(days=6),
+            )
+        if self.granularity == MONTH:
+            start = d.replace(day=1)
+            return frappe._dict(
+                key=start.strftime("%Y_%m"), label=start.strftime("%b %Y"), year=d.year, number=d.month,
+                start=start, end=start + relativedelta(months=1, days=-1),
+            )
+        if self.granularity == QUARTER:
+            quarter = (d.month - 1) // 3 + 1
+            start = date(d.year, (quarter - 1) * 3 + 1, 1)
+            return frappe._dict(
+                key=f"{d.year}_q{quarter}", label=f"Q{quarter} {d.year}", year=d.year, number=quarter,
+                start=start, end=start + relativedelta(months=3, days=-1),
+            )
+        if self.granularity == YEAR:
+            return frappe._dict(
+                key=str(d.year), label=str(d.year), year=d.year, number=1,
+                start=date(d.year, 1, 1), end=date(d.year, 12, 31),
+            )
+
+        name, start, end = get_fiscal_year_of(d, self.company)
+        return frappe._dict(key=str(name), label=str(name), year=start.year, number=1, start=start, end=end)
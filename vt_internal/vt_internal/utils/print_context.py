@@ -0,0 +1,48 @@
+"""Utilitaires partagés des hooks `before_print`.
+
+- `get_bom_attributes` : attributs de plusieurs BOM (référence, dimensions) en
+  une requête, au lieu d'un `get_value` par ligne.
+- `get_cached_print_context` : mémorise le contexte calculé d'un document par
+  (doctype, nom, modified) ; aperçus, PDF et pièces jointes successifs d'une
+  même version le réutilisent.
+"""
+
+import frappe
+
+# Durée de vie d'un contexte d'impression mémorisé.
+PRINT_CONTEXT_TTL = 600
+
+BOM_PRINT_FIELDS = ("reference_ligne", "hauteur", "largeur")
+
+
+def get_bom_attributes(bom_nos, fields=BOM_PRINT_FIELDS):
+    """{bom: frappe._dict(champs)} pour les BOM donnés (une seule requête)."""
+    bom_nos = list({b for b in bom_nos if b})
+    if not bom_nos:
+        return {}
+    return {
+        r.name: r
+        for r in frappe.db.sql(
+            f"""
+            SELECT name, {", ".join(f"`{f}`" for f in fields)}
+            FROM `tabBOM`
+            WHERE name IN %(boms)s
+            """,
+            {"boms": bom_nos},
+            as_dict=True,
+        )
+    }
+
+
+def get_cached_print_context(doc, kind, build):
+    """Renvoie `build(doc)`, mémorisé par (doctype, nom, modified, kind).
+
+    Un document non enregistré n'est pas mis en cache."""
+    if doc.is_new():
+        return build(doc)
+    key = f"vt_print_context:{doc.doctype}:{doc.name}:{doc.modified}:{kind}"
+    context = frappe.cache.get_value(key)
+    if context is None:
+        context = build(doc)
+        frappe.cache.set_value(key, context, expires_in_sec=PRINT_CONTEXT_TTL)
+    return context
@@ -0,0 +1,199 @@
+"""Exécution en tâche de fond et cache des résultats des rapports longs.
+
+`background_report` décore le `execute` d'un Script Report :
+
+- le résultat est gardé en Redis, compressé (zlib), par (rapport, empreinte des
+  filtres) ; il est resservi tant que les tables dont dépend le rapport
+  (`depends_on`, tables enfants et arbres compris) n'ont pas changé (version =
+  dernier `modified` de chacune, lu sur son index, et dernière suppression
+  enregistrée dans Deleted Document) ;
+- si `is_long(filters)` est vrai, le calcul part sur la file « long » avec
+  progression (`report_progress`) et le rapport affiche un message d'attente ;
+  le navigateur est prévenu à la fin (`vt_report_ready`) et se rafraîchit. Le
+  résultat qui vient d'être calculé lui est servi une fois même si les données
+  ont changé pendant le calcul (sinon, sur des tables actives, chaque
+  rafraîchissement relancerait la tâche sans jamais afficher le résultat) ;
+- une tâche en échec garde son erreur (servie à la place du résultat tant que
+  les données n'ont pas changé, au plus ERROR_TTL) : un rafraîchissement ne
+  relance pas le même calcul voué à l'échec ;
+- `clear_report_result` (bouton « Recalculer », cf. public/js/vt/report_jobs.js)
+  oublie le résultat pour forcer un nouveau calcul.
+
+Les rapports Frappe « prepared » ne conviennent pas ici : ils s'appliquent à
+toutes les exécutions d'un rapport et ne voient pas les changements de données.
+"""
+
+import functools
+import hashlib
+import json
+import zlib
+
+import frappe
+from frappe import _
+from frappe.utils import date_diff
+
+# Durée de vie d'un résultat en cache.
+RESULT_TTL = 24 * 3600
+# Durée de vie d'une erreur de tâche de fond (avant nouvelle tentative).
+ERROR_TTL = 600
+JOB_TIMEOUT = 3600
+
+
+def background_report(report_name, depends_on, is_long=None):
+    """Décorateur de `execute(filters)` (cf. docstring du module)."""
+
+    def decorator(execute):
+        @functools.wraps(execute)
+        def wrapper(filters=None):
+            return run_report(report_name, execute, filters, depends_on, is_long)
+
+        return wrapper
+
+    return decorator
+
+
+def long_date_range(filters, days=365):
+    """`is_long` usuel : plage from_date -> to_date d'au moins `days` jours."""
+    if not filters.get("from_date") or not filters.get("to_date"):
+        return False
+    return date_diff(filters.to_date, filters.from_date) >= days
+
+
+def run_report(report_name, execute, filters, depends_on, is_long=None):
+    filters = frappe._dict(filters or {})
+    key = _result_key(report_name, filters)
+
+    # Résultat que la tâche de fond de l'utilisateur vient de terminer.
+    ready_key = _ready_key(key)
+    ready = _load(ready_key)
+    if ready:
+        frappe.cache.delete_value(ready_key)
+        return _unpack(ready)
+
+    version = _data_version(depends_on)
+    cached = _load(key)
+    if cached and cached["version"] == version:
+        return _unpack(cached)
+
+    if is_long and is_long(filters):
+        frappe.enqueue(
+            "vt_internal.vt_internal.utils.report_jobs.run_report_job",
+            queue="long",
+            timeout=JOB_TIMEOUT,
+            job_id=f"vt_report:{key}",
+            deduplicate=True,
+            report_name=report_name,
+            execute_method=f"{execute.__module__}.{execute.__name__}",
+            filters=filters,
+            depends_on=depends_on,
+        )
+        return [], [], _pending_message()
+
+    result = execute(filters)
+    _store(key, version, result)
+    return result
+
+
+def run_report_job(report_name, execute_method, filters, depends_on):
+    """Tâche de fond : calcule le rapport, garde le résultat, prévient l'utilisateur."""
+    execute = frappe.get_attr(execute_method)
+    execute = getattr(execute, "__wrapped__", execute)
+    key = _result_key(report_name, filters)
+    version = _data_version(depends_on)
+
+    frappe.flags.vt_report_job = report_name
+    try:
+        report_progress(0, _("Démarrage"))
+        result = execute(frappe._dict(filters))
+    except Exception as e:
+        # Erreur gardée et publiée (sinon message d'attente sans fin et même
+        # calcul relancé à chaque rafraîchissement), puis relevée pour le log RQ.
+        error = str(e) or type(e).__name__
+        _store(key, version, error=error, expires_in_sec=ERROR_TTL)
+        _store(_ready_key(key), version, error=error, expires_in_sec=JOB_TIMEOUT)
+        frappe.publish_realtime(
+            "vt_report_ready", {"report": report_name, "key": key, "error": error}, user=frappe.session.user
+        )
+        raise
+    finally:
+        frappe.flags.vt_report_job = None
+
+    _store(key, version, result)
+    _store(_ready_key(key), version, result, expires_in_sec=JOB_TIMEOUT)
+    report_progress(100, _("Terminé"))
+    frappe.publish_realtime("vt_report_ready", {"report": report_name, "key": key}, user=frappe.session.user)
+
+
+def report_progress(percent, description=None):
+    """Progression affichée à l'utilisateur (sans effet hors tâche de fond)."""
+    if frappe.flags.vt_report_job:
+        frappe.publish_progress(percent, title=_(frappe.flags.vt_report_job), description=description)
+
+
+@frappe.whitelist()
+def clear_report_result(report_name, filters=None):
+    """Oublie le résultat en cache pour ces filtres (bouton « Recalculer »)."""
+    if not frappe.get_doc("Report", report_name).is_permitted():
+        frappe.throw(_("Not permitted"), frappe.PermissionError)
+    if isinstance(filters, str):
+        filters = json.loads(filters)
+    key = _result_key(report_name, frappe._dict(filters or {}))
+    frappe.cache.delete_value([key, _ready_key(key)])
+
+
+def _result_key(report_name, filters):
+    # Les filtres vides ne changent pas le résultat : même empreinte.
+    significant = {k: v for k, v in filters.items() if v not in (None, "", [])}
+    digest = hashlib.sha1(json.dumps(significant, sort_keys=True, default=str).encode()).hexdigest()
+    return f"vt_report_result:{report_name}:{digest}"
+
+
+def _ready_key(key):
+    # Par utilisateur : la tâche (dédupliquée) prévient celui qui l'a lancée.
+    return f"vt_report_ready:{frappe.session.user}:{key}"
+
+
+def _data_version(doctypes):
+    """Empreinte des données sources, en une requête : dernier `modified` de
+    chaque table (lu sur l'index `modified`) et dernière suppression
+    enregistrée pour ces doctypes. Les modifications de lignes enfants passent
+    par l'enregistrement du parent (son `modified` change)."""
+    branches = [
+        f"SELECT {frappe.db.escape(doctype)}, MAX(modified) FROM `tab{doctype}`" for doctype in doctypes
+    ]
+    branches.append(
+        "SELECT 'Deleted Document', MAX(creation) FROM `tabDeleted Document` WHERE deleted_doctype IN %(doctypes)s"
+    )
+    rows = frappe.db.sql("\nUNION ALL\n".join(branches), {"doctypes": list(doctypes)})
+    return "|".join(f"{doctype}:{last_modified}" for doctype, last_modified in rows)
+
+
+def _load(key):
+    payload = frappe.cache.get_value(key)
+    if not payload:
+        return None
+    return json.loads(zlib.decompress(payload))
+
+
+def _store(key, version, result=None, error=None, expires_in_sec=RESULT_TTL):
+    value = {"version": version, "error": error} if error else {"version": version, "result": result}
+    payload = frappe.as_json(value, indent=None, separators=(",", ":"))
+    frappe.cache.set_value(key, zlib.compress(payload.encode()), expires_in_sec=expires_in_sec)
+
+
+def _unpack(payload):
+    if payload.get("error"):
+        return [], [], _error_message(payload["error"])
+    return payload["result"]
+
+
+def _error_message(error):
+    return "<div class='text-danger' style='padding:20px;text-align:center;'>{}<br>{}</div>".format(
+        _("Le calcul en arrière-plan a échoué (« Recalculer » pour relancer) :"), frappe.utils.escape_html(error)
+    )
+
+
+def _pending_message():
+    return "<div class='text-muted' style='padding:20px;text-align:center;'>{}</div>".format(
+        _("Calcul en cours en arrière-plan : le rapport s'affichera automatiquement une fois terminé.")
+    )
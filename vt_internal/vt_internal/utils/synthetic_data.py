@@ -0,0 +1,441 @@
+"""Jeu de données synthétique pour les mesures de performance (cf. utils/benchmark.py).
+
+`generate(scale, companies, seed)` crée, sur un site de test, des sociétés,
+clients, articles, nomenclatures, projets, devis, commandes (lignes avec
+nomenclature + articles emballés), factures, feuilles de temps, commandes
+fournisseur, fabrications, fiches de travail et événements. Volumes : `BASE_COUNTS`
+x `scale`. Même graine, même jeu de données.
+
+Les documents sont écrits directement (`db_insert`, sans contrôleurs ERPNext) :
+seules les lectures (rapports, API) sont mesurées, pas la saisie. Tous les noms
+commencent par `PREFIX`, ce qui permet `purge`.
+
+Les valeurs libres des champs personnalisés (secteur, assurance, type de
+projet…) sont tirées des valeurs déjà présentes sur le site quand il y en a.
+"""
+
+import random
+from datetime import timedelta
+
+import frappe
+from frappe.utils import add_days, getdate, today
+
+from vt_internal.vt_internal.constants import (
+    ACTIVITY_ATELIER,
+    ACTIVITY_CHANTIER,
+    ACTIVITY_VISITE,
+    FT_STATUS_DONE,
+    FT_STATUS_IN_PROGRESS,
+    FT_STATUS_TODO,
+    FT_STATUS_WAITING_FAB,
+)
+
+PREFIX = "VTB-"
+
+# Volumes pour scale = 1 (hors sociétés, nombre passé à part).
+BASE_COUNTS = {
+    "users": 8,
+    "customers": 40,
+    "suppliers": 10,
+    "items": 30,
+    "boms": 10,
+    "projects": 60,
+    "quotations": 150,
+    "sales_orders": 80,
+    "sales_invoices": 60,
+    "timesheets": 200,
+    "purchase_orders": 40,
+    "fabrications": 60,
+    "fiches": 80,
+    "events": 300,
+}
+
+# Documents générés, du parent vers les enfants (ordre de purge inverse).
+DOCTYPES = (
+    "Company",
+    "Cost Center",
+    "User",
+    "Employee",
+    "Customer",
+    "Supplier",
+    "Item",
+    "BOM",
+    "Project",
+    "Quotation",
+    "Sales Order",
+    "Sales Invoice",
+    "Timesheet",
+    "Purchase Order",
+    "Fabrication VT",
+    "Fiche de travail",
+    "Event",
+)
+
+# Historique couvert par les documents datés (jours avant aujourd'hui).
+HISTORY_DAYS = 730
+
+PROJECT_STATUSES = ("Open", "Open", "Open", "Completed", "Cancelled")
+FICHE_STATUSES = (FT_STATUS_WAITING_FAB, FT_STATUS_TODO, FT_STATUS_IN_PROGRESS, FT_STATUS_DONE)
+FABRICATION_STATUSES = ("À faire", "En cours", "Fait")
+PO_STATUSES = ("To Receive and Bill", "To Bill", "Completed")
+FOLLOW_UP_STATUSES = ("", "", "Relancé", "Variante")
+
+
+def generate(scale=1, companies=2, seed=42):
+    """Crée le jeu de données (après purge d'un éventuel jeu précédent), puis
+    reconstruit le cube des ventes pour que les rapports le lisent."""
+    from vt_internal.vt_internal.doctype.vt_sales_cube.vt_sales_cube import rebuild_all
+
+    purge()
+    counts = _Generator(scale, companies, seed).run()
+    rebuild_all()
+    return counts
+
+
+def purge():
+    """Supprime tous les documents générés (et leurs lignes enfants), ainsi que
+    les données dérivées : instantanés financiers des projets et cellules du
+    cube des ventes des sociétés générées."""
+    from vt_internal.vt_internal.doctype.project_financial_snapshot.project_financial_snapshot import (
+        DOCTYPE as SNAPSHOT_DOCTYPE,
+    )
+    from vt_internal.vt_internal.doctype.vt_sales_cube.vt_sales_cube import DOCTYPE as CUBE_DOCTYPE
+
+    # name = projet
+    frappe.db.sql(f"DELETE FROM `tab{SNAPSHOT_DOCTYPE}` WHERE name LIKE %s", (f"{PREFIX}%",))
+    frappe.db.sql(f"DELETE FROM `tab{CUBE_DOCTYPE}` WHERE company LIKE %s", (f"{PREFIX}%",))
+    for doctype in reversed(DOCTYPES):
+        for child_doctype in {df.options for df in frappe.get_meta(doctype).get_table_fields()}:
+            frappe.db.sql(
+                f"DELETE FROM `tab{child_doctype}` WHERE parenttype = %s AND parent LIKE %s",
+                (doctype, f"{PREFIX}%"),
+            )
+        # LIKE insensible à la casse : couvre aussi les User (vtb-user-…@example.com).
+        frappe.db.sql(f"DELETE FROM `tab{doctype}` WHERE name LIKE %s", (f"{PREFIX}%",))
+    frappe.db.commit()
+
+
+def _insert(values):
+    """Écrit un document et ses lignes enfants sans passer par son contrôleur."""
+    doc = frappe.get_doc(values)
+    doc.db_insert()
+    for child in doc.get_all_children():
+        child.db_insert()
+    return doc
+
+
+def _existing_values(doctype, fieldname):
+    """Valeurs distinctes d'un champ sur le site (vide si le champ n'existe pas)."""
+    if not frappe.db.has_column(doctype, fieldname):
+        return []
+    return [
+        r[0]
+        for r in frappe.db.sql(
+            f"SELECT DISTINCT `{fieldname}` FROM `tab{doctype}` WHERE IFNULL(`{fieldname}`, '') != '' LIMIT 50"
+        )
+    ]
+
+
+class _Generator:
+    def __init__(self, scale, companies, seed):
+        self.rng = random.Random(seed)
+        self.counts = {k: max(1, int(v * scale)) for k, v in BASE_COUNTS.items()}
+        self.counts["companies"] = companies
+        self.today = getdate(today())
+
+        self.secteurs = _existing_values("Project", "secteur_vt") or [None]
+        self.insurances = _existing_values("Project", "insurance") or [None]
+        self.project_types = frappe.get_all("Project Type", pluck="name") or [None]
+        self.activity_types = sorted(
+            set(frappe.get_all("Activity Type", pluck="name")) | {ACTIVITY_ATELIER, ACTIVITY_CHANTIER, ACTIVITY_VISITE}
+        )
+        self.customer_group = frappe.db.get_value("Customer Group", {"is_group": 0}) or "All Customer Groups"
+        self.supplier_group = frappe.db.get_value("Supplier Group", {"is_group": 0}) or "All Supplier Groups"
+        self.item_group = frappe.db.get_value("Item Group", {"is_group": 0}) or "All Item Groups"
+        self.uom = frappe.db.get_value("UOM", {"enabled": 1}) or "Nos"
+        self.currency = frappe.db.get_default("currency") or "EUR"
+
+    def name(self, kind, i):
+        return f"{PREFIX}{kind}-{i:05d}"
+
+    def pick(self, values):
+        return self.rng.choice(values)
+
+    def past_date(self, days=HISTORY_DAYS):
+        return self.today - timedelta(days=self.rng.randint(0, days))
+
+    def run(self):
+        for step in (
+            self.make_companies,
+            self.make_users,
+            self.make_parties,
+            self.make_items,
+            self.make_projects,
+            self.make_quotations,
+            self.make_sales_orders,
+            self.make_sales_invoices,
+            self.make_timesheets,
+            self.make_purchase_orders,
+            self.make_fabrications,
+            self.make_fiches,
+            self.make_events,
+        ):
+            step()
+            frappe.db.commit()
+
+        from frappe.utils.nestedset import rebuild_tree
+
+        rebuild_tree("Company")
+        rebuild_tree("Cost Center")
+        frappe.db.commit()
+        return self.counts
+
+    # --- Référentiels ---------------------------------------------------
+    def make_companies(self):
+        self.companies = []
+        for i in range(1, self.counts["companies"] + 1):
+            abbr = f"VTB{i}"
+            company = _insert({
+                "doctype": "Company", "name": self.name("SOC", i), "company_name": self.name("SOC", i),
+                "abbr": abbr, "default_currency": self.currency, "country": "France",
+            }).name
+            cost_centers = [
+                _insert({
+                    "doctype": "Cost Center", "name": f"{PREFIX}CC{j} - {abbr}", "cost_center_name": f"{PREFIX}CC{j}",
+                    "company": company, "is_group": 0,
+                }).name
+                for j in range(1, 4)
+            ]
+            self.companies.append(frappe._dict(name=company, cost_centers=cost_centers))
+
+    def make_users(self):
+        self.users, self.employees = [], []
+        for i in range(1, self.counts["users"] + 1):
+            user = _insert({
+                "doctype": "User", "name": f"{PREFIX.lower()}user-{i:03d}@example.com",
+                "email": f"{PREFIX.lower()}user-{i:03d}@example.com", "first_name": f"Bench {i}",
+                "enabled": 1, "user_type": "System User",
+                "roles": [{"role": "Employee"}, {"role": "Projects User"}],
+            }).name
+            company = self.companies[i % len(self.companies)]
+            employee = _insert({
+                "doctype": "Employee", "name": self.name("EMP", i), "first_name": f"Bench {i}",
+                "employee_name": f"Bench {i}", "company": company.name, "user_id": user,
+                "status": "Active", "date_of_joining": add_days(self.today, -HISTORY_DAYS),
+            }).name
+            self.users.append(user)
+            self.employees.append(frappe._dict(name=employee, user=user, company=company.name))
+
+    def make_parties(self):
+        self.customers = [
+            _insert({
+                "doctype": "Customer", "name": self.name("CLI", i), "customer_name": self.name("CLI", i),
+                "customer_group": self.customer_group, "customer_type": "Company",
+            }).name
+            for i in range(1, self.counts["customers"] + 1)
+        ]
+        self.suppliers = [
+            _insert({
+                "doctype": "Supplier", "name": self.name("FOU", i), "supplier_name": self.name("FOU", i),
+                "supplier_group": self.supplier_group,
+            }).name
+            for i in range(1, self.counts["suppliers"] + 1)
+        ]
+
+    def make_items(self):
+        self.items = [
+            _insert({
+                "doctype": "Item", "name": self.name("ART", i), "item_code": self.name("ART", i),
+                "item_name": self.name("ART", i), "item_group": self.item_group, "stock_uom": self.uom,
+                "is_stock_item": 1, "valuation_rate": self.rng.randint(5, 200),
+            }).name
+            for i in range(1, self.counts["items"] + 1)
+        ]
+        self.boms = []
+        for i in range(1, self.counts["boms"] + 1):
+            item = self.items[i % len(self.items)]
+            bom = _insert({
+                "doctype": "BOM", "name": self.name("BOM", i), "item": item, "company": self.companies[0].name,
+                "quantity": 1, "is_active": 1, "is_default": 1, "docstatus": 1, "currency": self.currency,
+                "items": [
+                    {"item_code": self.pick(self.items), "qty": self.rng.randint(1, 4), "rate": self.rng.randint(5, 80),
+                     "uom": self.uom, "stock_uom": self.uom, "conversion_factor": 1}
+                    for _ in range(3)
+                ],
+            })
+            self.boms.append(frappe._dict(name=bom.name, item=item, lines=[r.item_code for r in bom.items]))
+
+    # --- Projets et ventes -----------------------------------------------
+    def make_projects(self):
+        self.projects = []
+        for i in range(1, self.counts["projects"] + 1):
+            company = self.pick(self.companies)
+            start = self.past_date()
+            project = _insert({
+                "doctype": "Project", "name": self.name("PRJ", i), "project_name": self.name("PRJ", i),
+                "company": company.name, "status": self.pick(PROJECT_STATUSES),
+                "customer": self.pick(self.customers), "cost_center": self.pick(company.cost_centers),
+                "project_type": self.pick(self.project_types), "secteur_vt": self.pick(self.secteurs),
+                "insurance": self.pick(self.insurances), "custom_construction_manager": self.pick(self.users),
+                "custom_project_manager": self.pick(self.users), "expected_start_date": start,
+                "expected_end_date": start + timedelta(days=self.rng.randint(7, 120)),
+                "custom_estimated_labor_hours": self.rng.randint(4, 200),
+            })
+            self.projects.append(frappe._dict(name=project.name, company=company, customer=project.customer))
+
+    def _lines(self, with_bom=False):
+        lines = []
+        for _ in range(self.rng.randint(1, 5)):
+            qty, rate = self.rng.randint(1, 10), self.rng.randint(20, 900)
+            line = {
+                "item_code": self.pick(self.items), "qty": qty, "rate": rate, "amount": qty * rate,
+                "base_amount": qty * rate, "net_amount": qty * rate, "uom": self.uom, "stock_uom": self.uom,
+                "conversion_factor": 1, "stock_qty": qty,
+            }
+            if with_bom:
+                bom = self.pick(self.boms)
+                line.update(item_code=bom.item, bom_no=bom.name, unit_cost_price=round(rate * self.rng.uniform(0.4, 0.8), 2))
+            lines.append(line)
+        return lines
+
+    def _totals(self, lines):
+        total = sum(r["amount"] for r in lines)
+        return {
+            "total": total, "net_total": total, "base_total": total, "base_net_total": total,
+            "grand_total": round(total * 1.2, 2), "base_grand_total": round(total * 1.2, 2),
+            "total_qty": sum(r["qty"] for r in lines), "currency": self.currency, "conversion_rate": 1,
+        }
+
+    def _sales_dims(self, project):
+        return {
+            "company": project.company.name, "cost_center": self.pick(project.company.cost_centers),
+            "secteur_vt": self.pick(self.secteurs), "custom_insurance_client": self.pick(self.insurances),
+            "custom_type_de_projet": self.pick(self.project_types), "custom_responsable_du_devis": self.pick(self.users),
+        }
+
+    def make_quotations(self):
+        for i in range(1, self.counts["quotations"] + 1):
+            project = self.pick(self.projects)
+            lines = self._lines()
+            docstatus = self.rng.choice((0, 1, 1, 1))
+            _insert({
+                "doctype": "Quotation", "name": self.name("DEV", i), "quotation_to": "Customer",
+                "party_name": project.customer, "customer_name": project.customer, "transaction_date": self.past_date(),
+                "docstatus": docstatus, "status": "Open" if docstatus else "Draft",
+                "custom_dernier_statut_de_suivi": self.pick(FOLLOW_UP_STATUSES),
+                **self._sales_dims(project), **self._totals(lines), "items": lines,
+            })
+
+    def make_sales_orders(self):
+        self.sales_orders = []
+        for i in range(1, self.counts["sales_orders"] + 1):
+            project = self.pick(self.projects)
+            lines = self._lines(with_bom=True)
+            packed = [
+                {"parent_item": line["item_code"], "item_code": component, "qty": line["qty"], "uom": self.uom}
+                for line in lines
+                for component in next(b.lines for b in self.boms if b.name == line["bom_no"])[:2]
+            ]
+            transaction_date = self.past_date()
+            so = _insert({
+                "doctype": "Sales Order", "name": self.name("CMD", i), "customer": project.customer,
+                "customer_name": project.customer, "project": project.name, "transaction_date": transaction_date,
+                "delivery_date": transaction_date + timedelta(days=self.rng.randint(10, 90)),
+                "docstatus": self.rng.choice((0, 1, 1, 1, 1)), "status": "To Deliver and Bill",
+                "per_billed": self.rng.choice((0, 50, 100)), "per_delivered": self.rng.choice((0, 100)),
+                **self._sales_dims(project), **self._totals(lines), "items": lines, "packed_items": packed,
+            })
+            self.sales_orders.append(frappe._dict(name=so.name, project=project, customer=project.customer))
+
+    def make_sales_invoices(self):
+        for i in range(1, self.counts["sales_invoices"] + 1):
+            project = self.pick(self.projects)
+            lines = self._lines()
+            _insert({
+                "doctype": "Sales Invoice", "name": self.name("FAC", i), "customer": project.customer,
+                "customer_name": project.customer, "project": project.name, "posting_date": self.past_date(),
+                "company": project.company.name, "cost_center": self.pick(project.company.cost_centers),
+                "custom_type_de_projet": self.pick(self.project_types), "docstatus": self.rng.choice((0, 1, 1, 1)),
+                "custom_labour_hours": self.rng.randint(0, 40), **self._totals(lines), "items": lines,
+            })
+
+    # --- Production et planning ------------------------------------------
+    def make_timesheets(self):
+        for i in range(1, self.counts["timesheets"] + 1):
+            employee = self.pick(self.employees)
+            # La première feuille est celle du jour, laissée ouverte (pointage en cours).
+            day = self.today if i == 1 else self.past_date(HISTORY_DAYS // 2)
+            start = frappe.utils.get_datetime(f"{day} 07:30:00")
+            logs, cursor = [], start
+            for _ in range(self.rng.randint(2, 5)):
+                hours = self.rng.choice((0.5, 1, 1.5, 2, 2.5, 3))
+                logs.append({
+                    "activity_type": self.pick(self.activity_types), "from_time": cursor,
+                    "to_time": cursor + timedelta(hours=hours), "hours": hours,
+                    "project": self.pick(self.projects).name,
+                })
+                cursor += timedelta(hours=hours)
+            if i == 1:
+                logs[-1].update(to_time=None, hours=0)
+            _insert({
+                "doctype": "Timesheet", "name": self.name("TS", i), "employee": employee.name,
+                "employee_name": employee.name, "company": employee.company, "start_date": day, "end_date": day,
+                "docstatus": 0 if i == 1 else self.rng.choice((0, 1, 1)),
+                "total_hours": sum(r["hours"] for r in logs), "time_logs": logs,
+            })
+
+    def make_purchase_orders(self):
+        for i in range(1, self.counts["purchase_orders"] + 1):
+            company = self.pick(self.companies)
+            transaction_date = self.past_date(HISTORY_DAYS // 2)
+            schedule_date = transaction_date + timedelta(days=self.rng.randint(5, 45))
+            lines = self._lines()
+            for line in lines:
+                line.update(schedule_date=schedule_date, expected_delivery_date=schedule_date)
+            _insert({
+                "doctype": "Purchase Order", "name": self.name("CF", i), "supplier": self.pick(self.suppliers),
+                "company": company.name, "transaction_date": transaction_date, "schedule_date": schedule_date,
+                "docstatus": 1, "status": self.pick(PO_STATUSES), "per_received": self.rng.choice((0, 50, 100)),
+                **self._totals(lines), "items": lines,
+            })
+
+    def make_fabrications(self):
+        for i in range(1, self.counts["fabrications"] + 1):
+            so = self.pick(self.sales_orders)
+            bom = self.pick(self.boms)
+            _insert({
+                "doctype": "Fabrication VT", "name": self.name("FAB", i), "status": self.pick(FABRICATION_STATUSES),
+                "nomenclature": bom.name, "article": bom.item, "company": so.project.company.name,
+                "client": so.customer, "customer_order": so.name, "project": so.project.name,
+                "date_de_fin_prévue": self.past_date(HISTORY_DAYS // 2) + timedelta(days=30),
+                "quantity": str(self.rng.randint(1, 10)), "destination": "Chantier",
+                "manufacturing_costs": self.rng.randint(50, 2000),
+            })
+
+    def make_fiches(self):
+        self.fiches = []
+        for i in range(1, self.counts["fiches"] + 1):
+            so = self.pick(self.sales_orders)
+            fiche = _insert({
+                "doctype": "Fiche de travail", "name": self.name("FT", i), "status": self.pick(FICHE_STATUSES),
+                "référence_pièce": f"REF-{i:05d}", "customer": so.customer, "projet": so.project.name,
+                "sales_order": so.name, "company": so.project.company.name,
+                "cost_center": self.pick(so.project.company.cost_centers),
+                "starts_on": self.past_date(HISTORY_DAYS // 4) + timedelta(days=30),
+            })
+            self.fiches.append(fiche.name)
+
+    def make_events(self):
+        for i in range(1, self.counts["events"] + 1):
+            # Un quart des événements autour d'aujourd'hui (planning, pointage du jour).
+            day = self.today + timedelta(days=self.rng.randint(-3, 10)) if i % 4 == 0 else self.past_date(HISTORY_DAYS // 4)
+            starts_on = frappe.utils.get_datetime(f"{day} {self.rng.choice(('08:00', '10:00', '14:00'))}:00")
+            employee = self.pick(self.employees)
+            fiche = self.pick(self.fiches) if self.rng.random() < 0.7 else None
+            _insert({
+                "doctype": "Event", "name": self.name("EV", i), "subject": fiche or self.name("EV", i),
+                "event_type": "Public", "event_category": "Event", "starts_on": starts_on,
+                "ends_on": starts_on + timedelta(hours=self.rng.choice((2, 4, 8))),
+                "custom_employé": employee.name, "custom_fiche_de_travail": fiche,
+                "project": self.pick(self.projects).name, "owner": employee.user,
+            })
@@ -0,0 +1,33 @@
+# Copyright (c) 2026, Verre & Transparence and Contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from vt_internal.vt_internal.utils import instrumentation
+
+
+class TestInstrumentation(FrappeTestCase):
+	HANDLER_KEY = "ToDo|on_update|todo.on_update"
+
+	def setUp(self):
+		frappe.set_user("Administrator")
+		instrumentation.reset_handler_stats()
+
+	def test_recorded_samples_are_read_back_and_reset(self):
+		instrumentation._record(self.HANDLER_KEY, 12.5, 3, 4)
+		instrumentation._record(self.HANDLER_KEY, 7.5, 1, 2)
+
+		stats = instrumentation.get_handler_stats()
+		handlers = {(h["doctype"], h["event"], h["handler"]): h for h in stats["handlers"]}
+		handler = handlers[("ToDo", "on_update", "todo.on_update")]
+		self.assertEqual(handler["calls"], 2)
+		self.assertEqual(handler["max_ms"], 12.5)
+		self.assertEqual(stats["doctypes"][0]["doctype"], "ToDo")
+
+		instrumentation.reset_handler_stats()
+
+		stats = instrumentation.get_handler_stats()
+		self.assertEqual(stats["handlers"], [])
+		samples_key = instrumentation._key(instrumentation._SAMPLES_KEY + self.HANDLER_KEY)
+		self.assertEqual(frappe.cache.pipeline().llen(samples_key).execute(), [0])
@@ -1,5 +1,7 @@
 """Utilitaires temps partagés (feuilles de temps / pointage)."""
 
+from datetime import datetime, timedelta
+
 import frappe
 
 
@@ -10,8 +12,18 @@ def round_to_quarter(dt):
     par l'event `validate` du Timesheet (à l'enregistrement), pour éviter deux
     algorithmes d'arrondi divergents.
     """
-    dt = frappe.utils.get_datetime(dt)
+    # Chemin rapide : datetime déjà typé (cas des lignes d'une feuille chargée).
+    if type(dt) is not datetime:
+        dt = frappe.utils.get_datetime(dt)
     delta = round(dt.minute / 15.0) * 15 - dt.minute
-    return frappe.utils.add_to_date(
-        dt.replace(second=0, microsecond=0), minutes=delta, as_datetime=True
-    )
+    return dt.replace(second=0, microsecond=0) + timedelta(minutes=delta)
+
+
+def hours_between(from_time, to_time):
+    """Durée en heures entre deux datetimes (équivalent de
+    frappe.utils.time_diff_in_hours, sans conversion quand ils sont déjà typés)."""
+    if type(from_time) is not datetime:
+        from_time = frappe.utils.get_datetime(from_time)
+    if type(to_time) is not datetime:
+        to_time = frappe.utils.get_datetime(to_time)
+    return round((to_time - from_time).total_seconds() / 3600, 6)